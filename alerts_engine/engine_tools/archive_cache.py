@@ -0,0 +1,166 @@
+"""
+archive_cache.py provides CachedArchive, a caching layer in front of the
+archiver client.
+
+Responses are kept per (PV, start, end, options) request with least recently
+used eviction and a time to live. Identical requests made while a fetch is
+still in flight wait for that fetch instead of sending their own, so scan
+groups and other callers asking for the same data during an alert storm
+cost the archiver a single request.
+"""
+
+############
+# Standard #
+############
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+
+class CachedArchive:
+    """
+    Wraps a raw_archive.RawArchive (or anything with the same get method).
+    Other attributes, such as search, are passed through. Batch clients such
+    as bulk_fetch.BulkArchive can be wrapped too, as long as the batch of PVs
+    is passed as a tuple.
+
+    Attributes
+    ----------
+    hits : int
+        requests answered from the cache
+
+    coalesced : int
+        requests that waited for an identical request in flight
+
+    misses : int
+        requests sent to the archiver
+    """
+    def __init__(self, archive, ttl=30.0, max_entries=1024, clock=None):
+        """
+        Parameters
+        ----------
+        archive : raw_archive.RawArchive
+
+        ttl : float
+            Seconds a response stays valid. Defaults to 30.
+
+        max_entries : int
+            Responses kept before the least recently used is dropped.
+            Defaults to 1024.
+
+        clock : callable or None
+            returns the current time in seconds. Defaults to None,
+            time.monotonic.
+        """
+        self.archive = archive
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock or time.monotonic
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == 'archive':
+            raise AttributeError(name)
+        return getattr(self.archive, name)
+
+    @staticmethod
+    def key(pvname, start, end, kwargs):
+        return (pvname, start, end, tuple(sorted(kwargs.items())))
+
+    def get(self, pvname, start=None, end=None, **kwargs):
+        """
+        Return the archiver data for a PV, from the cache if possible. Takes
+        the arguments of RawArchive.get.
+
+        Note
+        ----
+            Requests without an end time are relative to the time of the
+            request, so they are passed straight to the archiver.
+        """
+        if end == None:
+            return self.archive.get(pvname, start=start, end=end, **kwargs)
+
+        key = self.key(pvname, start, end, kwargs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry != None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits = self.hits + 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            if future != None:
+                self.coalesced = self.coalesced + 1
+                owner = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses = self.misses + 1
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = self.archive.get(pvname, start=start, end=end, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (self.clock() + self.ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(data)
+        return data
+
+    def purge(self):
+        """
+        Drop the expired responses.
+
+        Returns
+        -------
+        int
+            number of responses dropped
+        """
+        now = self.clock()
+        with self._lock:
+            expired = [
+                key for key, (expires, _) in self._entries.items()
+                if expires <= now
+            ]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def clear(self):
+        """
+        Drop every cached response.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
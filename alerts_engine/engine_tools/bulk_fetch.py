@@ -0,0 +1,156 @@
+"""
+bulk_fetch.py retrieves the data of many PVs from the archiver in a single
+request, through the retrieval service's getDataForPVs.json endpoint.
+
+The response is split back into one structured array per PV, as returned by
+raw_archive.RawArchive, or one xarray.DataArray per PV in the format of
+archapp's EpicsArchive.get, so callers can't tell a bulk retrieval from a
+series of single PV requests.
+"""
+
+############
+# Standard #
+############
+import logging
+import json
+import urllib.parse
+import urllib.request
+
+###############
+# Third Party #
+###############
+from archapp import config
+from archapp.data import date_spec, make_xarray
+from archapp.url import arch_url
+
+##########
+# Custom #
+##########
+from .raw_archive import raw_samples
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+BULK_URL = "/retrieval/data/getDataForPVs.json"
+
+
+def batches(names, size):
+    """
+    Split a list of PV names into consecutive batches.
+
+    Parameters
+    ----------
+    names : list of strings
+
+    size : int
+        maximum number of names per batch
+
+    Returns
+    -------
+    list of lists of strings
+    """
+    return [names[i:i + size] for i in range(0, len(names), size)]
+
+
+class BulkArchive:
+    """
+    Multi PV client for the archiver retrieval service.
+    """
+    def __init__(self, hostname=config.hostname, data_port=config.data_port,
+                 timeout=30.0):
+        """
+        Parameters
+        ----------
+        hostname : string
+            archiver host
+
+        data_port : int
+            port of the retrieval service
+
+        timeout : float
+            Seconds to wait on the connection before the request fails.
+            Defaults to 30.
+        """
+        self.base_url = arch_url(hostname, data_port, BULK_URL)
+        self.timeout = timeout
+
+    def url(self, pvs, start, end):
+        """
+        Return the request url for a batch of PVs.
+
+        Parameters
+        ----------
+        pvs : list of strings
+
+        start : datetime.datetime
+            local start time
+
+        end : datetime.datetime
+            local end time
+
+        Returns
+        -------
+        string
+        """
+        query = [('pv', pv) for pv in pvs]
+        query.append(('from', date_spec(start)))
+        query.append(('to', date_spec(end)))
+        query.append(('donotchunk', ''))
+        return self.base_url + '?' + urllib.parse.urlencode(query)
+
+    def get_raw(self, pvs, start, end):
+        """
+        Request a batch of PVs.
+
+        Returns
+        -------
+        list of dicts
+            one {meta, data} entry per PV with data, see
+            archapp.data.ArchiveData.get_raw
+        """
+        # urllib's timeout rather than archapp's get_json, which relies on
+        # SIGALRM and so only works from the main thread
+        with urllib.request.urlopen(
+                self.url(pvs, start, end), timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def get(self, pvs, start, end, xarray=False):
+        """
+        Request a batch of PVs and split the response per PV.
+
+        Parameters
+        ----------
+        pvs : list of strings
+
+        start : datetime.datetime
+
+        end : datetime.datetime
+
+        xarray : bool
+            If True, return xarray.DataArrays, otherwise
+            raw_archive.SAMPLE_DTYPE arrays. Defaults to False.
+
+        Returns
+        -------
+        dict
+            keyed by PV name, with an entry for every requested PV. PVs
+            without data in the window get an empty array, like a single PV
+            request, so callers can tell them from PVs that failed.
+        """
+        pv_data = {}
+        for entry in self.get_raw(pvs, start, end):
+            try:
+                name = entry['meta']['name']
+            except (KeyError, TypeError):
+                logger.warning("unexpected bulk archiver entry")
+                continue
+            if xarray:
+                pv_data[name] = make_xarray(entry)
+            else:
+                pv_data[name] = raw_samples(entry)
+        for name in pvs:
+            if name not in pv_data:
+                pv_data[name] = make_xarray({}) if xarray else raw_samples({})
+        return pv_data
@@ -0,0 +1,184 @@
+"""
+digest.py provides NotificationDigest, which groups the alerts tripped for
+each recipient into a single message.
+
+Sending one email per alert floods the subscribers of many alerts when they
+trip together and costs an SMTP transaction per alert. The scan adds every
+notifiable alert to the digest instead and sends what is due: with the
+default window of 0 each recipient gets one message per scan, with a window
+of N seconds the alerts tripped for a recipient within N seconds of the first
+one are collected into the same message, across scans and scan classes.
+"""
+
+############
+# Standard #
+############
+import logging
+import threading
+import time
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+
+class NotificationDigest:
+    """
+    Collects tripped alerts per recipient until their digest is due.
+    """
+    def __init__(self, window=0.0, clock=time.monotonic):
+        """
+        Parameters
+        ----------
+        window : float
+            Seconds a recipient's digest stays open after its first alert.
+            Defaults to 0 (every flush sends what was added).
+
+        clock : callable
+            returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.window = window
+        self.clock = clock
+        self._lock = threading.Lock()
+        # recipient to (opening time, list of (alert name, triggers, time,
+        # event, note))
+        self._pending = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, recipients, alert_name, trigger_names, tripped_time,
+            event='tripped', note=None):
+        """
+        Add a tripped alert to the digest of each of its recipients.
+
+        Parameters
+        ----------
+        recipients : iterable of strings
+            email addresses, duplicates are ignored
+
+        alert_name : string
+
+        trigger_names : list of strings
+            the alert's tripped triggers
+
+        tripped_time : datetime.datetime
+            time of the scan that tripped the alert
+
+        event : string
+            what happened to the triggers, e.g. 'flapping'. Defaults to
+            'tripped'.
+
+        note : string or None
+            line shown under the alert's name. Defaults to None.
+        """
+        entry = (alert_name, list(trigger_names), tripped_time, event, note)
+        now = self.clock()
+        with self._lock:
+            for recipient in set(recipients):
+                if not recipient:
+                    continue
+                self._pending.setdefault(recipient, (now, []))[1].append(
+                    entry)
+
+    def due(self, force=False):
+        """
+        Remove and return the digests whose window has run out.
+
+        Parameters
+        ----------
+        force : bool
+            Return every pending digest, e.g. on shutdown. Defaults to False.
+
+        Returns
+        -------
+        list of tuples
+            (recipient, subject, body) for email_wrapper.build_message or
+            outbox.NotificationOutbox.enqueue
+        """
+        now = self.clock()
+        with self._lock:
+            recipients = [
+                recipient
+                for recipient, (opened, _) in self._pending.items()
+                if force or now - opened >= self.window
+            ]
+            digests = [
+                (recipient, self._pending.pop(recipient)[1])
+                for recipient in sorted(recipients)
+            ]
+        return [
+            (recipient, self.subject(entries), self.body(entries))
+            for recipient, entries in digests
+        ]
+
+    def flush(self, emailer, outbox=None, force=False):
+        """
+        Send the digests that are due over one SMTP connection, or queue
+        them in an outbox.
+
+        Parameters
+        ----------
+        emailer : email_wrapper.EmailWrapper
+
+        outbox : outbox.NotificationOutbox or None
+            If given, the digests are queued there instead. Defaults to None.
+
+        force : bool
+            Send every pending digest, see due. Defaults to False.
+
+        Returns
+        -------
+        int
+            number of digests sent or queued
+        """
+        notifications = self.due(force)
+        if outbox != None:
+            for notification in notifications:
+                outbox.enqueue(*notification)
+        elif notifications:
+            emailer.send_batch([
+                emailer.build_message(*notification)
+                for notification in notifications
+            ])
+        return len(notifications)
+
+    def subject(self, entries):
+        """
+        Return the subject line of a digest.
+        """
+        names = []
+        events = set()
+        for alert_name, _, _, event, _ in entries:
+            if alert_name not in names:
+                names.append(alert_name)
+            events.add(event)
+        event = events.pop() if len(events) == 1 else "changed"
+        if len(names) == 1:
+            return "EASE: {} {}".format(names[0], event)
+        return "EASE: {} alerts {}".format(len(names), event)
+
+    def body(self, entries):
+        """
+        Return the text of a digest, one section per tripped alert.
+        """
+        sections = []
+        for alert_name, trigger_names, tripped_time, event, note in entries:
+            lines = ["{} ({})".format(
+                alert_name, tripped_time.strftime("%Y-%m-%d %H:%M:%S"))]
+            if note != None:
+                lines.append(note)
+            lines.append("triggers {}:".format(event))
+            lines.extend("\t" + str(name) for name in trigger_names)
+            sections.append("\n".join(lines) + "\n")
+        return "\n".join(sections)
@@ -13,6 +13,7 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart                                           
                                
 import logging
+from contextlib import contextmanager
 
 from django.conf import settings
 
@@ -23,6 +24,10 @@ logger.setLevel(logging.DEBUG)
 class EmailWrapper:
     """
     Convenience tool for EASE's email sending
+
+    Each send opens its own SMTP connection unless a session is open. Inside
+    a session (see session) every message reuses one connection, which is
+    reestablished if the server drops it.
     """
     def __init__(self, host, host_email):
         """
@@ -39,6 +44,144 @@ class EmailWrapper:
         """
         self.host = host
         self.host_email = host_email
+        self._smtp = None
+        self._session_depth = 0
+
+    def connect(self):
+        """
+        Open a new SMTP connection to the host.
+
+        Returns
+        -------
+        smtplib.SMTP
+        """
+        return smtplib.SMTP(self.host, settings.EMAIL_PORT)
+
+    @contextmanager
+    def session(self):
+        """
+        Context manager sharing one SMTP connection between every message
+        sent inside it. Sessions may be nested, the connection is closed when
+        the outermost one exits.
+
+        Example
+        -------
+        >>> with emailer.session():
+        ...     emailer.send_text(to, 'subject', 'first')
+        ...     emailer.send_text(to, 'subject', 'second')
+        """
+        self._session_depth = self._session_depth + 1
+        try:
+            yield self
+        finally:
+            self._session_depth = self._session_depth - 1
+            if self._session_depth == 0:
+                self.close()
+
+    def close(self):
+        """
+        Close the session's connection if it is open.
+        """
+        if self._smtp != None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                self._smtp.close()
+            except OSError:
+                pass
+            self._smtp = None
+
+    def deliver(self, msg):
+        """
+        Send a prepared message, reusing the session's connection when a
+        session is open.
+
+        Parameters
+        ----------
+        msg : email.message.Message
+            message with its From and To headers set
+        """
+        if self._session_depth == 0:
+            s = self.connect()
+            try:
+                s.send_message(msg)
+            finally:
+                s.quit()
+            return
+
+        if self._smtp == None:
+            self._smtp = self.connect()
+        try:
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # the server dropped the idle connection, retry once on a new one
+            logger.debug("SMTP connection lost, reconnecting")
+            self._smtp = None
+            self._smtp = self.connect()
+            self._smtp.send_message(msg)
+
+    def build_message(self, to, subj, content, subtype='plain'):
+        """
+        Create a message ready for deliver or send_batch.
+
+        Paramters
+        ---------
+        to : string or list of strings
+            full email of intended recipient(s)
+
+        subj : string
+            subject line for email
+
+        content : string
+            text to place in email
+
+        subtype : string
+            MIME text subtype, 'plain' or 'html'. Defaults to 'plain'.
+
+        Returns
+        -------
+        email.mime.multipart.MIMEMultipart
+        """
+        msgRoot = MIMEMultipart()
+        email_part = MIMEText(content, subtype)
+        msgRoot.attach(email_part)
+
+        msgRoot['Subject'] = subj
+        msgRoot['From'] = self.host_email
+        if type(to) == list:
+            msgRoot['To'] = ",".join(to)
+        else:
+            msgRoot['To'] = to
+        return msgRoot
+
+    def send_batch(self, messages):
+        """
+        Send several messages over a single connection. A message that fails
+        is logged and skipped without interrupting the rest of the batch.
+
+        Paramters
+        ---------
+        messages : list of email.message.Message
+            see build_message
+
+        Returns
+        -------
+        list of email.message.Message
+            the messages that could not be sent
+        """
+        failed = []
+        with self.session():
+            for msg in messages:
+                try:
+                    self.deliver(msg)
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.error("failed to send '{}' to {}: {}".format(
+                        msg['Subject'], msg['To'], e))
+                    if isinstance(e, OSError):
+                        # connection is unusable, start over on the next one
+                        self.close()
+                    failed.append(msg)
+        return failed
     
     
     def send_file(self, to, subj, textfile):
@@ -69,9 +212,7 @@ class EmailWrapper:
         msg['To'] = to
                                                                                         
         # Send the message via our own SMTP server.                                     
-        s = smtplib.SMTP(self.host, settings.EMAIL_PORT)                                                      
-        s.send_message(msg)                                                             
-        s.quit()
+        self.deliver(msg)
 
 
     def send_text(self, to, subj, content):
@@ -90,22 +231,10 @@ class EmailWrapper:
             text to place in email
         """
 
-        msgRoot = MIMEMultipart()
-        text = content
-        email_part = MIMEText(text,'plain')
-        msgRoot.attach(email_part)
-        
-        msgRoot['Subject'] = subj
-        msgRoot['From'] = self.host_email
-        if type(to) == list:
-            msgRoot['To'] = ",".join(to)
-        else:
-            msgRoot['To'] = to
+        msgRoot = self.build_message(to, subj, content, 'plain')
 
         # Send the message via our own SMTP server.  
-        s = smtplib.SMTP(self.host, settings.EMAIL_PORT)  
-        s.send_message(msgRoot)    
-        s.quit()
+        self.deliver(msgRoot)
 
     def send_html(self, to, subj, content):
         """
@@ -122,23 +251,11 @@ class EmailWrapper:
         textfile : string
             html to place in email
         """
-        msgRoot = MIMEMultipart()
-        text = content
-        email_part = MIMEText(text,'html')
-        msgRoot.attach(email_part)
-        
-        msgRoot['Subject'] = subj
-        msgRoot['From'] = self.host_email
-        if type(to) == list:
-            msgRoot['To'] = ",".join(to)
-        else:
-            msgRoot['To'] = to
-            
+        msgRoot = self.build_message(to, subj, content, 'html')
  
         # Send the message via our own SMTP server.                                     
-        s = smtplib.SMTP(self.host, settings.EMAIL_HOST)                                                      
         try:
-            s.sendmail(self.host_email,to,msgRoot.as_string())
+            self.deliver(msgRoot)
         except smtplib.SMTPRecipientsRefused:                                   
             logging.error('All recipient addresses refused.')            
         except smtplib.SMTPDataError:                                           
@@ -150,8 +267,6 @@ class EmailWrapper:
         except smtplib.SMTPException:
             logging.error('SMTPlib failed to send email')
 
-        s.quit()
-
 
     def html_wrapper(self,msg):
         """
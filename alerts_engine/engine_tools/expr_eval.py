@@ -0,0 +1,130 @@
+"""
+expr_eval.py evaluates the triggers defined by an expression (see
+alert_config_app.trigger_expr) rather than a single compare/value pair.
+
+Expressions are compiled once and cached by their text, so a scan only pays
+for the numpy evaluation. ExpressionEvaluator also keeps the deadband latches
+of every trigger and PV between scans.
+"""
+
+############
+# Standard #
+############
+import logging
+import functools
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+from . import django_connect
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+django_connect.prepare()
+from alert_config_app import trigger_expr
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expression(source):
+    """
+    Compile a trigger expression, caching the result by its text.
+
+    Parameters
+    ----------
+    source : string
+
+    Returns
+    -------
+    alert_config_app.trigger_expr.Expression or None
+        None if the expression doesn't parse. The web interface rejects
+        those on save, so this only happens for rows edited by hand.
+    """
+    try:
+        return trigger_expr.parse(source)
+    except trigger_expr.ExpressionError as e:
+        logger.error("invalid trigger expression {!r}: {}".format(source, e))
+        return None
+
+
+def referenced_pvs(rows):
+    """
+    Return the PVs that a set of expression rows refer to through pv("...").
+
+    Parameters
+    ----------
+    rows : iterable of tuples
+        (pk, pv_name, expression) rows, see ScanPlan.expression_rows
+
+    Returns
+    -------
+    set of strings
+    """
+    names = set()
+    for _, _, source in rows:
+        expression = compile_expression(source)
+        if expression != None:
+            names.update(expression.pvs)
+    return names
+
+
+class ExpressionEvaluator:
+    """
+    Evaluates expression triggers and keeps their deadband state between
+    scans.
+    """
+    def __init__(self):
+        self.latches = {}
+
+    def evaluate(self, rows, samples, end_time=None, current=None):
+        """
+        Evaluate expression triggers.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            (pk, pv_name, expression) for every trigger and value_src PV
+
+        samples : dict
+            PV name to (times, values) of the scan window, for the value PVs
+            and every PV the expressions refer to
+
+        end_time : datetime.datetime or None
+            end of the scan window
+
+        current : iterable of tuples or None
+            every expression row of the current plan, evaluated or not. The
+            latches of other rows are dropped, those of rows skipped in this
+            scan (e.g. their PV failed to fetch) are kept. Defaults to None,
+            which keeps only the latches of rows.
+
+        Returns
+        -------
+        set
+            pks of the tripped triggers
+        """
+        if current == None:
+            current = rows
+        current = {tuple(row) for row in current}
+        # triggers that left the plan drop their latches
+        latches = {
+            key: state for key, state in self.latches.items()
+            if key in current
+        }
+        tripped = set()
+        for pk, name, source in rows:
+            expression = compile_expression(source)
+            if expression == None:
+                continue
+            key = (pk, name, source)
+            state = self.latches.get(key, {})
+            if expression.evaluate(samples, name, end_time, state):
+                tripped.add(pk)
+            latches[key] = state
+        self.latches = latches
+        return tripped
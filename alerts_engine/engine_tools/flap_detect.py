@@ -0,0 +1,153 @@
+"""
+flap_detect.py provides FlapDetector, which spots triggers that keep
+tripping and clearing, e.g. on a PV hovering around its threshold.
+
+Every trigger has a ring holding the times of its last N trip/clear
+transitions, N being the number of transitions that makes a trigger flap.
+All rings live in one 2D numpy array, so a scan records its transitions and
+checks the triggers that changed with a few vectorized operations. A trigger
+starts flapping once N transitions fall within the window and stops when no
+more than clear_transitions remain in it; the gap between the two keeps a
+trigger from flapping in and out of the flapping state itself.
+"""
+
+############
+# Standard #
+############
+import logging
+import datetime
+import threading
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+
+class FlapDetector:
+    """
+    Tracks the trip/clear transitions of triggers over a sliding window.
+    """
+    def __init__(self, window=600.0, transitions=6, clear_transitions=None):
+        """
+        Parameters
+        ----------
+        window : float
+            Length of the sliding window in seconds. Defaults to 600.
+
+        transitions : int
+            Transitions within the window that make a trigger flap, at least
+            2. Defaults to 6.
+
+        clear_transitions : int or None
+            A flapping trigger stabilizes once no more than this many
+            transitions remain within the window. Defaults to None, which
+            uses half of transitions.
+        """
+        self.window = window
+        self.transitions = max(int(transitions), 2)
+        if clear_transitions == None:
+            clear_transitions = self.transitions // 2
+        self.clear_transitions = min(
+            int(clear_transitions), self.transitions - 1)
+        self._lock = threading.Lock()
+        # trigger pk to its row in the arrays below
+        self._rows = {}
+        self._pks = []
+        self._times = np.full((0, self.transitions), -np.inf)
+        self._heads = np.zeros(0, dtype=np.int32)
+        self._levels = np.zeros(0, dtype=bool)
+        self._known = np.zeros(0, dtype=bool)
+        self._flapping = np.zeros(0, dtype=bool)
+
+    def _grow(self, pks):
+        """
+        Give rows to the triggers seen for the first time.
+        """
+        new = [pk for pk in pks if pk not in self._rows]
+        if not new:
+            return
+        for pk in new:
+            self._rows[pk] = len(self._pks)
+            self._pks.append(pk)
+        n = len(new)
+        self._times = np.concatenate(
+            [self._times, np.full((n, self.transitions), -np.inf)])
+        self._heads = np.concatenate(
+            [self._heads, np.zeros(n, dtype=np.int32)])
+        self._levels = np.concatenate([self._levels, np.zeros(n, dtype=bool)])
+        self._known = np.concatenate([self._known, np.zeros(n, dtype=bool)])
+        self._flapping = np.concatenate(
+            [self._flapping, np.zeros(n, dtype=bool)])
+
+    @property
+    def flapping(self):
+        """
+        set of int : pks of the triggers flapping at the last update
+        """
+        with self._lock:
+            return {self._pks[row] for row in np.flatnonzero(self._flapping)}
+
+    def update(self, evaluated_pks, tripped_pks, now):
+        """
+        Record the result of a scan.
+
+        Parameters
+        ----------
+        evaluated_pks : iterable of int
+            triggers evaluated in the scan
+
+        tripped_pks : iterable of int
+            the evaluated triggers that tripped
+
+        now : datetime.datetime or float
+            time of the scan, or seconds since the epoch
+
+        Returns
+        -------
+        tuple of sets
+            pks of the triggers that started flapping and of those that
+            stopped
+        """
+        if isinstance(now, datetime.datetime):
+            now = now.timestamp()
+        evaluated = list(evaluated_pks)
+        tripped = set(tripped_pks)
+        with self._lock:
+            self._grow(evaluated)
+            rows = np.array(
+                [self._rows[pk] for pk in evaluated], dtype=np.intp)
+            levels = np.array([pk in tripped for pk in evaluated], dtype=bool)
+
+            # the first evaluation of a trigger isn't a transition
+            changed = rows[self._known[rows] & (self._levels[rows] != levels)]
+            self._times[changed, self._heads[changed]] = now
+            self._heads[changed] = (self._heads[changed] + 1) % self.transitions
+            self._levels[rows] = levels
+            self._known[rows] = True
+
+            # only the triggers that moved can start flapping, the flapping
+            # ones stabilize as their transitions leave the window
+            checked = np.union1d(changed, np.flatnonzero(self._flapping))
+            counts = (self._times[checked] > now - self.window).sum(axis=1)
+            flapping = self._flapping[checked]
+            starting = checked[~flapping & (counts >= self.transitions)]
+            stopping = checked[flapping & (counts <= self.clear_transitions)]
+            self._flapping[starting] = True
+            self._flapping[stopping] = False
+
+            started = {self._pks[row] for row in starting}
+            stopped = {self._pks[row] for row in stopping}
+        if started or stopped:
+            logger.info("{} triggers started flapping, {} stopped".format(
+                len(started), len(stopped)))
+        return started, stopped
@@ -0,0 +1,326 @@
+"""
+live_monitor.py provides push-based ingestion of PV values as an alternative
+to polling the archiver.
+
+A PvSource delivers value updates for subscribed PVs. LiveMonitor subscribes
+to every PV of the current scan plan and, on each update, evaluates only the
+triggers watching the PV that changed, notifying through the same path as
+TriggerScan.scanTask.
+
+Two sources are provided: EpicsPvSource monitors PVs through Channel Access
+(requires pyepics) and SimulatedPvSource lets tests and demos push values by
+hand.
+
+Only comparison triggers are monitored. Expression triggers need the sample
+history of the archiver (durations, other PVs), they are skipped with a
+warning and must be scanned by a polling engine.
+"""
+
+############
+# Standard #
+############
+import logging
+import datetime
+import threading
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+from . import trigger_eval
+from . import scan_plan
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+
+class PvSource:
+    """
+    Interface for sources pushing PV value updates.
+
+    Subclasses call the callback registered through subscribe with
+    (name, timestamp, value) for every update, where timestamp is a naive
+    local datetime.datetime. Callbacks may arrive on any thread.
+    """
+    def subscribe(self, name, callback):
+        """
+        Start delivering updates of a PV to callback.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+
+        callback : callable
+            called with (name, timestamp, value)
+        """
+        raise NotImplementedError
+
+    def unsubscribe(self, name):
+        """
+        Stop delivering updates of a PV.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Drop every subscription.
+        """
+        for name in list(self.subscriptions()):
+            self.unsubscribe(name)
+
+    def subscriptions(self):
+        """
+        Return the names of the subscribed PVs.
+
+        Returns
+        -------
+        list of strings
+        """
+        raise NotImplementedError
+
+
+class SimulatedPvSource(PvSource):
+    """
+    Local stand-in for live PVs. Values are injected with put and delivered
+    synchronously to the subscriber.
+    """
+    def __init__(self):
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, callback):
+        with self._lock:
+            self._callbacks[name] = callback
+
+    def unsubscribe(self, name):
+        with self._lock:
+            self._callbacks.pop(name, None)
+
+    def subscriptions(self):
+        with self._lock:
+            return list(self._callbacks)
+
+    def put(self, name, value, timestamp=None):
+        """
+        Publish a new value for a PV.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+
+        value : float
+
+        timestamp : datetime.datetime or None
+            defaults to the current time
+        """
+        if timestamp == None:
+            timestamp = datetime.datetime.now()
+        with self._lock:
+            callback = self._callbacks.get(name)
+        if callback != None:
+            callback(name, timestamp, value)
+
+
+class EpicsPvSource(PvSource):
+    """
+    Channel Access monitors through pyepics.
+    """
+    def __init__(self):
+        try:
+            import epics
+        except ImportError:
+            raise ImportError(
+                "EpicsPvSource requires pyepics, install it or use the "
+                "archiver polling mode"
+            )
+        self._epics = epics
+        self._pvs = {}
+
+    def subscribe(self, name, callback):
+        def relay(pvname=None, value=None, timestamp=None, **kwargs):
+            if timestamp == None:
+                timestamp = datetime.datetime.now()
+            else:
+                timestamp = datetime.datetime.fromtimestamp(timestamp)
+            callback(name, timestamp, value)
+
+        self._pvs[name] = self._epics.PV(
+            name,
+            callback = relay,
+            auto_monitor = True,
+        )
+
+    def unsubscribe(self, name):
+        pv = self._pvs.pop(name, None)
+        if pv != None:
+            pv.clear_callbacks()
+            pv.disconnect()
+
+    def subscriptions(self):
+        return list(self._pvs)
+
+
+class LiveMonitor:
+    """
+    Evaluates triggers as soon as one of their PVs changes.
+    """
+    def __init__(self, scanner, source, loop=None):
+        """
+        Parameters
+        ----------
+        scanner : record_scanner.TriggerScan
+            provides PV resolution and the notification path
+
+        source : PvSource
+            delivers the PV updates
+
+        loop : asyncio.AbstractEventLoop or None
+            If given, updates are handed over to this loop (e.g. the
+            scheduler_async.EventMgr loop) and evaluated there, whatever
+            thread the source calls back on. Otherwise updates are evaluated
+            on the calling thread. Defaults to None.
+        """
+        self.scanner = scanner
+        self.source = source
+        self.loop = loop
+        self.plan = None
+        self.evaluators = {}
+        # PV name to the pks of its triggers, and of those tripped by the
+        # PV's last update
+        self.watching = {}
+        self.tripped = {}
+        # refresh runs on the scheduler's worker threads, evaluate on the
+        # loop or the source's thread
+        self._lock = threading.Lock()
+
+    def refresh(self, plan=None):
+        """
+        Load the current triggers and update the subscriptions to match.
+
+        Parameters
+        ----------
+        plan : scan_plan.ScanPlan or None
+            Defaults to None, which takes the scanner's current plan. It is
+            only reloaded from the database when the configuration changed.
+        """
+        if plan == None:
+            plan = self.scanner.plans.get()
+
+        shard = getattr(self.scanner, 'shard', None)
+        if shard != None:
+            shard.refresh()
+
+        rows = {}
+        for row in plan.trigger_rows():
+            if shard != None and not shard.owns(row[1]):
+                continue
+            rows.setdefault(row[1], []).append(row)
+        evaluators = {
+            name: trigger_eval.TriggerEvaluator(pv_rows)
+            for name, pv_rows in rows.items()
+        }
+
+        watching = {
+            name: {row[0] for row in pv_rows}
+            for name, pv_rows in rows.items()
+        }
+
+        current = set(self.source.subscriptions())
+        for name in current - set(evaluators):
+            self.source.unsubscribe(name)
+        if plan is not self.plan:
+            expressions = {row[0] for row in plan.expression_rows()}
+            if expressions:
+                logger.warning(
+                    "{} expression triggers aren't evaluated in live mode"
+                    .format(len(expressions)))
+        with self._lock:
+            if plan is not self.plan:
+                # trigger pks of the previous plan may be gone
+                self.tripped = {}
+            else:
+                # PVs given to another shard keep no tripped triggers
+                self.tripped = {
+                    name: tripped & watching[name]
+                    for name, tripped in self.tripped.items()
+                    if name in watching
+                }
+            self.plan = plan
+            self.evaluators = evaluators
+            self.watching = watching
+        for name in set(evaluators) - current:
+            self.source.subscribe(name, self.on_update)
+        logger.debug("monitoring {} PVs".format(len(evaluators)))
+
+    def task(self, target_time=None, *args, **kwargs):
+        """
+        Periodic task for scheduler_async.EventMgr: keeps the subscriptions
+        in line with the configured triggers and sends the notification
+        digests whose window ran out since the last update.
+        """
+        self.refresh()
+        self.scanner.flushDigest()
+
+    def on_update(self, name, timestamp, value):
+        """
+        Callback registered with the source.
+        """
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(
+                self.evaluate, name, timestamp, value)
+        else:
+            self.evaluate(name, timestamp, value)
+
+    def evaluate(self, name, timestamp, value):
+        """
+        Evaluate the triggers watching a PV against its new value. Only when
+        the set of tripped triggers changed are the alerts' statuses
+        advanced, with the triggers of every PV updated so far, notifying
+        the alerts that became active.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+
+        timestamp : datetime.datetime
+
+        value : float
+
+        Returns
+        -------
+        list of int
+            pks of the notified alerts
+        """
+        with self._lock:
+            evaluator = self.evaluators.get(name)
+            if evaluator == None:
+                return []
+            try:
+                tripped = evaluator.evaluate({name: [value]})
+            except (TypeError, ValueError):
+                logger.debug(
+                    "non numeric update for {}: {}".format(name, value))
+                return []
+            if tripped == self.tripped.get(name):
+                return []
+            logger.debug("{} tripped {} triggers".format(name, len(tripped)))
+            self.tripped[name] = tripped
+            return self.scanner.notify(
+                self.plan,
+                set().union(*self.tripped.values()),
+                timestamp,
+                set().union(*(self.watching[pv] for pv in self.tripped)),
+            )
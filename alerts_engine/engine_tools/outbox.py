@@ -0,0 +1,323 @@
+"""
+outbox.py provides NotificationOutbox, a persistent queue decoupling the
+scan loop from mail delivery.
+
+The scan only enqueues notifications, which is a single local write. Worker
+threads drain the queue through their own SMTP sessions, retrying failed
+messages with exponential backoff. The queue lives in a SQLite file so
+notifications that were not delivered yet survive an engine restart.
+"""
+
+############
+# Standard #
+############
+import logging
+import json
+import sqlite3
+import threading
+import time
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+from . import email_wrapper
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+SENDING = 'sending'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    subtype TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+"""
+
+
+class NotificationOutbox:
+    """
+    Persistent notification queue drained by a pool of worker threads.
+    """
+    def __init__(self, emailer, path=":memory:", workers=2, max_attempts=8,
+                 backoff=30.0, max_backoff=3600.0, batch_size=50):
+        """
+        Parameters
+        ----------
+        emailer : email_wrapper.EmailWrapper
+            Provides the SMTP host and sender. Every worker opens its own
+            connection to that host.
+
+        path : string
+            SQLite database file holding the queue. Defaults to ":memory:",
+            which does not survive a restart.
+
+        workers : int
+            number of delivery threads. Defaults to 2.
+
+        max_attempts : int
+            Deliveries attempted before a notification is marked failed and
+            left in the queue for inspection. Defaults to 8.
+
+        backoff : float
+            Seconds before the first retry, doubled on every further attempt.
+            Defaults to 30.
+
+        max_backoff : float
+            upper limit for the retry delay in seconds. Defaults to 3600.
+
+        batch_size : int
+            notifications a worker claims and sends per SMTP session.
+            Defaults to 50.
+        """
+        self.emailer = emailer
+        self.path = path
+        self.n_workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            # anything in flight when the engine stopped is sent again
+            self._db.execute(
+                "UPDATE outbox SET status = ? WHERE status = ?",
+                (QUEUED, SENDING),
+            )
+
+    def enqueue(self, to, subj, content, subtype='plain'):
+        """
+        Queue a notification for delivery.
+
+        Parameters
+        ----------
+        to : string or list of strings
+            recipient email address(es)
+
+        subj : string
+            subject line
+
+        content : string
+            message body
+
+        subtype : string
+            MIME text subtype, 'plain' or 'html'. Defaults to 'plain'.
+
+        Returns
+        -------
+        int
+            id of the queued notification
+        """
+        if type(to) != list:
+            to = [to]
+        now = time.time()
+        with self._wakeup:
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT INTO outbox (recipients, subject, body, subtype, "
+                    "status, next_attempt, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (json.dumps(to), subj, content, subtype, QUEUED, now, now),
+                )
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def pending(self):
+        """
+        Return the number of notifications not delivered yet, excluding those
+        that exhausted their attempts.
+
+        Returns
+        -------
+        int
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status != ?", (FAILED,)
+            ).fetchone()[0]
+
+    def failed(self):
+        """
+        Return the notifications that exhausted their delivery attempts.
+
+        Returns
+        -------
+        list of tuples
+            (id, recipients, subject, last_error)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, recipients, subject, last_error FROM outbox "
+                "WHERE status = ? ORDER BY id", (FAILED,)
+            ).fetchall()
+        return [(i, json.loads(to), subj, err) for i, to, subj, err in rows]
+
+    def _claim(self):
+        """
+        Mark up to batch_size due notifications as being sent and return
+        them.
+        """
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id, recipients, subject, body, subtype, attempts "
+                "FROM outbox WHERE status = ? AND next_attempt <= ? "
+                "ORDER BY next_attempt, id LIMIT ?",
+                (QUEUED, time.time(), self.batch_size),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE outbox SET status = ? WHERE id = ?",
+                [(SENDING, row[0]) for row in rows],
+            )
+        return rows
+
+    def _next_due(self):
+        """
+        Return seconds until the next queued notification is due, or None if
+        the queue is empty.
+        """
+        row = self._db.execute(
+            "SELECT MIN(next_attempt) FROM outbox WHERE status = ?", (QUEUED,)
+        ).fetchone()
+        if row[0] == None:
+            return None
+        return max(row[0] - time.time(), 0)
+
+    def _finish(self, sent, retry):
+        """
+        Remove delivered notifications and reschedule failed ones.
+        """
+        now = time.time()
+        updates = []
+        for job_id, attempts, error in retry:
+            if attempts >= self.max_attempts:
+                logger.error("giving up on notification {}: {}".format(
+                    job_id, error))
+                updates.append((FAILED, now, attempts, error, job_id))
+            else:
+                delay = min(
+                    self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                updates.append((QUEUED, now + delay, attempts, error, job_id))
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM outbox WHERE id = ?", [(i,) for i in sent])
+            self._db.executemany(
+                "UPDATE outbox SET status = ?, next_attempt = ?, "
+                "attempts = ?, last_error = ? WHERE id = ?",
+                updates,
+            )
+
+    def drain(self, emailer=None):
+        """
+        Deliver every notification that is currently due.
+
+        Parameters
+        ----------
+        emailer : email_wrapper.EmailWrapper or None
+            Defaults to None, which uses a new connection to the outbox's
+            emailer host.
+
+        Returns
+        -------
+        int
+            number of notifications delivered
+        """
+        if emailer == None:
+            emailer = email_wrapper.EmailWrapper(
+                self.emailer.host, self.emailer.host_email)
+        delivered = 0
+        while True:
+            rows = self._claim()
+            if not rows:
+                return delivered
+            sent = []
+            retry = []
+            with emailer.session():
+                for job_id, to, subj, body, subtype, attempts in rows:
+                    msg = emailer.build_message(
+                        json.loads(to), subj, body, subtype)
+                    try:
+                        emailer.deliver(msg)
+                        sent.append(job_id)
+                    except Exception as e:
+                        logger.warning(
+                            "notification {} failed: {}".format(job_id, e))
+                        emailer.close()
+                        retry.append((job_id, attempts + 1, str(e)))
+            self._finish(sent, retry)
+            delivered = delivered + len(sent)
+
+    def _work(self):
+        emailer = email_wrapper.EmailWrapper(
+            self.emailer.host, self.emailer.host_email)
+        while not self._stop.is_set():
+            try:
+                self.drain(emailer)
+            except Exception:
+                logger.exception("outbox worker error")
+            with self._wakeup:
+                if self._stop.is_set():
+                    return
+                self._wakeup.wait(self._next_due())
+
+    def start(self):
+        """
+        Start the delivery threads.
+        """
+        self._stop.clear()
+        for i in range(self.n_workers):
+            thread = threading.Thread(
+                target = self._work,
+                name = "outbox:{}".format(i),
+                daemon = True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stop the delivery threads once they finish their current batch.
+        Queued notifications stay in the database.
+
+        Parameters
+        ----------
+        timeout : float or None
+            seconds to wait for each thread
+        """
+        with self._wakeup:
+            self._stop.set()
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def close(self):
+        """
+        Stop the workers and close the database.
+        """
+        self.stop()
+        with self._lock:
+            self._db.close()
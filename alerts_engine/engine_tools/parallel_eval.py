@@ -0,0 +1,247 @@
+"""
+parallel_eval.py spreads trigger evaluation over a pool of processes so large
+trigger sets are not limited to the one core the GIL allows.
+
+The scan's sample arrays are packed into a single file backed by shared
+memory (/dev/shm where available) that the workers map read-only, so only
+the file path, the per-PV offsets and the trigger rows are pickled. The
+triggers are split into batches by PV, so each PV is reduced by a single
+worker, and the tripped trigger sets of the batches are merged.
+
+The engine runs scans, mail delivery and sharding from several threads, and
+forking a multithreaded process can copy locks held by other threads into
+the workers. The pool starts its workers from a forkserver instead.
+"""
+
+############
+# Standard #
+############
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Custom #
+##########
+from . import trigger_eval
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+SHM_DIR = '/dev/shm'
+
+
+class SharedSamples:
+    """
+    The sample values of several PVs packed into one shared memory mapping.
+
+    Attributes
+    ----------
+    path : string
+        file backing the mapping
+
+    offsets : dict
+        {pv name: (start, stop)} slice of each PV in the mapping
+    """
+    def __init__(self, samples):
+        """
+        Parameters
+        ----------
+        samples : dict
+            {pv name: numpy.ndarray of sample values}
+        """
+        self.offsets = {}
+        position = 0
+        for name, values in samples.items():
+            self.offsets[name] = (position, position + len(values))
+            position = position + len(values)
+        self.length = position
+
+        directory = SHM_DIR if os.path.isdir(SHM_DIR) else None
+        fd, self.path = tempfile.mkstemp(
+            prefix='ease-samples-', dir=directory)
+        os.close(fd)
+        if self.length:
+            mapping = np.memmap(
+                self.path, dtype=float, mode='w+', shape=(self.length,))
+            for name, (start, stop) in self.offsets.items():
+                mapping[start:stop] = samples[name]
+            mapping.flush()
+            del mapping
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Remove the backing file. Mappings already open stay valid.
+        """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def open_samples(path, length, offsets):
+    """
+    Map a SharedSamples file read-only.
+
+    Returns
+    -------
+    dict
+        {pv name: numpy.ndarray view of its samples}
+    """
+    if not length:
+        return {name: np.zeros(0) for name in offsets}
+    mapping = np.memmap(path, dtype=float, mode='r', shape=(length,))
+    return {
+        name: mapping[start:stop] for name, (start, stop) in offsets.items()
+    }
+
+
+def evaluate_batch(path, length, offsets, rows):
+    """
+    Evaluate a batch of trigger rows against shared samples. Runs in the
+    worker processes.
+
+    Parameters
+    ----------
+    path, length, offsets :
+        describe a SharedSamples mapping
+
+    rows : list of tuples
+        (pk, pv_name, compare, value) rows, see TriggerEvaluator
+
+    Returns
+    -------
+    set of int
+        pks of the tripped triggers
+    """
+    evaluator = trigger_eval.TriggerEvaluator(rows)
+    samples = open_samples(path, length, offsets)
+    return evaluator.evaluate(samples)
+
+
+def split_rows(rows, batches):
+    """
+    Split trigger rows into batches of roughly equal size, keeping the rows
+    of a PV together.
+
+    Parameters
+    ----------
+    rows : list of tuples
+        (pk, pv_name, compare, value)
+
+    batches : int
+        maximum number of batches
+
+    Returns
+    -------
+    list of lists of tuples
+    """
+    by_pv = {}
+    for row in rows:
+        by_pv.setdefault(row[1], []).append(row)
+    groups = sorted(by_pv.values(), key=len, reverse=True)
+    split = [[] for _ in range(min(batches, len(groups)))]
+    # largest PVs first, each into the currently smallest batch
+    for group in groups:
+        min(split, key=len).extend(group)
+    return split
+
+
+class ParallelEvaluator:
+    """
+    Evaluates trigger rows in a process pool. One evaluator may be shared by
+    several scanners running on different threads.
+    """
+    def __init__(self, processes=None, min_rows=2000,
+                 start_method='forkserver'):
+        """
+        Parameters
+        ----------
+        processes : int or None
+            Size of the process pool. Defaults to None, the number of cores.
+
+        min_rows : int
+            Scans with fewer trigger rows are evaluated in this process, where
+            they are cheaper than the hand off to the pool. Defaults to 2000.
+
+        start_method : string
+            multiprocessing start method of the workers, 'forkserver' or
+            'spawn'. Defaults to 'forkserver'.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.min_rows = min_rows
+        self.start_method = start_method
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # started on first use, only if a scan is large enough to need it
+        with self._lock:
+            if self._pool == None:
+                self._pool = multiprocessing.get_context(
+                    self.start_method).Pool(self.processes)
+            return self._pool
+
+    def evaluate(self, rows, samples):
+        """
+        Evaluate trigger rows against the samples of their PVs.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            (pk, pv_name, compare, value) rows, see TriggerEvaluator
+
+        samples : dict
+            {pv name: numpy.ndarray of sample values}
+
+        Returns
+        -------
+        set of int
+            pks of the tripped triggers
+        """
+        rows = list(rows)
+        if len(rows) < self.min_rows or self.processes < 2:
+            return trigger_eval.TriggerEvaluator(rows).evaluate(samples)
+
+        tripped = set()
+        with SharedSamples(samples) as shared:
+            results = [
+                self.pool.apply_async(evaluate_batch, (
+                    shared.path,
+                    shared.length,
+                    {name: shared.offsets[name]
+                     for name in {row[1] for row in batch}
+                     if name in shared.offsets},
+                    batch,
+                ))
+                for batch in split_rows(rows, self.processes)
+            ]
+            for result in results:
+                tripped.update(result.get())
+        return tripped
+
+    def close(self):
+        """
+        Shut the process pool down once its pending batches are done.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool != None:
+            pool.close()
+            pool.join()
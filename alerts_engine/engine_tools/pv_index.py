@@ -0,0 +1,148 @@
+"""
+pv_index.py resolves the PV names watched by triggers.
+
+Trigger.value_src holds a comma separated list of PV names written by the
+web interface (see saveTriggerPVs in pv_search.js). Entries may be archiver
+glob patterns, which are expanded through the archiver's PV search and cached
+for a limited time so that each pattern costs at most one search per TTL
+regardless of how many triggers use it.
+"""
+
+############
+# Standard #
+############
+import logging
+import time
+
+###############
+# Third Party #
+###############
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+# characters marking a value_src entry as an archiver glob pattern
+GLOB_CHARS = ('*', '?')
+
+
+def parse_value_src(value_src):
+    """
+    Split a Trigger.value_src string into its entries.
+
+    Parameters
+    ----------
+    value_src : string or None
+        comma separated PV names or glob patterns
+
+    Returns
+    -------
+    list of strings
+        stripped, non-empty entries in their original order
+    """
+    if not value_src:
+        return []
+    return [entry.strip() for entry in value_src.split(",") if entry.strip()]
+
+
+def is_glob(name):
+    """
+    Return whether a value_src entry is a glob pattern.
+
+    Parameters
+    ----------
+    name : string
+
+    Returns
+    -------
+    bool
+    """
+    return any(char in name for char in GLOB_CHARS)
+
+
+class PvIndex:
+    """
+    Resolves value_src strings into concrete PV names, caching glob
+    expansions.
+    """
+    def __init__(self, search, ttl=600):
+        """
+        Parameters
+        ----------
+        search : callable
+            Receives a glob pattern and returns the list of matching PV names,
+            e.g. raw_archive.RawArchive.search
+
+        ttl : float
+            Seconds a glob expansion is reused before the archiver is asked
+            again. Defaults to 600.
+        """
+        self.search = search
+        self.ttl = ttl
+        self._globs = {}
+
+    def expand(self, pattern):
+        """
+        Return the PV names matched by a value_src entry.
+
+        Plain names are returned as they are. Glob patterns are expanded
+        through search and cached for ttl seconds. If a refresh fails the
+        stale expansion is kept rather than dropping the PVs from the scan.
+
+        Parameters
+        ----------
+        pattern : string
+            PV name or glob pattern
+
+        Returns
+        -------
+        list of strings
+        """
+        if not is_glob(pattern):
+            return [pattern]
+        now = time.monotonic()
+        cached = self._globs.get(pattern)
+        if cached != None and now < cached[0]:
+            return cached[1]
+        try:
+            names = list(self.search(pattern) or [])
+        except Exception as e:
+            logger.error("PV search failed for {}: {}".format(pattern, e))
+            if cached != None:
+                return cached[1]
+            return []
+        self._globs[pattern] = (now + self.ttl, names)
+        return names
+
+    def resolve(self, value_src):
+        """
+        Resolve a Trigger.value_src string into concrete PV names.
+
+        Parameters
+        ----------
+        value_src : string or None
+
+        Returns
+        -------
+        list of strings
+            unique PV names in the order they were listed or matched
+        """
+        names = []
+        seen = set()
+        for entry in parse_value_src(value_src):
+            for name in self.expand(entry):
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    def clear(self):
+        """
+        Forget every cached glob expansion.
+        """
+        self._globs = {}
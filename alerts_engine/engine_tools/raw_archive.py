@@ -0,0 +1,229 @@
+"""
+raw_archive.py provides RawArchive, an archiver client that returns samples
+as compact numpy structured arrays instead of xarray objects.
+
+Building a labelled xarray.DataArray for every PV and selecting the values
+back out of it costs far more than the comparisons a scan makes on the
+samples. RawArchive decodes the retrieval service's JSON straight into one
+structured array per PV with a time, val, sevr and stat field. It can still
+return archapp's xarray format for debugging.
+
+Unlike archapp's EpicsArchive, whose requests time out with SIGALRM and so
+only work from the main thread, every request goes through urllib with a
+socket timeout, so RawArchive can be used from the scanners' thread pools.
+"""
+
+############
+# Standard #
+############
+import logging
+import json
+import urllib.parse
+import urllib.request
+
+###############
+# Third Party #
+###############
+import numpy as np
+from archapp import config
+from archapp.data import GET_URL, date_spec, make_xarray
+from archapp.dates import utc_delta
+from archapp.mgmt import MGMT_URL
+from archapp.url import arch_url
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+SAMPLE_DTYPE = np.dtype([
+    ('time', 'datetime64[ns]'),
+    ('val', float),
+    ('sevr', np.int16),
+    ('stat', np.int16),
+])
+
+
+def as_floats(values):
+    """
+    Convert sample values to floats, using NaN for values that have no float
+    form (strings, waveforms).
+    """
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        converted = np.full(len(values), np.nan)
+        for i, val in enumerate(values):
+            try:
+                converted[i] = float(val)
+            except (TypeError, ValueError):
+                pass
+        return converted
+
+
+def raw_samples(data):
+    """
+    Convert one PV's archiver JSON to a structured array.
+
+    Parameters
+    ----------
+    data : dict
+        {meta, data} entry as returned by the retrieval service, see
+        archapp.data.ArchiveData.get_raw
+
+    Returns
+    -------
+    numpy.ndarray
+        SAMPLE_DTYPE array with times in local time, like archapp's xarray
+        output. Empty if the archiver returned no data.
+    """
+    points = data.get('data', ()) if isinstance(data, dict) else ()
+    samples = np.zeros(len(points), dtype=SAMPLE_DTYPE)
+    if not len(points):
+        return samples
+    secs = np.array([pt['secs'] for pt in points], dtype=np.int64)
+    nanos = np.array([pt['nanos'] for pt in points], dtype=np.int64)
+    utc = (secs * 1000000000 + nanos).astype('datetime64[ns]')
+    samples['time'] = utc - np.timedelta64(utc_delta())
+    samples['val'] = as_floats([pt['val'] for pt in points])
+    samples['sevr'] = [pt.get('severity', 0) for pt in points]
+    samples['stat'] = [pt.get('status', 0) for pt in points]
+    return samples
+
+
+class RawArchive:
+    """
+    Archiver client returning SAMPLE_DTYPE arrays.
+    """
+    def __init__(self, hostname=config.hostname, data_port=config.data_port,
+                 timeout=30.0, mgmt_port=config.mgmt_port):
+        """
+        Parameters
+        ----------
+        hostname : string
+            archiver host
+
+        data_port : int
+            port of the retrieval service
+
+        timeout : float
+            Seconds to wait on the connection before the request fails.
+            Defaults to 30.
+
+        mgmt_port : int
+            port of the management service, used by search
+        """
+        self.base_url = arch_url(hostname, data_port, GET_URL)
+        self.search_url = arch_url(hostname, mgmt_port, MGMT_URL) + 'getAllPVs'
+        self.timeout = timeout
+
+    def search(self, glob, do_print=False):
+        """
+        Return the archived PVs matching a glob pattern.
+
+        Unlike archapp's search, a failed request raises instead of returning
+        no PVs, so pv_index.PvIndex keeps the previous expansion.
+
+        Parameters
+        ----------
+        glob : string
+
+        do_print : bool
+            Also print the names, one per line. Defaults to False.
+
+        Returns
+        -------
+        list of strings
+        """
+        url = self.search_url + '?' + urllib.parse.urlencode([('pv', glob)])
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            names = json.loads(response.read().decode('utf-8'))
+        if do_print:
+            for name in names:
+                print(name)
+        return names
+
+    def url(self, pvname, start, end):
+        """
+        Return the request url for a PV's samples.
+        """
+        return self.base_url + '?' + urllib.parse.urlencode([
+            ('pv', pvname),
+            ('from', date_spec(start)),
+            ('to', date_spec(end)),
+            ('donotchunk', ''),
+        ])
+
+    def get_raw(self, pvname, start, end):
+        """
+        Request a PV's samples as the retrieval service's JSON.
+
+        Returns
+        -------
+        dict
+        """
+        # urllib's timeout rather than archapp's get_json, which relies on
+        # SIGALRM and so only works from the main thread
+        with urllib.request.urlopen(
+                self.url(pvname, start, end), timeout=self.timeout) as response:
+            data = json.loads(response.read().decode('utf-8'))
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        return data
+
+    def get(self, pvname, start=None, end=None, xarray=False):
+        """
+        Request a PV's samples.
+
+        Parameters
+        ----------
+        pvname : string
+
+        start : datetime.datetime
+
+        end : datetime.datetime
+
+        xarray : bool
+            If True, return an xarray.DataArray in the format of archapp's
+            EpicsArchive.get. Defaults to False.
+
+        Returns
+        -------
+        numpy.ndarray or xarray.DataArray
+            SAMPLE_DTYPE array unless xarray is set
+        """
+        if xarray:
+            return make_xarray(self.get_raw(pvname, start, end))
+        return raw_samples(self.get_raw(pvname, start, end))
+
+    def stream(self, pvname, start, end, chunk_size=65536):
+        """
+        Request a PV's samples and yield the response body as it arrives,
+        for stream_decode.
+
+        Parameters
+        ----------
+        pvname : string
+
+        start : datetime.datetime
+
+        end : datetime.datetime
+
+        chunk_size : int
+            bytes per yielded chunk. Defaults to 65536.
+
+        Yields
+        ------
+        bytes
+        """
+        with urllib.request.urlopen(
+                self.url(pvname, start, end), timeout=self.timeout) as response:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
@@ -9,12 +9,13 @@ import logging
 import sys
 import os
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 ###############
 # Third Party #
 ###############
 import django
-from archapp.interactive import EpicsArchive
 
 ##########
 # Custom #
@@ -23,6 +24,17 @@ from archapp.interactive import EpicsArchive
 #from .django_connect import prepare
 from . import django_connect
 from . import email_wrapper
+from . import trigger_eval
+from . import expr_eval
+from . import scan_plan
+from . import pv_index
+from . import sample_buffer
+from . import parallel_eval
+from . import bulk_fetch
+from . import raw_archive
+from . import stream_decode
+from . import server_reduce
+from . import digest as digest_module
 
 #################
 # Configuration #
@@ -34,21 +46,14 @@ from account_mgr_app.models import *
 from django.conf import settings
 
 
-
-def test_db():
-    """
-    teset db connection by scanning models in the config_app. Only intended for
-    diagnostic use
-    """
-    #print("testing")
-    for x in Alert.objects.all():
-        print("\n--+",x)
-        for y in x.trigger_set.all():
-            print('  |-->',y)
-
-
 class TriggerScan:
-    def __init__(self, hostname="pscaa02", rep_t=datetime.timedelta(minutes=1)):
+    def __init__(self, hostname="pscaa02", rep_t=datetime.timedelta(minutes=1),
+                 max_workers=None, fetch_timeout=None, glob_ttl=600,
+                 lookback=None, outbox=None, scan_classes=None, shard=None,
+                 eval_processes=None, sample_cache=None, archive=None,
+                 bulk_size=None, xarray=False, stream=False,
+                 extrema_bin=None, config_interval=0.0, digest=None,
+                 flapping=None, parallel=None, bulk=None, extrema=None):
         """
 
         Parameters
@@ -58,34 +63,188 @@ class TriggerScan:
 
         rep_t : datetime.timedelta
             specify duration of each period between scans
+
+        max_workers : int or None
+            Maximum number of archiver requests in flight at once. None, 0 or
+            1 fetch the PVs sequentially. Defaults to None.
+
+        fetch_timeout : float or None
+            Seconds a single PV's archiver request may run before it is
+            abandoned for this scan. Only applies to concurrent fetches.
+            Defaults to None (no limit).
+
+        glob_ttl : float
+            Seconds a glob pattern in a trigger's value_src stays expanded
+            before the archiver is searched again. Defaults to 600.
+
+        lookback : datetime.timedelta or None
+            Length of the window each scan evaluates. Samples are buffered
+            between scans so only those archived since the previous scan are
+            requested. Defaults to None, which uses rep_t.
+
+        outbox : outbox.NotificationOutbox or None
+            If given, notifications are queued there and delivered by its
+            workers instead of being sent from the scan. Defaults to None.
+
+        scan_classes : list of strings or None
+            Only scan the alerts in these scan classes, letting one scanner
+            per class run at its own rate. Defaults to None (every alert).
+
+        shard : sharding.ShardCoordinator or None
+            If given, only the PVs assigned to this worker are scanned and
+            the assignment is refreshed at the start of every scan. Defaults
+            to None (scan every PV).
+
+        eval_processes : int or None
+            If above 1, large trigger sets are evaluated in a pool of this
+            many processes. Defaults to None (evaluate in this process).
+
+        sample_cache : alert_config_app.sample_cache.SampleCache or None
+            If given, newly retrieved samples are also written to this
+            memory mapped cache for the web interface. Defaults to None.
+
+        archive : raw_archive.RawArchive or None
+            Archiver client to use instead of a new one for hostname, e.g. an
+            archive_cache.CachedArchive shared by several scanners. Defaults
+            to None.
+
+        bulk_size : int or None
+            If above 1, PVs are requested from the archiver in batches of up
+            to this many PVs per request. Defaults to None (one request per
+            PV).
+
+        xarray : bool
+            If True, decode samples into labelled xarray data in archapp's
+            format, which is slower but convenient when debugging. Otherwise
+            they are decoded straight into numpy structured arrays
+            (raw_archive.SAMPLE_DTYPE). Either way the requests go through
+            raw_archive.RawArchive, safe to use from worker threads. Defaults
+            to False.
+
+        stream : bool
+            If True, every scan streams each PV's whole lookback window and
+            reduces it while decoding instead of buffering samples, bounding
+            memory for long windows of fast PVs. Requires an archive with a
+            stream method, such as raw_archive.RawArchive. Defaults to False.
+
+        extrema_bin : int or None
+            If given, the archiver computes the min/max of PVs watched only
+            by extrema comparisons server side, in bins of this many seconds,
+            and only the PVs with '==' triggers are downloaded. Defaults to
+            None (download every PV).
+
+        config_interval : float
+            The scan plan is kept in memory and only reloaded when the alert
+            configuration changes. This many seconds may pass between checks
+            for a change. Defaults to 0 (check before every scan).
+
+        digest : digest.NotificationDigest or None
+            Collects the tripped alerts into one message per recipient, may
+            be shared by several scanners. Defaults to None, which sends
+            each recipient one message per scan.
+
+        flapping : flap_detect.FlapDetector or None
+            If given, alerts with a flapping trigger don't notify until they
+            stabilize, their subscribers only get one notice when they start
+            flapping. Defaults to None (no flap detection).
+
+        parallel : parallel_eval.ParallelEvaluator or None
+            Process pool shared with other scanners, used instead of one of
+            eval_processes processes. Its owner closes it. Defaults to None.
+
+        bulk : bulk_fetch.BulkArchive or None
+            Multi PV client to use for bulk_size batches instead of a new one
+            for hostname, e.g. an archive_cache.CachedArchive shared by
+            several scanners. Defaults to None.
+
+        extrema : server_reduce.ExtremaArchive or None
+            Extrema client to use when extrema_bin is set instead of a new one
+            for hostname, shared the same way as bulk. Defaults to None.
         """
         #timing info etc probs useful
-        self.arch = EpicsArchive(hostname=hostname)
+        self.xarray = xarray
+        self.stream = stream
+        if extrema_bin and extrema != None:
+            self.extrema = extrema
+        elif extrema_bin:
+            self.extrema = server_reduce.ExtremaArchive(
+                hostname,
+                bin_size = extrema_bin,
+                timeout = fetch_timeout or 30.0,
+            )
+        else:
+            self.extrema = None
+        if archive == None:
+            archive = raw_archive.RawArchive(
+                hostname,
+                timeout = fetch_timeout or 30.0,
+            )
+        self.arch = archive
+        if bulk_size != None and bulk_size > 1:
+            self.bulk_size = bulk_size
+            if bulk == None:
+                bulk = bulk_fetch.BulkArchive(
+                    hostname,
+                    timeout = fetch_timeout or 30.0,
+                )
+            self.bulk = bulk
+        else:
+            self.bulk_size = None
+            self.bulk = None
         self.rep_t = rep_t
+        self.max_workers = max_workers
+        self.fetch_timeout = fetch_timeout
+        if lookback == None:
+            lookback = rep_t
+        self.samples = sample_buffer.SampleBuffer(lookback)
+        self.pv_index = pv_index.PvIndex(
+            lambda glob: self.arch.search(glob, do_print=False),
+            ttl = glob_ttl,
+        )
         self.emailer = email_wrapper.EmailWrapper(settings.EMAIL_HOST, "EASE")
+        self.outbox = outbox
+        if digest == None:
+            digest = digest_module.NotificationDigest()
+        self.digest = digest
+        self.flapping = flapping
+        self.scan_classes = scan_classes
+        self.shard = shard
+        if parallel != None:
+            self.parallel = parallel
+        elif eval_processes != None and eval_processes > 1:
+            self.parallel = parallel_eval.ParallelEvaluator(eval_processes)
+        else:
+            self.parallel = None
+        self.sample_cache = sample_cache
+        self.expressions = expr_eval.ExpressionEvaluator()
+        self.plans = scan_plan.PlanCache(
+            self.pv_index,
+            scan_classes,
+            check_interval = config_interval,
+        )
 
     def dbPvPull(self,live=True):
         """
-        Return queryset of relevant PVs. 
+        Return the names of relevant PVs. 
 
         Parameters
         ----------
         live : bool
-            If true, filter the pvs to only those with triggers. Defaults to
-            true.
+            If true, return the PVs watched by triggers, resolved from their
+            value_src with glob patterns expanded. Otherwise return every
+            entry of the Pv table. Defaults to true.
 
         Returns
         -------
-        django.db.models.query.QuerySet (Pv type)
+        list of strings
 
         """
         if live:
-            return Pv.objects.filter(trigger__isnull=False)
+            return self.plans.get().pv_names
         else:
-            return Pv.objects.all()
+            return [pv.name for pv in Pv.objects.all()]
 
-    def archPull(self, pv_list, end_time=datetime.datetime.now(),
-                 start_time=None):
+    def archPull(self, pv_list, end_time=None, start_time=None):
         """
         return xarray of archiver data for a collection of pvs. Duration of
         data is specified by the interval (rep_t) until the current_time 
@@ -103,17 +262,19 @@ class TriggerScan:
             either be in the form of a 
         
         end_time : datetime.datetime 
-            current_time is the end time for the pulled data
+            current_time is the end time for the pulled data. Defaults to None
+            in which case the current time is used.
 
-        start_time : datetime.datetime
+        start_time : datetime.datetime or dict
             start_time is the start time for the pulled data. Defaults to None
             in which the interval set for the TriggerScan class calculates the
-            start_time. 
+            start_time. A dict maps PV names to their own start times.
 
         Returns
         -------
-        dict of xarray.DataArray
-            xarray with PV data
+        dict of numpy.ndarray or xarray.DataArray
+            xarray with PV data. PVs whose request failed, or timed out when
+            fetching concurrently, are left out of the dict.
         """
         if type(pv_list) == django.db.models.query.QuerySet:
             pv_names = []
@@ -123,60 +284,230 @@ class TriggerScan:
         if type(pv_list) == list:
             pv_names = pv_list
 
+        if end_time == None:
+            end_time = datetime.datetime.now()
+
         if start_time == None:
             start_time = end_time - self.rep_t
 
+        if isinstance(start_time, dict):
+            windows = {
+                name: (start_time[name], end_time) for name in pv_names
+            }
+        else:
+            windows = {name: (start_time, end_time) for name in pv_names}
+
+        if self.bulk != None:
+            return self.archPullBulk(windows)
+
+        if self.max_workers != None and self.max_workers > 1:
+            return self.archPullConcurrent(windows)
+
         pv_data = {}
 
-        for name in pv_names:
-            pv_data[name] = self.arch.get(
-                name,
-                xarray = True,
-                start = start_time,
-                end = end_time,
-            )
+        for name, (start, end) in windows.items():
+            try:
+                pv_data[name] = self.archFetch(name, start, end)
+            except Exception as e:
+                logger.error(
+                    "archiver fetch failed for {}: {}".format(name, e))
+
+        return pv_data
+
+    def archPullIncremental(self, pv_names, end_time):
+        """
+        Fetch only the samples archived since the previous scan and add them
+        to the sample buffer. PVs seen for the first time are fetched over the
+        whole lookback window.
+
+        Parameters
+        ----------
+        pv_names : list of strings
+
+        end_time : datetime.datetime
+
+        Returns
+        -------
+        dict of numpy.ndarray or xarray.DataArray
+            the newly retrieved data, as returned by archPull. Use
+            self.samples.window for the full lookback window.
+        """
+        start_times = {
+            name: self.samples.fetch_start(name, end_time)
+            for name in pv_names
+        }
+        arch_data = self.archPull(pv_names, end_time, start_times)
+        self.samples.retain(pv_names)
+        added = 0
+        for name, data in arch_data.items():
+            times, values = sample_buffer.archive_samples(data, name)
+            added = added + self.samples.add(name, times, values)
+            if self.sample_cache != None:
+                self.sample_cache.write(name, times, values)
+        logger.debug("{} new samples for {} PVs".format(added, len(arch_data)))
+        return arch_data
+
+    def archFetch(self, name, start_time, end_time):
+        """
+        Request a single PV's data from the archiver.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+
+        start_time : datetime.datetime
+
+        end_time : datetime.datetime
+
+        Returns
+        -------
+        numpy.ndarray or xarray.DataArray
+            a raw_archive.SAMPLE_DTYPE array, or archapp's xarray output if
+            the scanner was created with xarray=True
+        """
+        if not self.xarray:
+            return self.arch.get(name, start=start_time, end=end_time)
+        return self.arch.get(
+            name,
+            xarray = True,
+            start = start_time,
+            end = end_time,
+        )
+
+    def archPullConcurrent(self, windows, fetch=None):
+        """
+        Fetch the PVs through a bounded thread pool. At most max_workers
+        requests are in flight at once. Each request is isolated: a PV that
+        raises is logged and dropped, and a PV still running fetch_timeout
+        seconds after it started is abandoned so it can't stall the scan.
+
+        Parameters
+        ----------
+        windows : dict
+            PV name to (start_time, end_time) of the data to fetch
+
+        fetch : callable or None
+            called with (name, start_time, end_time) for each PV. Defaults to
+            None, archFetch.
+
+        Returns
+        -------
+        dict of numpy.ndarray or xarray.DataArray
+            Same layout as archPull, without the failed or timed out PVs.
+        """
+        pv_data = {}
+        started = {}
+        if fetch == None:
+            fetch = self.archFetch
+
+        def timed_fetch(name):
+            started[name] = time.monotonic()
+            return fetch(name, *windows[name])
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {
+            executor.submit(timed_fetch, name): name for name in windows
+        }
+        pending = set(futures)
+        try:
+            while pending:
+                # wake up in time for the earliest per-PV deadline
+                poll = None
+                if self.fetch_timeout != None:
+                    now = time.monotonic()
+                    deadlines = [
+                        started[futures[f]] + self.fetch_timeout - now
+                        for f in pending if futures[f] in started
+                    ]
+                    poll = max(min(deadlines, default=self.fetch_timeout), 0)
+
+                done, pending = wait(
+                    pending,
+                    timeout = poll,
+                    return_when = FIRST_COMPLETED,
+                )
+                for future in done:
+                    name = futures[future]
+                    try:
+                        pv_data[name] = future.result()
+                    except Exception as e:
+                        logger.error(
+                            "archiver fetch failed for {}: {}".format(name, e))
+
+                if self.fetch_timeout == None:
+                    continue
+                now = time.monotonic()
+                for future in list(pending):
+                    name = futures[future]
+                    if name not in started:
+                        continue
+                    if now - started[name] >= self.fetch_timeout:
+                        logger.warning(
+                            "archiver fetch timed out for {}".format(name))
+                        future.cancel()
+                        pending.discard(future)
+        finally:
+            # don't wait on abandoned requests, their threads exit on their own
+            executor.shutdown(wait=False)
 
         return pv_data
         
 
-    def compare(self, dbpv, dbtrig, archpv):
-        #examine 1 pv for violations
-        logger.debug("compare {} {}".format(str(dbpv.name),str(dbtrig.name)))
-        comparison = dbtrig.compare
-        # if the value field has been left empty
-        if comparison == None:
-            return False
-        if dbtrig.value == None:
-            return False
-        status = False
-        if comparison == "==":
-            filtered_xarray = dbtrig.value == archpv[dbpv.name].sel(field='vals')
-            if filtered_xarray.any():
-                status = True
-        elif comparison == "<=":
-            minimum = archpv[dbpv.name].sel(field='vals').min().item(0)
-            if minimum <= dbtrig.value:
-                status = True
-        elif comparison == ">=":
-            maximum = archpv[dbpv.name].sel(field='vals').max().item(0)
-            if maximum >= dbtrig.value:
-                status = True
-        elif comparison == "<":
-            minimum = archpv[dbpv.name].sel(field='vals').min().item(0)
-            if minimum < dbtrig.value:
-                status = True
-        elif comparison == ">":
-            maximum = archpv[dbpv.name].sel(field='vals').max().item(0)
-            if maximum > dbtrig.value:
-                status = True
-        elif comparison == "!=":
-            filtered_xarray = dbtrig.value != archpv[dbpv.name].sel(field='vals')
-            if filtered_xarray.any():
-                status = True
+    def archPullBulk(self, windows):
+        """
+        Fetch the PVs in batches of bulk_size PVs per archiver request. PVs
+        are batched in order of their window start, and each batch requests
+        the union of its PVs' windows; samples older than a PV's own window
+        are ignored by the sample buffer. A batch that fails is fetched
+        again one PV at a time. Batches are requested concurrently when
+        max_workers is above 1.
+
+        Parameters
+        ----------
+        windows : dict
+            PV name to (start_time, end_time) of the data to fetch
+
+        Returns
+        -------
+        dict of numpy.ndarray or xarray.DataArray
+            Same layout as archPull. PVs without data in the window get an
+            empty array, PVs whose fallback request failed are left out.
+        """
+        names = sorted(windows, key=lambda name: windows[name][0])
+
+        def fetch(batch):
+            start = min(windows[name][0] for name in batch)
+            end = max(windows[name][1] for name in batch)
+            try:
+                # tuples keep the batch hashable for a shared cache
+                return self.bulk.get(
+                    tuple(batch), start=start, end=end, xarray=self.xarray)
+            except Exception as e:
+                logger.warning(
+                    "bulk fetch of {} PVs failed, fetching one by one: {}"
+                    .format(len(batch), e))
+            pv_data = {}
+            for name in batch:
+                try:
+                    pv_data[name] = self.archFetch(name, *windows[name])
+                except Exception as e:
+                    logger.error(
+                        "archiver fetch failed for {}: {}".format(name, e))
+            return pv_data
+
+        pv_data = {}
+        pv_batches = bulk_fetch.batches(names, self.bulk_size)
+        if self.max_workers != None and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for batch_data in executor.map(fetch, pv_batches):
+                    pv_data.update(batch_data)
         else:
-            logger.error("comparator not yet implemented")
-            #raise NotImplementedError
-        return status
+            for batch in pv_batches:
+                pv_data.update(fetch(batch))
+        logger.debug("{} PVs in {} bulk requests".format(
+            len(names), len(pv_batches)))
+        return pv_data
 
     def utc_to_local(self,utc_dt):
         """
@@ -209,57 +540,456 @@ class TriggerScan:
         if target_time == None:
             target_time = datetime.datetime.now()
 
-        pv_qset = self.dbPvPull()
-        arch_data = self.archPull(pv_qset, target_time)
-        
-        tripped_trigger_pk = set()
+        plan = self.plans.get()
+        pv_names = plan.pv_names
+        if self.shard != None:
+            self.shard.refresh()
+            pv_names = self.shard.share(pv_names)
+            # expressions may refer to PVs owned by other workers
+            referenced = expr_eval.referenced_pvs(
+                self.ownedRows(plan.expression_rows(), pv_names))
+            pv_names = pv_names + sorted(referenced.difference(pv_names))
+            logger.debug("{} scanning {} of {} PVs".format(
+                self.shard.name, len(pv_names), len(plan.pv_names)))
+        if self.stream:
+            tripped_trigger_pk, evaluated_rows = self.scanStreamed(
+                plan, pv_names, target_time)
+        elif self.extrema != None:
+            tripped_trigger_pk, evaluated_rows = self.scanExtrema(
+                plan, pv_names, target_time)
+        else:
+            tripped_trigger_pk, evaluated_rows = self.scanBuffered(
+                plan, pv_names, target_time)
+        evaluated = self.knownTriggers(
+            plan.trigger_rows() + plan.expression_rows(),
+            evaluated_rows,
+            tripped_trigger_pk,
+        )
+        self.notify(plan, tripped_trigger_pk, target_time, evaluated)
+
+    def scanBuffered(self, plan, pv_names, target_time):
+        """
+        Evaluate the triggers of a plan against the sample buffer, fetching
+        only the samples archived since the previous scan.
+
+        Parameters
+        ----------
+        plan : scan_plan.ScanPlan
+
+        pv_names : list of strings
+            the PVs to scan
+
+        target_time : datetime.datetime
 
-        # loop through all PVs
+        Returns
+        -------
+        tuple
+            set of the tripped trigger pks and list of the rows evaluated
+            against samples (see knownTriggers)
+        """
+        arch_data = self.archPullIncremental(pv_names, target_time)
+        available = self.bufferedPvs(arch_data, target_time)
+
+        # compile every trigger/PV pair into one vectorized evaluation
         logger.debug("scanning triggers")
-        for pv in pv_qset:
-            trigger_set = pv.trigger_set.all()
-            # all triggers must be compared - ensures all triggers visited once
-            for trigger in trigger_set:
-                if(self.compare(pv,trigger,arch_data[pv.name])):
-                    logger.debug("TRIPPED")
-                    tripped_trigger_pk.add(trigger.pk)
-
-        tripped_triggers = Trigger.objects.filter(pk__in=tripped_trigger_pk)
-        tripped_alerts = Alert.objects.filter(trigger__in=tripped_triggers)
-        tripped_alerts = tripped_alerts.distinct()
-        #print(tripped_alerts)
-
-        for alert in tripped_alerts:
-            #print(alert.last_sent)
-            #print(target_time)
-            #print(alert.lockout_duration)
-            if alert.last_sent != None:
-                if datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc) \
-                        - self.utc_to_local(alert.last_sent) \
-                        < alert.lockout_duration:
-                    logging.debug("lockout duration stil in effect")
-                    continue
-            specific_triggers = alert.trigger_set.filter(
-                pk__in=tripped_trigger_pk
+        trigger_rows = []
+        for row in self.ownedRows(plan.trigger_rows(), set(pv_names)):
+            if row[1] not in available:
+                logger.warning("no archiver data for {}".format(row[1]))
+                continue
+            trigger_rows.append(row)
+        samples = {
+            name: self.samples.window(name, target_time)[1]
+            for name in {row[1] for row in trigger_rows}
+        }
+        if self.parallel != None:
+            tripped_trigger_pk = self.parallel.evaluate(trigger_rows, samples)
+        else:
+            evaluator = trigger_eval.TriggerEvaluator(trigger_rows)
+            tripped_trigger_pk = evaluator.evaluate(samples)
+        logger.debug("{} of {} triggers tripped".format(
+            len(tripped_trigger_pk), len(trigger_rows)))
+        expression_tripped, expression_rows = self.scanExpressions(
+            self.ownedRows(plan.expression_rows(), pv_names),
+            target_time,
+            available,
+            plan.expression_rows(),
+        )
+        return (
+            tripped_trigger_pk | expression_tripped,
+            trigger_rows + expression_rows,
+        )
+
+    def bufferedPvs(self, names, target_time):
+        """
+        Return the PVs among names with samples in the buffer's lookback
+        window ending at target_time.
+        """
+        return {
+            name for name in names
+            if len(self.samples.window(name, target_time)[1])
+        }
+
+    def knownTriggers(self, rows, evaluated_rows, tripped_trigger_pk):
+        """
+        Return the triggers whose result a scan established. A trigger
+        tripped as soon as one of its PVs tripped it, but it is only known to
+        be clear once every one of its rows was evaluated: a PV without data
+        in this scan, or owned by another worker, leaves the trigger's last
+        result in place.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            every row of the plan, see ScanPlan.trigger_rows and
+            ScanPlan.expression_rows
+
+        evaluated_rows : list of tuples
+            the rows evaluated against samples
+
+        tripped_trigger_pk : set
+            pks of the tripped triggers
+
+        Returns
+        -------
+        set
+            pks of the triggers to record, see ScanPlan.record_evaluation
+        """
+        evaluated = {row[:2] for row in evaluated_rows}
+        missed = {row[0] for row in rows if row[:2] not in evaluated}
+        return {pk for pk, _ in evaluated}.difference(missed).union(
+            tripped_trigger_pk)
+
+    def ownedRows(self, rows, pv_names):
+        """
+        Select the trigger rows this scanner evaluates: those watching a
+        scanned PV which, when sharded, this worker owns. Owning a PV only
+        referenced by another worker's expressions doesn't make its rows
+        ours.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            rows of ScanPlan.trigger_rows or ScanPlan.expression_rows
+
+        pv_names : collection of strings
+            the scanned PVs
+
+        Returns
+        -------
+        list of tuples
+        """
+        return [
+            row for row in rows
+            if row[1] in pv_names
+            and (self.shard == None or self.shard.owns(row[1]))
+        ]
+
+    def scanExpressions(self, rows, target_time, available, current):
+        """
+        Evaluate expression triggers against the sample buffer. Their value
+        PVs and the PVs they refer to must have been fetched into the buffer
+        for this scan.
+
+        Parameters
+        ----------
+        rows : list of tuples
+            rows of ScanPlan.expression_rows
+
+        target_time : datetime.datetime
+
+        available : set of strings
+            PVs fetched in this scan with samples in the buffer. Rows missing
+            one of their PVs aren't evaluated.
+
+        current : list of tuples
+            every row of ScanPlan.expression_rows, the deadband latches of
+            the rows skipped in this scan are kept
+
+        Returns
+        -------
+        tuple
+            set of the tripped trigger pks and list of the evaluated rows
+        """
+        rows = [
+            row for row in rows
+            if self.expressionPvs([row]).issubset(available)
+        ]
+        if not rows:
+            return set(), []
+        samples = {
+            name: self.samples.window(name, target_time)
+            for name in self.expressionPvs(rows)
+        }
+        tripped_trigger_pk = self.expressions.evaluate(
+            rows, samples, target_time, current)
+        logger.debug("{} of {} expression triggers tripped".format(
+            len(tripped_trigger_pk), len({row[0] for row in rows})))
+        return tripped_trigger_pk, rows
+
+    def expressionPvs(self, rows):
+        """
+        Return the PVs whose samples a set of expression rows needs.
+        """
+        return {row[1] for row in rows} | expr_eval.referenced_pvs(rows)
+
+    def scanStreamed(self, plan, pv_names, target_time):
+        """
+        Evaluate the triggers of a plan by streaming each PV's lookback window
+        from the archiver and reducing it while it is decoded. No samples are
+        kept between scans, so memory stays bounded whatever the window length
+        and PV rates. Expression triggers need the samples themselves, so
+        their PVs are still buffered incrementally.
+
+        Parameters
+        ----------
+        plan : scan_plan.ScanPlan
+
+        pv_names : list of strings
+            the PVs to scan
+
+        target_time : datetime.datetime
+
+        Returns
+        -------
+        tuple
+            set of the tripped trigger pks and list of the rows evaluated
+            against samples (see knownTriggers)
+        """
+        trigger_rows = self.ownedRows(plan.trigger_rows(), set(pv_names))
+        evaluator = trigger_eval.TriggerEvaluator(trigger_rows)
+        expression_rows = self.ownedRows(
+            plan.expression_rows(), set(pv_names))
+        start_time = target_time - self.samples.lookback
+
+        def fetch(name, start, end):
+            return stream_decode.reduce_stream(
+                self.arch.stream(name, start, end),
+                evaluator.eq_values(name),
             )
-            trigger_string = ""
-            for x in specific_triggers:
-                trigger_string = trigger_string + "\t" + str(x.name) + "\n"
-            trigger_string = "triggers Tripped:\n" + trigger_string
-            recipients = []
-            for prof in alert.subscriber.all():
-                recipients.append(prof.user.email)
-            #print(recipients)
-            self.emailer.send_text(recipients,'test',trigger_string)
-            alert.last_sent = target_time
-            alert.save()
 
+        windows = {
+            name: (start_time, target_time) for name in evaluator.pv_names
+        }
+        if self.max_workers != None and self.max_workers > 1:
+            reductions = self.archPullConcurrent(windows, fetch)
+        else:
+            reductions = {}
+            for name, window in windows.items():
+                try:
+                    reductions[name] = fetch(name, *window)
+                except Exception as e:
+                    logger.error(
+                        "archiver fetch failed for {}: {}".format(name, e))
+        tripped_trigger_pk = evaluator.evaluate_reductions(reductions)
+        logger.debug("{} of {} triggers tripped".format(
+            len(tripped_trigger_pk), len(evaluator)))
+        evaluated_rows = [
+            row for row in trigger_rows
+            if row[1] in reductions and reductions[row[1]].count
+        ]
+        if expression_rows:
+            arch_data = self.archPullIncremental(
+                sorted(self.expressionPvs(expression_rows)), target_time)
+            expression_tripped, expression_rows = self.scanExpressions(
+                expression_rows,
+                target_time,
+                self.bufferedPvs(arch_data, target_time),
+                plan.expression_rows(),
+            )
+            tripped_trigger_pk = tripped_trigger_pk | expression_tripped
+            evaluated_rows = evaluated_rows + expression_rows
+        return tripped_trigger_pk, evaluated_rows
+
+    def scanExtrema(self, plan, pv_names, target_time):
+        """
+        Evaluate the triggers of a plan using server side min/max reductions
+        for the PVs that only have extrema comparisons ('<', '<=', '>', '>='
+        and '!=', which holds unless min == max == value). PVs with an '=='
+        trigger need to know whether a value occurs at all, so their samples
+        are still downloaded incrementally, as are the PVs of expression
+        triggers. A failed extrema batch falls back to downloading its PVs as
+        well.
+
+        Parameters
+        ----------
+        plan : scan_plan.ScanPlan
+
+        pv_names : list of strings
+            the PVs to scan
+
+        target_time : datetime.datetime
+
+        Returns
+        -------
+        tuple
+            set of the tripped trigger pks and list of the rows evaluated
+            against samples (see knownTriggers)
+        """
+        trigger_rows = self.ownedRows(plan.trigger_rows(), set(pv_names))
+        evaluator = trigger_eval.TriggerEvaluator(trigger_rows)
+        expression_rows = self.ownedRows(
+            plan.expression_rows(), set(pv_names))
+        expression_names = self.expressionPvs(expression_rows)
+        raw_names = sorted(expression_names.union(
+            name for name in pv_names if name in evaluator.eq_rows))
+        extrema_names = [
+            name for name in evaluator.pv_names if name not in raw_names]
+        start_time = target_time - self.samples.lookback
+
+        def fetch(batch):
+            try:
+                return batch, self.extrema.get(
+                    tuple(batch), start=start_time, end=target_time)
+            except Exception as e:
+                logger.warning(
+                    "extrema request for {} PVs failed, downloading them: {}"
+                    .format(len(batch), e))
+                return batch, None
+
+        batches = bulk_fetch.batches(extrema_names, self.bulk_size or 100)
+        if self.max_workers != None and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(fetch, batches))
+        else:
+            results = [fetch(batch) for batch in batches]
+
+        reductions = {}
+        for batch, batch_reductions in results:
+            if batch_reductions == None:
+                raw_names.extend(batch)
+            else:
+                reductions.update(batch_reductions)
+
+        arch_data = self.archPullIncremental(raw_names, target_time)
+        available = self.bufferedPvs(arch_data, target_time)
+        reductions.update(evaluator.reduce({
+            name: self.samples.window(name, target_time)[1]
+            for name in available
+        }))
+        logger.debug("{} PVs reduced by the archiver, {} downloaded".format(
+            len(pv_names) - len(raw_names), len(raw_names)))
+
+        tripped_trigger_pk = evaluator.evaluate_reductions(reductions)
+        logger.debug("{} of {} triggers tripped".format(
+            len(tripped_trigger_pk), len(evaluator)))
+        expression_tripped, expression_rows = self.scanExpressions(
+            expression_rows, target_time, available, plan.expression_rows())
+        evaluated_rows = [
+            row for row in trigger_rows
+            if row[1] in reductions and reductions[row[1]].count
+        ]
+        return (
+            tripped_trigger_pk | expression_tripped,
+            evaluated_rows + expression_rows,
+        )
+
+    def notify(self, plan, tripped_trigger_pk, target_time, evaluated=None):
+        """
+        Advance the status of the evaluated alerts and notify the alerts that
+        became ACTIVE: each is added to its subscribers' digests unless it is
+        locked out, its notification time is recorded and the digests that
+        are due are sent (see flushDigest).
+
+        Alerts stay ACTIVE or ACKNOWLEDGED while their triggers keep
+        tripping, so a lasting condition notifies once rather than every
+        scan. With flap detection, alerts with a flapping trigger only send
+        one notice when they start flapping and notify once they stabilize if
+        they are still ACTIVE. The alerts' runtime state goes to the
+        AlertState table, never to the Alert rows owners edit.
+
+        Parameters
+        ----------
+        plan : scan_plan.ScanPlan
+            plan the triggers were evaluated from
+
+        tripped_trigger_pk : set
+            pks of the tripped triggers
+
+        target_time : datetime.datetime
+            time recorded as the alerts' last_sent
 
+        evaluated : set or None
+            pks of the triggers whose result the scan established (see
+            knownTriggers), those not tripped are recorded as clear. Defaults
+            to None, which only records the tripped triggers, so no alert is
+            cleared.
 
+        Returns
+        -------
+        list of int
+            pks of the alerts that were notified
+        """
+        if evaluated == None:
+            evaluated = tripped_trigger_pk
+        if self.flapping != None:
+            flapped = plan.trigger_alerts(
+                self.flapping.flapping.intersection(plan.triggers))
+            _, stopped = self.flapping.update(
+                evaluated, tripped_trigger_pk, target_time)
+            flapping_triggers = self.flapping.flapping.intersection(
+                plan.triggers)
+            flapping = plan.trigger_alerts(flapping_triggers)
+            stabilized = plan.trigger_alerts(
+                stopped.intersection(plan.triggers)) - flapping
+        else:
+            flapping_triggers = flapped = flapping = stabilized = set()
+        activated = plan.record_evaluation(
+            evaluated, tripped_trigger_pk, target_time)
+        # alerts held back while flapping notify if they settled tripped
+        activated = activated.union(
+            pk for pk in stabilized
+            if plan.states[pk].status == AlertState.ACTIVE
+        ) - flapping
+        notifiable = plan.notifiable(activated, target_time)
+        logger.debug("{} of {} activated alerts locked out".format(
+            len(activated) - len(notifiable), len(activated)))
+
+        for pk in sorted(flapping - flapped):
+            alert = plan.alerts[pk]
+            self.digest.add(
+                plan.recipients[pk],
+                alert.name,
+                [
+                    plan.triggers[trigger_pk].name
+                    for trigger_pk in sorted(flapping_triggers)
+                    if plan.triggers[trigger_pk].alert_id == pk
+                ],
+                target_time,
+                event = 'flapping',
+                note = "notifications are suppressed until it stabilizes",
+            )
 
+        sent_alerts = []
+        for alert, triggers in plan.tripped_alerts(tripped_trigger_pk).items():
+            if alert.pk not in notifiable:
+                continue
+            self.digest.add(
+                plan.recipients[alert.pk],
+                alert.name,
+                [x.name for x in triggers],
+                target_time,
+            )
+            sent_alerts.append(alert.pk)
 
+        self.flushDigest()
+        plan.mark_sent(sent_alerts, target_time)
+        return sent_alerts
 
+    def flushDigest(self, force=False):
+        """
+        Send the notification digests that are due. With an outbox they are
+        only queued here.
 
+        Parameters
+        ----------
+        force : bool
+            Send every pending digest, whether its window ran out or not.
+            Defaults to False.
 
-if __name__ == '__main__':
-    test_db()
+        Returns
+        -------
+        int
+            number of digests sent
+        """
+        return self.digest.flush(self.emailer, self.outbox, force)
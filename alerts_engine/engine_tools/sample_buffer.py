@@ -0,0 +1,312 @@
+"""
+sample_buffer.py keeps recently retrieved archiver samples in memory so each
+scan only has to request the samples archived since the previous scan.
+
+SampleRing holds the (timestamp, value) pairs of one PV in a growable ring.
+SampleBuffer holds one ring per PV, decides which time range still has to be
+fetched and serves the lookback window used for trigger evaluation.
+"""
+
+############
+# Standard #
+############
+import logging
+import datetime
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+TIME_DTYPE = 'datetime64[ns]'
+
+
+def to_datetime64(dt):
+    """
+    Convert a naive local datetime.datetime to numpy.datetime64[ns].
+    """
+    return np.datetime64(dt, 'ns')
+
+
+def to_datetime(dt64):
+    """
+    Convert a numpy.datetime64 to a naive datetime.datetime.
+    """
+    return dt64.astype('datetime64[us]').astype(datetime.datetime)
+
+
+def archive_samples(archpv, name):
+    """
+    Extract timestamps and values of a PV from the data returned by
+    TriggerScan.archPull.
+
+    Parameters
+    ----------
+    archpv : numpy.ndarray, xarray.Dataset or xarray.DataArray
+        archiver data for a single PV, a raw_archive.SAMPLE_DTYPE array or
+        archapp's xarray output
+
+    name : string
+        PV name
+
+    Returns
+    -------
+    times : numpy.ndarray
+        datetime64[ns] sample times in the archiver's local time
+
+    values : numpy.ndarray
+        float sample values
+    """
+    if archpv is None:
+        return np.zeros(0, dtype=TIME_DTYPE), np.zeros(0)
+    if isinstance(archpv, np.ndarray) and archpv.dtype.names:
+        return archpv['time'], archpv['val']
+    try:
+        if name in getattr(archpv, 'data_vars', ()):
+            archpv = archpv[name]
+        vals = archpv.sel(field='vals')
+        return (
+            np.asarray(vals['time'].values, dtype=TIME_DTYPE).ravel(),
+            np.asarray(vals.values, dtype=float).ravel(),
+        )
+    except (KeyError, ValueError, TypeError):
+        # the archiver returns an empty array when it has no data
+        return np.zeros(0, dtype=TIME_DTYPE), np.zeros(0)
+
+
+class SampleRing:
+    """
+    Time ordered (timestamp, value) samples of a single PV.
+
+    The ring doubles its capacity when full and is kept short by trim, so in
+    practice it holds roughly one lookback window of samples.
+    """
+    def __init__(self, capacity=64):
+        """
+        Parameters
+        ----------
+        capacity : int
+            initial number of samples the ring can hold. Defaults to 64.
+        """
+        self.times = np.zeros(capacity, dtype=TIME_DTYPE)
+        self.values = np.zeros(capacity)
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.values)
+
+    @property
+    def last_time(self):
+        """
+        numpy.datetime64 or None : timestamp of the newest sample
+        """
+        if not self.size:
+            return None
+        return self.times[(self.head + self.size - 1) % self.capacity]
+
+    def ordered(self):
+        """
+        Return the held samples oldest first.
+
+        Returns
+        -------
+        times : numpy.ndarray
+
+        values : numpy.ndarray
+        """
+        idx = (self.head + np.arange(self.size)) % self.capacity
+        return self.times[idx], self.values[idx]
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity = capacity * 2
+        times, values = self.ordered()
+        self.times = np.zeros(capacity, dtype=TIME_DTYPE)
+        self.values = np.zeros(capacity)
+        self.times[:self.size] = times
+        self.values[:self.size] = values
+        self.head = 0
+
+    def extend(self, times, values):
+        """
+        Append samples newer than the newest held sample. Older or repeated
+        samples, such as the one the archiver returns ahead of the requested
+        start time, are ignored.
+
+        Parameters
+        ----------
+        times : numpy.ndarray
+            datetime64 sample times, ascending
+
+        values : numpy.ndarray
+            sample values
+
+        Returns
+        -------
+        int
+            number of samples added
+        """
+        times = np.asarray(times, dtype=TIME_DTYPE)
+        values = np.asarray(values, dtype=float)
+        last = self.last_time
+        if last is not None:
+            newer = times > last
+            times = times[newer]
+            values = values[newer]
+        count = len(times)
+        if not count:
+            return 0
+        if self.size + count > self.capacity:
+            self._grow(self.size + count)
+        idx = (self.head + self.size + np.arange(count)) % self.capacity
+        self.times[idx] = times
+        self.values[idx] = values
+        self.size = self.size + count
+        return count
+
+    def trim(self, before):
+        """
+        Drop samples older than a time, keeping the last one before it since
+        that value is still in effect at the start of the window.
+
+        Parameters
+        ----------
+        before : numpy.datetime64
+        """
+        times, _ = self.ordered()
+        drop = np.searchsorted(times, before, side='left') - 1
+        if drop > 0:
+            self.head = (self.head + drop) % self.capacity
+            self.size = self.size - drop
+
+    def window(self, start, end):
+        """
+        Return the samples describing the interval [start, end]: every sample
+        inside it plus the last one before start, matching what the archiver
+        returns for a request over the same interval.
+
+        Parameters
+        ----------
+        start : numpy.datetime64
+
+        end : numpy.datetime64
+
+        Returns
+        -------
+        times : numpy.ndarray
+
+        values : numpy.ndarray
+        """
+        times, values = self.ordered()
+        first = max(np.searchsorted(times, start, side='left') - 1, 0)
+        last = np.searchsorted(times, end, side='right')
+        return times[first:last], values[first:last]
+
+
+class SampleBuffer:
+    """
+    Per-PV sample rings for incremental archiver retrieval.
+    """
+    def __init__(self, lookback):
+        """
+        Parameters
+        ----------
+        lookback : datetime.timedelta
+            length of the window evaluated by each scan
+        """
+        self.lookback = lookback
+        self.rings = {}
+
+    def fetch_start(self, name, end_time):
+        """
+        Return the time from which a PV's samples must be requested so the
+        buffer covers the lookback window ending at end_time.
+
+        Parameters
+        ----------
+        name : string
+
+        end_time : datetime.datetime
+
+        Returns
+        -------
+        datetime.datetime
+        """
+        window_start = end_time - self.lookback
+        ring = self.rings.get(name)
+        if ring is None or ring.last_time is None:
+            return window_start
+        return max(to_datetime(ring.last_time), window_start)
+
+    def add(self, name, times, values):
+        """
+        Store newly retrieved samples for a PV.
+
+        Parameters
+        ----------
+        name : string
+
+        times : numpy.ndarray
+
+        values : numpy.ndarray
+
+        Returns
+        -------
+        int
+            number of new samples
+        """
+        if name not in self.rings:
+            self.rings[name] = SampleRing()
+        return self.rings[name].extend(times, values)
+
+    def window(self, name, end_time):
+        """
+        Return a PV's samples for the lookback window ending at end_time and
+        drop the samples that fell out of it.
+
+        Parameters
+        ----------
+        name : string
+
+        end_time : datetime.datetime
+
+        Returns
+        -------
+        times : numpy.ndarray
+
+        values : numpy.ndarray
+        """
+        ring = self.rings.get(name)
+        if ring is None:
+            return np.zeros(0, dtype=TIME_DTYPE), np.zeros(0)
+        start = to_datetime64(end_time - self.lookback)
+        ring.trim(start)
+        return ring.window(start, to_datetime64(end_time))
+
+    def retain(self, names):
+        """
+        Forget the PVs that are no longer scanned.
+
+        Parameters
+        ----------
+        names : iterable of strings
+        """
+        names = set(names)
+        for name in list(self.rings):
+            if name not in names:
+                del self.rings[name]
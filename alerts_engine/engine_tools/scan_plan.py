@@ -0,0 +1,542 @@
+"""
+scan_plan.py provides ScanPlan, a snapshot of everything a single scan needs
+from the database, loaded in a constant number of queries.
+"""
+
+############
+# Standard #
+############
+import logging
+import time
+
+###############
+# Third Party #
+###############
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    DateTimeField, Exists, ExpressionWrapper, F, OuterRef, Prefetch, Q, Value)
+from django.utils import timezone
+
+##########
+# Custom #
+##########
+from . import django_connect
+from . import pv_index as pv_index_module
+from . import expr_eval
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+django_connect.prepare()
+from alert_config_app.models import (
+    Alert, AlertState, ConfigVersion, Trigger, TriggerState)
+from account_mgr_app.models import Profile
+
+
+class ScanPlan:
+    """
+    The live triggers, their alerts, the alerts' runtime state and the
+    subscriber emails for one scan cycle.
+
+    Use ScanPlan.load to build a plan from the database. The plan never
+    queries the database again apart from notifiable, mark_sent and
+    record_evaluation, which read and write the cycle's notifications and
+    alert statuses in the AlertState table with a few column targeted
+    queries.
+
+    Attributes
+    ----------
+    triggers : dict
+        trigger pk to Trigger
+
+    alerts : dict
+        alert pk to Alert
+
+    states : dict
+        alert pk to AlertState
+
+    pv_triggers : dict
+        PV name to list of the Triggers watching it. Each PV appears once no
+        matter how many triggers list it or match it through a glob.
+
+    recipients : dict
+        alert pk to list of subscriber email addresses
+
+    expression_pvs : set
+        PVs the trigger expressions refer to through pv("..."), which must be
+        fetched along with the watched PVs
+
+    globs : bool
+        whether some value_src lists a glob pattern, whose expansion can
+        change without the configuration changing
+    """
+    def __init__(self, triggers, alerts, pv_index=None, states=None):
+        """
+        Parameters
+        ----------
+        triggers : iterable of alert_config_app.models.Trigger
+
+        alerts : iterable of alert_config_app.models.Alert
+            The alerts owning the triggers with their subscribers' users
+            already fetched.
+
+        pv_index : pv_index.PvIndex or None
+            Resolves the triggers' value_src into PV names. Without an index
+            glob patterns are not expanded. Defaults to None.
+
+        states : iterable of alert_config_app.models.AlertState or None
+            The alerts' runtime state. Alerts without one start from a blank
+            state. Defaults to None.
+        """
+        self.pv_index = pv_index
+        self.triggers = {trigger.pk: trigger for trigger in triggers}
+        self.alerts = {alert.pk: alert for alert in alerts}
+        self.states = {state.alert_id: state for state in states or ()}
+        for pk in self.alerts:
+            if pk not in self.states:
+                self.states[pk] = AlertState(alert_id=pk)
+
+        self.globs = any(
+            pv_index_module.is_glob(entry)
+            for trigger in self.triggers.values()
+            for entry in pv_index_module.parse_value_src(trigger.value_src)
+        )
+        self.pv_triggers = {}
+        for trigger in self.triggers.values():
+            for name in self.trigger_pvs(trigger):
+                self.pv_triggers.setdefault(name, []).append(trigger)
+        self.expression_pvs = expr_eval.referenced_pvs(self.expression_rows())
+
+        self.recipients = {
+            pk: [prof.user.email for prof in alert.subscriber.all()]
+            for pk, alert in self.alerts.items()
+        }
+
+    @classmethod
+    def load(cls, pv_index=None, scan_classes=None):
+        """
+        Fetch the plan using five queries: triggers, alerts, subscribers
+        (with their users), alert states and the pks of the existing trigger
+        states. Missing AlertState and TriggerState rows are created.
+
+        Parameters
+        ----------
+        pv_index : pv_index.PvIndex or None
+            see ScanPlan
+
+        scan_classes : list of strings or None
+            Only include the triggers of alerts in these scan classes.
+            Defaults to None (every alert).
+
+        Returns
+        -------
+        ScanPlan
+        """
+        triggers = (
+            Trigger.objects
+            .exclude(value_src__isnull=True)
+            .exclude(value_src="")
+        )
+        if scan_classes != None:
+            triggers = triggers.filter(alert__scan_class__in=scan_classes)
+        triggers = list(triggers)
+        alerts = (
+            Alert.objects
+            .filter(pk__in={trigger.alert_id for trigger in triggers})
+            .prefetch_related(Prefetch(
+                'subscriber',
+                queryset=Profile.objects.select_related('user'),
+            ))
+        )
+        alert_pks = {trigger.alert_id for trigger in triggers}
+        states = list(AlertState.objects.filter(alert_id__in=alert_pks))
+        missing = alert_pks.difference(state.alert_id for state in states)
+        if missing:
+            try:
+                with transaction.atomic():
+                    AlertState.objects.bulk_create([
+                        AlertState(alert_id=pk) for pk in missing])
+            except IntegrityError:
+                # created concurrently, e.g. by another engine worker
+                pass
+            states = list(AlertState.objects.filter(alert_id__in=alert_pks))
+        trigger_pks = {trigger.pk for trigger in triggers}
+        missing = trigger_pks.difference(
+            TriggerState.objects
+            .filter(trigger_id__in=trigger_pks)
+            .values_list('trigger_id', flat=True)
+        )
+        if missing:
+            # the alert pages create triggers with bulk_create, which skips
+            # the post_save receiver
+            try:
+                with transaction.atomic():
+                    TriggerState.objects.bulk_create([
+                        TriggerState(trigger_id=pk) for pk in missing])
+            except IntegrityError:
+                pass
+        return cls(triggers, alerts, pv_index, states)
+
+    def trigger_pvs(self, trigger):
+        """
+        Return the PV names watched by a trigger.
+
+        Parameters
+        ----------
+        trigger : alert_config_app.models.Trigger
+
+        Returns
+        -------
+        list of strings
+        """
+        if self.pv_index == None:
+            return pv_index_module.parse_value_src(trigger.value_src)
+        return self.pv_index.resolve(trigger.value_src)
+
+    @property
+    def pv_names(self):
+        """
+        list of strings : every PV watched by at least one trigger or
+        referred to by a trigger expression
+        """
+        return list(self.pv_triggers) + sorted(
+            self.expression_pvs.difference(self.pv_triggers))
+
+    def trigger_rows(self):
+        """
+        Return the (pk, pv_name, compare, value) rows used to compile a
+        trigger_eval.TriggerEvaluator. Triggers with an expression are left
+        out, see expression_rows.
+
+        Returns
+        -------
+        list of tuples
+        """
+        return [
+            (trigger.pk, name, trigger.compare, trigger.value)
+            for name, triggers in self.pv_triggers.items()
+            for trigger in triggers
+            if not trigger.expression
+        ]
+
+    def expression_rows(self):
+        """
+        Return the (pk, pv_name, expression) rows of the triggers defined by
+        an expression, one per watched PV, for expr_eval.ExpressionEvaluator.
+
+        Returns
+        -------
+        list of tuples
+        """
+        return [
+            (trigger.pk, name, trigger.expression)
+            for name, triggers in self.pv_triggers.items()
+            for trigger in triggers
+            if trigger.expression
+        ]
+
+    def tripped_alerts(self, tripped_trigger_pk):
+        """
+        Group tripped triggers by their alert.
+
+        Parameters
+        ----------
+        tripped_trigger_pk : set
+            pks of tripped triggers
+
+        Returns
+        -------
+        dict
+            Alert to list of its tripped Triggers, ordered by trigger pk
+        """
+        tripped = {}
+        for pk in sorted(tripped_trigger_pk):
+            trigger = self.triggers[pk]
+            alert = self.alerts[trigger.alert_id]
+            tripped.setdefault(alert, []).append(trigger)
+        return tripped
+
+    def notifiable(self, alert_pks, now=None):
+        """
+        Select the alerts whose lockout has run out with a single query: those
+        never sent, without a lockout_duration, or whose
+        last_sent <= now - lockout_duration. The comparison runs in the
+        database, so notifications sent by other engine workers count too.
+
+        Parameters
+        ----------
+        alert_pks : iterable of int
+
+        now : datetime.datetime or None
+            defaults to timezone.now(). Naive times are interpreted in the
+            django TIME_ZONE
+
+        Returns
+        -------
+        set of int
+            pks of the alerts that may notify
+        """
+        alert_pks = set(alert_pks)
+        if not alert_pks:
+            return set()
+        if now == None:
+            now = timezone.now()
+        elif timezone.is_naive(now):
+            now = timezone.make_aware(now)
+        rows = (
+            AlertState.objects
+            .filter(alert_id__in=alert_pks)
+            # SQLite computes the time as text with a UTC offset, comparing
+            # the stored last_sent to it keeps a lockout that just ran out
+            # inclusive
+            .annotate(lockout_start=ExpressionWrapper(
+                Value(now, output_field=DateTimeField())
+                - F('alert__lockout_duration'),
+                output_field=DateTimeField(),
+            ))
+            .filter(
+                Q(last_sent=None)
+                | Q(alert__lockout_duration=None)
+                | Q(last_sent__lte=F('lockout_start'))
+            )
+            .values_list('alert_id', 'last_sent')
+        )
+        notifiable = set()
+        for pk, last_sent in rows:
+            notifiable.add(pk)
+            self.states[pk].last_sent = last_sent
+        return notifiable
+
+    def mark_sent(self, alert_pks, sent_time):
+        """
+        Record the notification time of alerts with a single UPDATE of
+        AlertState.last_sent.
+
+        Parameters
+        ----------
+        alert_pks : iterable of int
+
+        sent_time : datetime.datetime
+            naive times are interpreted in the django TIME_ZONE
+        """
+        alert_pks = list(alert_pks)
+        if not alert_pks:
+            return
+        if timezone.is_naive(sent_time):
+            sent_time = timezone.make_aware(sent_time)
+        AlertState.objects.filter(pk__in=alert_pks).update(last_sent=sent_time)
+        for pk in alert_pks:
+            self.states[pk].last_sent = sent_time
+
+    def trigger_alerts(self, trigger_pks):
+        """
+        Return the pks of the alerts owning some triggers.
+
+        Parameters
+        ----------
+        trigger_pks : iterable of int
+
+        Returns
+        -------
+        set of int
+        """
+        return {self.triggers[pk].alert_id for pk in trigger_pks}
+
+    def record_evaluation(self, evaluated_trigger_pks, tripped_trigger_pks,
+                          evaluated_time):
+        """
+        Record the result of the triggers evaluated in a scan, advance the
+        status of their alerts (see AlertState.next_status) and return the
+        alerts that became ACTIVE, the only transition that notifies.
+
+        An alert is raised while any of its TriggerStates is tripped. Only
+        the evaluated triggers are written, so a trigger that couldn't be
+        evaluated (its PV failed to fetch, or another engine worker owns it)
+        keeps its last result and can't clear the alert.
+
+        Whatever the number of triggers, this is one transaction: two
+        UPDATEs of the triggers whose result changed, an UPDATE of
+        last_evaluated, a SELECT of the alerts whose status changes and one
+        UPDATE per kind of transition. The SELECT compares the trigger states
+        with the alert statuses in the database, so alerts whose condition
+        holds or stays clear, usually nearly all of them, are never read or
+        rewritten, and acknowledgements from the web interface and
+        transitions by other workers are taken into account.
+
+        Parameters
+        ----------
+        evaluated_trigger_pks : iterable of int
+            triggers evaluated against samples in this scan
+
+        tripped_trigger_pks : iterable of int
+            the evaluated triggers that tripped
+
+        evaluated_time : datetime.datetime
+            naive times are interpreted in the django TIME_ZONE
+
+        Returns
+        -------
+        set of int
+            pks of the alerts that became ACTIVE
+        """
+        evaluated = set(evaluated_trigger_pks)
+        if not evaluated:
+            return set()
+        tripped = evaluated.intersection(tripped_trigger_pks)
+        alert_pks = self.trigger_alerts(evaluated)
+        if timezone.is_naive(evaluated_time):
+            evaluated_time = timezone.make_aware(evaluated_time)
+
+        raised = AlertState.raised_statuses
+        states = AlertState.objects
+        moves = {}
+        with transaction.atomic():
+            TriggerState.objects.filter(
+                trigger_id__in=tripped, tripped=False).update(tripped=True)
+            TriggerState.objects.filter(
+                trigger_id__in=evaluated - tripped,
+                tripped=True,
+            ).update(tripped=False)
+            states.filter(pk__in=alert_pks).update(
+                last_evaluated=evaluated_time)
+            changing = (
+                states
+                .select_for_update()
+                .filter(pk__in=alert_pks)
+                .annotate(now_raised=Exists(
+                    TriggerState.objects.filter(
+                        trigger__alert_id=OuterRef('alert_id'),
+                        tripped=True,
+                    )
+                ))
+                .filter(
+                    Q(now_raised=True) & ~Q(status__in=raised)
+                    | Q(now_raised=False, status__in=raised)
+                )
+                .values_list('alert_id', 'status', 'now_raised')
+            )
+            for pk, status, now_raised in changing:
+                new_status = AlertState.next_status(status, now_raised)
+                moves.setdefault((status, new_status), []).append(pk)
+            for (status, new_status), pks in moves.items():
+                update = {
+                    'status': new_status,
+                    'status_changed': evaluated_time,
+                }
+                if new_status == AlertState.ACTIVE:
+                    update['trip_count'] = F('trip_count') + 1
+                states.filter(pk__in=pks, status=status).update(**update)
+
+        activated = set()
+        for pk in alert_pks:
+            self.states[pk].last_evaluated = evaluated_time
+        for (status, new_status), pks in moves.items():
+            for pk in pks:
+                state = self.states[pk]
+                state.status = new_status
+                state.status_changed = evaluated_time
+                if new_status == AlertState.ACTIVE:
+                    state.trip_count = state.trip_count + 1
+                    activated.add(pk)
+        logger.debug("{} of {} alerts changed status, {} became active".format(
+            sum(len(pks) for pks in moves.values()), len(alert_pks),
+            len(activated)))
+        return activated
+
+    def resolved(self):
+        """
+        Return a plan for the same triggers and alerts with the PVs resolved
+        again through the PV index, without querying the database.
+
+        Returns
+        -------
+        ScanPlan
+        """
+        return self.__class__(
+            self.triggers.values(),
+            self.alerts.values(),
+            self.pv_index,
+            self.states.values(),
+        )
+
+
+class PlanCache:
+    """
+    Keeps the scan plan in memory between scans and reloads it from the
+    database only when the configuration changes, as recorded by
+    alert_config_app.models.ConfigVersion.
+
+    Checking the version is a single row primary key lookup, and it can be
+    limited to once every check_interval seconds. The notification times
+    recorded by ScanPlan.mark_sent and record_evaluation are kept on the
+    cached alert states.
+
+    Attributes
+    ----------
+    version : int or None
+        configuration version of the cached plan
+
+    loads : int
+        number of times the plan was loaded from the database
+    """
+    def __init__(self, pv_index=None, scan_classes=None, check_interval=0.0,
+                 clock=None):
+        """
+        Parameters
+        ----------
+        pv_index : pv_index.PvIndex or None
+            see ScanPlan
+
+        scan_classes : list of strings or None
+            see ScanPlan.load
+
+        check_interval : float
+            Seconds the cached plan is used before the configuration version
+            is checked again. Defaults to 0 (check on every get).
+
+        clock : callable or None
+            returns the current time in seconds. Defaults to None,
+            time.monotonic.
+        """
+        self.pv_index = pv_index
+        self.scan_classes = scan_classes
+        self.check_interval = check_interval
+        self.clock = clock or time.monotonic
+        self.plan = None
+        self.version = None
+        self.loads = 0
+        self._checked = None
+
+    def get(self):
+        """
+        Return the current plan, reloading it if the configuration changed.
+
+        Returns
+        -------
+        ScanPlan
+        """
+        now = self.clock()
+        if (self.plan == None or self._checked == None
+                or now - self._checked >= self.check_interval):
+            # read the version first, a change made while the plan loads
+            # then triggers another load on the next check
+            version = ConfigVersion.current()
+            self._checked = now
+            if self.plan == None or version != self.version:
+                self.plan = ScanPlan.load(self.pv_index, self.scan_classes)
+                self.version = version
+                self.loads = self.loads + 1
+                logger.debug("loaded scan plan for configuration {}".format(
+                    version))
+                return self.plan
+        if self.plan.globs:
+            # glob expansions expire on their own
+            self.plan = self.plan.resolved()
+        return self.plan
+
+    def invalidate(self):
+        """
+        Drop the cached plan so the next get reloads it.
+        """
+        self.plan = None
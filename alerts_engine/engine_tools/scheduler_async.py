@@ -1,14 +1,24 @@
 """
 scheduler_async.py provides the EventMgr object for scheduling regular tasks
 with minimal clock drift. 
+
+Ticks are scheduled on the event loop's monotonic clock, on a fixed grid
+anchored at the first execution, so wall clock jumps (NTP, DST) neither
+shift nor bunch up the runs. The overrun policy decides what happens to the
+ticks missed while a task ran longer than the interval.
 """
 
 
 import asyncio
+import collections
 import datetime
+import heapq
+import itertools
 import logging
+import math
 import time
 import signal
+from concurrent.futures import ThreadPoolExecutor
 '''
 logging.basicConfig(                                                        
     datefmt="%Y-%m-%d %H:%M:%S",                                            
@@ -23,6 +33,43 @@ logger = logging.getLogger(__name__)
 class EndRun(Exception):
     pass
 
+
+# overrun policies
+SKIP = 'skip'
+"""Drop the missed ticks and wait for the next tick on the grid."""
+COALESCE = 'coalesce'
+"""Run once right away for all the missed ticks, then continue on the grid."""
+RUN_LATE = 'late'
+"""Run every missed tick back to back until the schedule is caught up."""
+
+OVERRUN_POLICIES = (SKIP, COALESCE, RUN_LATE)
+
+
+TickStats = collections.namedtuple(
+    'TickStats',
+    ['iteration', 'target_time', 'lateness', 'duration', 'missed'],
+)
+TickStats.__doc__ = """
+Timing of a single execution of the task.
+
+Attributes
+----------
+iteration : int
+    index of the tick on the schedule grid
+
+target_time : datetime.datetime
+    wall clock time the tick was scheduled for
+
+lateness : float
+    seconds between the scheduled and the actual start of the task
+
+duration : float
+    seconds the task ran for
+
+missed : int
+    ticks dropped or merged by the overrun policy after this run
+"""
+
 class EventMgr():
     """
     The EventMgr class manages a single repeated task. The frequency and
@@ -30,6 +77,7 @@ class EventMgr():
     either a function or class method.
     """
     def __init__(self,  interval, end = None, task=None, block=True, 
+                 overrun=RUN_LATE, run_in_executor=False, history=100,
                  *args, **kwargs):
         """
         Initial configuration of EventMgr
@@ -54,6 +102,18 @@ class EventMgr():
             running the EventMgr in the background. A non-blocking run should
             be terminated with the end method.  
 
+        overrun : string
+            Policy applied when a run ends after the next tick was due. One of
+            SKIP, COALESCE or RUN_LATE. Defaults to RUN_LATE.
+
+        run_in_executor : bool
+            If True the task runs in the loop's default thread pool so the
+            loop stays responsive (signals, other callbacks) while it runs.
+            Runs never overlap either way. Defaults to False.
+
+        history : int
+            Number of TickStats kept in the ticks attribute. Defaults to 100.
+
             
         ToDo
         ----
@@ -70,6 +130,15 @@ class EventMgr():
         self.end_time = end
         self.iteration = 0
         self.block = block
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("overrun must be one of {}".format(
+                OVERRUN_POLICIES))
+        self.overrun = overrun
+        self.run_in_executor = run_in_executor
+        self.ticks = collections.deque(maxlen=history)
+        self.start_mono = None
+        self.start_wall = None
+        self.end_mono = None
         self.loop = asyncio.get_event_loop()
         self.loop.call_soon(self.executor)
 
@@ -152,7 +221,9 @@ class EventMgr():
         else:
             self.no_block_terminate()
 
-        self.loop.close()
+        # a loop can't be closed from one of its own callbacks
+        if not self.loop.is_running():
+            self.loop.close()
 
     '''
     async def waiter(self):
@@ -167,55 +238,115 @@ class EventMgr():
     '''
 
 
-    def executor(self,target_time=None):
+    def executor(self, tick=0):
         """
         The executor method manages the execution of the given task and
         schedules the next task at the according time. 
 
         Parameters
         ----------
-        target_time = datetime.datetime
-            Specify the time at which the execution should ideally happen. 
+        tick : int
+            Index of the tick on the schedule grid. The task is passed the
+            wall clock time of the tick as target_time.
         
         Note
         ----
             Intended for internal use only.
         
         """
-        args = {'target_time':target_time}
+        now = self.loop.time()
+        if self.start_mono == None:
+            # anchor the schedule grid on the first execution
+            self.start_mono = now
+            self.start_wall = datetime.datetime.now()
+            if self.end_time != None:
+                self.end_mono = now + (
+                    self.end_time - self.start_wall).total_seconds()
+
+        interval = self.interval.total_seconds()
+        lateness = now - (self.start_mono + tick * interval)
+        target_time = self.start_wall + tick * self.interval
+
+        if self.run_in_executor:
+            future = self.loop.run_in_executor(None, self.task, target_time)
+            future.add_done_callback(
+                lambda f: self.complete(tick, target_time, lateness, now, f))
+            return
+
         try:
             self.task(target_time)
         except:
             self.end()
             return
-        
-        #self.task()
+        self.complete(tick, target_time, lateness, now)
+
+    def complete(self, tick, target_time, lateness, started, future=None):
+        """
+        Record the timing of a finished run and schedule the next one
+        according to the overrun policy.
+
+        Parameters
+        ----------
+        tick : int
+            index of the finished tick
+
+        target_time : datetime.datetime
+            wall clock time the finished tick was scheduled for
+
+        lateness : float
+            seconds the run started after its scheduled time
+
+        started : float
+            loop time at which the run started
+
+        future : asyncio.Future or None
+            result of the run when it was executed in the thread pool
+
+        Note
+        ----
+            Intended for internal use only.
+
+        """
+        if future != None:
+            if future.cancelled() or future.exception() != None:
+                self.end()
+                return
+
+        now = self.loop.time()
+        duration = now - started
+        interval = self.interval.total_seconds()
         self.iteration = self.iteration + 1
-        if target_time == None:
-            target_time = datetime.datetime.now() + self.interval
-        else:
-            target_time = target_time + self.interval 
-    
-        now = datetime.datetime.now()
-        delay = target_time - datetime.datetime.now()
-        #logger.debug("EXTRA TIME: {:4.3}f {}s".format(delay/self.interval,delay))
-        logger.info("load: {:7.4f}%".format((1-delay/self.interval)*100))
-        if delay < datetime.timedelta():
-            logger.warn("task exceeding cycle time")
-        delay = max(delay,datetime.timedelta()) 
-        if self.end_time != None:
-            if (now + delay) < self.end_time:
-                self.loop.call_later(
-                    delay.total_seconds(),
-                    self.executor,target_time
-                )
-            else:
-                self.loop.stop()
-        else:
-            self.loop.call_later(
-                delay.total_seconds(),
-                self.executor,target_time
-            )
+
+        next_tick = tick + 1
+        # last tick whose scheduled time has already passed
+        due = int(math.floor((now - self.start_mono) / interval))
+        if due >= next_tick:
+            logger.warning("task exceeding cycle time")
+            if self.overrun == SKIP:
+                next_tick = due + 1
+            elif self.overrun == COALESCE:
+                next_tick = due
+        missed = next_tick - (tick + 1)
+
+        self.ticks.append(
+            TickStats(tick, target_time, lateness, duration, missed))
+        logger.info("load: {:7.4f}% late: {:.3f}s missed: {}".format(
+            duration / interval * 100, lateness, missed))
+
+        delay = max(self.start_mono + next_tick * interval - now, 0)
+        if self.end_mono != None and now + delay >= self.end_mono:
+            self.loop.stop()
+            return
+        self.loop.call_later(delay, self.executor, next_tick)
+
+    @property
+    def last_tick(self):
+        """
+        TickStats or None : timing of the most recent run
+        """
+        if not self.ticks:
+            return None
+        return self.ticks[-1]
         
     def default_task(self,*args,**kwargs):
         """
@@ -230,6 +361,267 @@ class EventMgr():
         logger.debug("{:>7} DEFAULT TASK".format(self.iteration))
 
 
+class PeriodicTask:
+    """
+    Bookkeeping for one task managed by a TaskScheduler.
+
+    Attributes
+    ----------
+    running : int
+        number of runs currently in progress
+
+    backlog : collections.deque
+        ticks waiting for a free run slot
+
+    ticks : collections.deque of TickStats
+        timing of the most recent runs
+    """
+    def __init__(self, name, interval, task, priority=0, concurrency=1,
+                 overrun=SKIP, history=100, max_backlog=10):
+        """
+        Parameters
+        ----------
+        name : string
+            unique name of the task
+
+        interval : datetime.timedelta
+            delay between successive ticks
+
+        task : callable
+            called with the wall clock target_time of its tick
+
+        priority : int
+            Lower values are started first when several tasks are due at the
+            same time. Defaults to 0.
+
+        concurrency : int
+            Maximum number of simultaneous runs of this task. Defaults to 1.
+
+        overrun : string
+            Policy for ticks falling due while every run slot is busy. SKIP
+            drops them, COALESCE keeps only the latest and RUN_LATE keeps
+            them to be run as slots free up. Defaults to SKIP.
+
+        history : int
+            number of TickStats kept. Defaults to 100.
+
+        max_backlog : int
+            Ticks RUN_LATE keeps at most, the oldest are dropped beyond it so
+            a task that can't keep up doesn't build an endless backlog.
+            Defaults to 10.
+        """
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("overrun must be one of {}".format(
+                OVERRUN_POLICIES))
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if max_backlog < 1:
+            raise ValueError("max_backlog must be at least 1")
+        self.name = name
+        self.interval = interval
+        self.task = task
+        self.priority = priority
+        self.concurrency = concurrency
+        self.overrun = overrun
+        self.max_backlog = max_backlog
+        self.running = 0
+        self.missed = 0
+        self.backlog = collections.deque()
+        self.ticks = collections.deque(maxlen=history)
+
+    @property
+    def last_tick(self):
+        """
+        TickStats or None : timing of the most recent run
+        """
+        if not self.ticks:
+            return None
+        return self.ticks[-1]
+
+
+class TaskScheduler:
+    """
+    Runs many periodic tasks, each at its own interval, on one event loop.
+
+    The next tick of every task is kept in a heap ordered by due time and
+    priority, and a single loop timer is armed for the earliest one. Runs
+    execute in a shared thread pool so a slow task delays neither the loop
+    nor the other tasks. Like EventMgr, ticks follow a fixed grid on the
+    loop's monotonic clock.
+    """
+    def __init__(self, end=None, max_workers=None):
+        """
+        Parameters
+        ----------
+        end : datetime.datetime or None
+            Stop once this time is reached. Defaults to None (run until end
+            is called or a signal is received).
+
+        max_workers : int or None
+            Size of the shared thread pool, i.e. the total number of runs in
+            progress across all tasks. Defaults to None, the
+            ThreadPoolExecutor default.
+        """
+        self.end_time = end
+        self.tasks = {}
+        self.loop = asyncio.get_event_loop()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.start_mono = None
+        self.start_wall = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._timer = None
+
+    def add(self, name, interval, task, priority=0, concurrency=1,
+            overrun=SKIP, max_backlog=10):
+        """
+        Register a periodic task. See PeriodicTask for the parameters.
+
+        Returns
+        -------
+        PeriodicTask
+        """
+        if name in self.tasks:
+            raise ValueError("task {} already exists".format(name))
+        ptask = PeriodicTask(
+            name, interval, task, priority, concurrency, overrun,
+            max_backlog = max_backlog,
+        )
+        self.tasks[name] = ptask
+        if self.start_mono != None:
+            self._push(ptask, 0)
+            self._arm()
+        return ptask
+
+    def start(self, block=True):
+        """
+        Start the scheduler.
+
+        Parameters
+        ----------
+        block : bool
+            If True, run the loop until end is called or SIGINT/SIGTERM is
+            received. Otherwise only schedule the first ticks, leaving the
+            loop to be run by the caller. Defaults to True.
+        """
+        self.start_mono = self.loop.time()
+        self.start_wall = datetime.datetime.now()
+        for ptask in self.tasks.values():
+            self._push(ptask, 0)
+        self._arm()
+        if block:
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(sig, self.end)
+            self.loop.run_forever()
+
+    def end(self):
+        """
+        Stop scheduling and halt the loop. Runs in progress finish in the
+        background.
+        """
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+        self._heap = []
+        self.loop.stop()
+        self.pool.shutdown(wait=False)
+
+    def _push(self, ptask, tick):
+        due = self.start_mono + tick * ptask.interval.total_seconds()
+        heapq.heappush(
+            self._heap, (due, ptask.priority, next(self._seq), ptask, tick))
+
+    def _arm(self):
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+        if self._heap:
+            self._timer = self.loop.call_at(self._heap[0][0], self._dispatch)
+
+    def _dispatch(self):
+        """
+        Start every task whose tick is due and schedule their next ticks.
+
+        Note
+        ----
+            Intended for internal use only.
+
+        """
+        self._timer = None
+        now = self.loop.time()
+        if self.end_time != None and datetime.datetime.now() >= self.end_time:
+            self.end()
+            return
+        # the heap orders simultaneous ticks by priority
+        while self._heap and self._heap[0][0] <= now:
+            due, _, _, ptask, tick = heapq.heappop(self._heap)
+            self._tick(ptask, tick, now)
+            self._push(ptask, tick + 1)
+        self._arm()
+
+    def _tick(self, ptask, tick, now):
+        if ptask.running < ptask.concurrency:
+            self._launch(ptask, tick, now)
+            return
+        logger.warning("{} exceeding cycle time".format(ptask.name))
+        if ptask.overrun == SKIP:
+            ptask.missed = ptask.missed + 1
+        elif ptask.overrun == COALESCE:
+            ptask.missed = ptask.missed + len(ptask.backlog)
+            ptask.backlog.clear()
+            ptask.backlog.append(tick)
+        else:
+            if len(ptask.backlog) >= ptask.max_backlog:
+                ptask.backlog.popleft()
+                ptask.missed = ptask.missed + 1
+            ptask.backlog.append(tick)
+
+    def _launch(self, ptask, tick, now):
+        interval = ptask.interval.total_seconds()
+        lateness = now - (self.start_mono + tick * interval)
+        target_time = self.start_wall + tick * ptask.interval
+        missed = ptask.missed
+        ptask.missed = 0
+        ptask.running = ptask.running + 1
+        future = self.loop.run_in_executor(self.pool, ptask.task, target_time)
+        future.add_done_callback(
+            lambda f: self._complete(
+                ptask, tick, target_time, lateness, now, missed, f)
+        )
+
+    def _complete(self, ptask, tick, target_time, lateness, started, missed,
+                  future):
+        """
+        Record a finished run and start a waiting tick if there is one.
+
+        Note
+        ----
+            Intended for internal use only.
+
+        """
+        ptask.running = ptask.running - 1
+        now = self.loop.time()
+        duration = now - started
+        ptask.ticks.append(
+            TickStats(tick, target_time, lateness, duration, missed))
+        logger.info("{}: load: {:7.4f}% late: {:.3f}s missed: {}".format(
+            ptask.name,
+            duration / ptask.interval.total_seconds() * 100,
+            lateness,
+            missed,
+        ))
+
+        if not future.cancelled() and future.exception() != None:
+            if isinstance(future.exception(), EndRun):
+                self.end()
+                return
+            logger.error("{} failed: {}".format(
+                ptask.name, future.exception()))
+
+        if ptask.backlog and self._heap:
+            self._launch(ptask, ptask.backlog.popleft(), now)
+
+
 class demo:
     def __init__(self):
         self.x = 0
@@ -0,0 +1,164 @@
+"""
+server_reduce.py asks the archiver for the extrema of PVs over a window
+instead of downloading their samples.
+
+The retrieval service applies processing operators server side: requesting
+min_N(PV) or max_N(PV) returns one value per N second bin. ExtremaArchive
+requests both operators for a batch of PVs in one getDataForPVs.json call and
+folds the bins into the PvReduction the trigger evaluation uses, so a PV
+costs a few numbers of transfer whatever its rate.
+
+Bins are aligned on multiples of N seconds, so the extrema may include
+samples up to one bin before the window start or after its end. Keep N well
+below the scan window; the window of the sample buffer already includes the
+value in effect before its start for the same reason.
+"""
+
+############
+# Standard #
+############
+import logging
+import json
+import re
+import urllib.parse
+import urllib.request
+
+###############
+# Third Party #
+###############
+import numpy as np
+from archapp import config
+from archapp.data import date_spec
+from archapp.url import arch_url
+
+##########
+# Custom #
+##########
+from . import trigger_eval
+from .bulk_fetch import BULK_URL
+from .raw_archive import raw_samples
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+OPERATORS = ('min', 'max')
+OPERATOR_NAME = re.compile(r'^(min|max)_\d+\((.*)\)$')
+
+
+def operator_name(operator, bin_size, pvname):
+    """
+    Return the processed PV name requesting an operator, e.g. min_10(PV).
+    """
+    return "{}_{}({})".format(operator, int(bin_size), pvname)
+
+
+class ExtremaArchive:
+    """
+    Client requesting server side min/max reductions.
+    """
+    def __init__(self, hostname=config.hostname, data_port=config.data_port,
+                 bin_size=10, timeout=30.0):
+        """
+        Parameters
+        ----------
+        hostname : string
+            archiver host
+
+        data_port : int
+            port of the retrieval service
+
+        bin_size : int
+            seconds per bin of the min/max operators. Defaults to 10.
+
+        timeout : float
+            Seconds to wait on the connection before the request fails.
+            Defaults to 30.
+        """
+        self.base_url = arch_url(hostname, data_port, BULK_URL)
+        self.bin_size = max(int(bin_size), 1)
+        self.timeout = timeout
+
+    def requested(self, pvs):
+        """
+        Return the (operator, pv) pairs requested for a batch, in order.
+        """
+        return [(op, pv) for pv in pvs for op in OPERATORS]
+
+    def url(self, pvs, start, end):
+        """
+        Return the request url for the extrema of a batch of PVs.
+        """
+        query = [
+            ('pv', operator_name(op, self.bin_size, pv))
+            for op, pv in self.requested(pvs)
+        ]
+        query.append(('from', date_spec(start)))
+        query.append(('to', date_spec(end)))
+        return self.base_url + '?' + urllib.parse.urlencode(query)
+
+    def get_raw(self, pvs, start, end):
+        """
+        Request the binned extrema of a batch of PVs.
+
+        Returns
+        -------
+        list of dicts
+            one {meta, data} entry per requested operator
+        """
+        with urllib.request.urlopen(
+                self.url(pvs, start, end), timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def get(self, pvs, start, end):
+        """
+        Request the extrema of a batch of PVs over a window.
+
+        Parameters
+        ----------
+        pvs : list of strings
+
+        start : datetime.datetime
+
+        end : datetime.datetime
+
+        Returns
+        -------
+        dict of trigger_eval.PvReduction
+            keyed by PV name. Only count, minimum and maximum are set (count
+            is the number of bins), so the reductions can't answer '=='
+            triggers. PVs without data in the window are left out.
+        """
+        entries = self.get_raw(pvs, start, end)
+        requested = self.requested(pvs)
+        bins = {}
+        for i, entry in enumerate(entries):
+            name = ''
+            if isinstance(entry, dict):
+                name = entry.get('meta', {}).get('name', '')
+            match = OPERATOR_NAME.match(name)
+            if match:
+                op, pv = match.groups()
+            elif len(entries) == len(requested):
+                # the response follows the order of the request
+                op, pv = requested[i]
+            else:
+                logger.warning("can't match extrema entry {!r}".format(name))
+                continue
+            values = raw_samples(entry)['val']
+            values = values[~np.isnan(values)]
+            if len(values):
+                bins.setdefault(pv, {})[op] = values
+
+        reductions = {}
+        for pv, found in bins.items():
+            if set(found) != set(OPERATORS):
+                continue
+            reductions[pv] = trigger_eval.PvReduction(
+                max(len(found['min']), len(found['max'])),
+                found['min'].min(),
+                found['max'].max(),
+                np.zeros(0),
+            )
+        return reductions
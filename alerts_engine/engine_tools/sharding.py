@@ -0,0 +1,255 @@
+"""
+sharding.py splits the scanned PVs between several engine processes.
+
+HashRing assigns every PV name to one worker by consistent hashing, so a
+worker joining or leaving only moves the PVs of its own share. ShardCoordinator
+registers the local worker in the EngineWorker table, keeps its heartbeat
+current and rebuilds the ring whenever the set of live workers changes. The
+Django database is the only coordination point, so workers may run on any
+host that can reach it and a stale heartbeat is all it takes for the
+remaining workers to take over a dead worker's PVs.
+"""
+
+############
+# Standard #
+############
+import logging
+import bisect
+import datetime
+import hashlib
+import os
+import socket
+
+###############
+# Third Party #
+###############
+from django.utils import timezone
+
+##########
+# Custom #
+##########
+from . import django_connect
+django_connect.prepare()
+from alert_config_app.models import EngineWorker
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+
+def ring_hash(key):
+    """
+    Return a stable 64 bit hash of a string, identical in every process
+    (unlike hash(), which is salted per interpreter).
+    """
+    return int.from_bytes(
+        hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes.
+
+    Every node is placed on the ring at several pseudo random points so the
+    keys spread evenly and a departing node's keys are shared out between all
+    the remaining nodes.
+    """
+    def __init__(self, nodes=(), replicas=64):
+        """
+        Parameters
+        ----------
+        nodes : iterable of strings
+            node names
+
+        replicas : int
+            points per node on the ring. Defaults to 64.
+        """
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points = sorted(
+            (ring_hash("{}#{}".format(node, i)), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def owner(self, key):
+        """
+        Return the node owning a key.
+
+        Parameters
+        ----------
+        key : string
+
+        Returns
+        -------
+        string or None
+            None if the ring has no nodes
+        """
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._owners[idx]
+
+    def partition(self, keys):
+        """
+        Group keys by owning node.
+
+        Parameters
+        ----------
+        keys : iterable of strings
+
+        Returns
+        -------
+        dict
+            {node: [keys]}
+        """
+        shares = {node: [] for node in self.nodes}
+        for key in keys:
+            owner = self.owner(key)
+            if owner != None:
+                shares[owner].append(key)
+        return shares
+
+
+def default_name(index=0):
+    """
+    Return a worker name unique to this host and slot, e.g. "host:0".
+    """
+    return "{}:{}".format(socket.gethostname(), index)
+
+
+class ShardCoordinator:
+    """
+    Membership and PV ownership of one sharded engine worker.
+    """
+    def __init__(self, name=None, ttl=datetime.timedelta(seconds=90),
+                 replicas=64):
+        """
+        Parameters
+        ----------
+        name : string or None
+            Unique worker name. Defaults to None, which uses default_name().
+            A restarted worker reusing its name takes its row back.
+
+        ttl : datetime.timedelta
+            Time since the last heartbeat after which a worker is considered
+            dead. Must be longer than the scan period. Defaults to 90 seconds.
+
+        replicas : int
+            see HashRing
+        """
+        if name == None:
+            name = default_name()
+        self.name = name
+        self.ttl = ttl
+        self.ring = HashRing((name,), replicas)
+
+    def heartbeat(self, now=None):
+        """
+        Record that this worker is alive.
+
+        Parameters
+        ----------
+        now : datetime.datetime or None
+            Defaults to None, the current time.
+        """
+        if now == None:
+            now = timezone.now()
+        EngineWorker.objects.update_or_create(
+            name = self.name,
+            defaults = {
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'heartbeat': now,
+            },
+        )
+
+    def members(self, now=None):
+        """
+        Return the names of the live workers.
+
+        Parameters
+        ----------
+        now : datetime.datetime or None
+            Defaults to None, the current time.
+
+        Returns
+        -------
+        list of strings
+        """
+        if now == None:
+            now = timezone.now()
+        return list(
+            EngineWorker.objects
+            .filter(heartbeat__gte=now - self.ttl)
+            .values_list('name', flat=True)
+        )
+
+    def refresh(self, now=None):
+        """
+        Send a heartbeat and rebuild the ring if workers joined or died.
+        Call once per scan, before assigning PVs.
+
+        Parameters
+        ----------
+        now : datetime.datetime or None
+            Defaults to None, the current time.
+
+        Returns
+        -------
+        bool
+            True if the ring changed
+        """
+        if now == None:
+            now = timezone.now()
+        self.heartbeat(now)
+        members = set(self.members(now))
+        # our own row may lag behind a slow clock, we are alive regardless
+        members.add(self.name)
+        if members == self.ring.nodes:
+            return False
+        logger.info("{}: rebalancing over {} workers: {}".format(
+            self.name, len(members), sorted(members)))
+        self.ring = HashRing(members, self.ring.replicas)
+        return True
+
+    def owns(self, pv_name):
+        """
+        Return whether this worker scans a PV.
+
+        Parameters
+        ----------
+        pv_name : string
+
+        Returns
+        -------
+        bool
+        """
+        return self.ring.owner(pv_name) == self.name
+
+    def share(self, pv_names):
+        """
+        Return the PVs scanned by this worker.
+
+        Parameters
+        ----------
+        pv_names : iterable of strings
+
+        Returns
+        -------
+        list of strings
+        """
+        return [name for name in pv_names if self.owns(name)]
+
+    def leave(self):
+        """
+        Remove this worker so the others take over its PVs right away instead
+        of waiting for the heartbeat to expire.
+        """
+        EngineWorker.objects.filter(name=self.name).delete()
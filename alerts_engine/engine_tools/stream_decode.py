@@ -0,0 +1,255 @@
+"""
+stream_decode.py parses archiver responses incrementally, so the samples of
+a long window at a high rate never have to be held in memory at once.
+
+The retrieval service answers with [{"meta": {...}, "data": [sample, ...]}].
+iter_samples walks that layout over a stream of byte chunks and yields the
+samples in fixed size batches of raw_archive.SAMPLE_DTYPE arrays.
+reduce_stream folds those batches into the PvReduction the trigger
+evaluation needs, so memory stays bounded by the batch size whatever the
+window length or PV rate.
+"""
+
+############
+# Standard #
+############
+import logging
+import codecs
+import json
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Custom #
+##########
+from . import trigger_eval
+from .raw_archive import raw_samples
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+WHITESPACE = ' \t\r\n'
+
+
+class _Reader:
+    """
+    Pull parser over a stream of byte chunks.
+
+    Note
+    ----
+        Intended for internal use only.
+
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+
+    def fill(self):
+        chunk = next(self.chunks, None)
+        if chunk == None:
+            return False
+        self.buf = self.buf[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Return the next non whitespace character without consuming it, or
+        None at the end of the stream.
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos = self.pos + 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char == None or char not in chars:
+            raise ValueError("expected one of {!r} in archiver response, got "
+                             "{!r}".format(chars, char))
+        self.pos = self.pos + 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # a number may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_data(reader, meta, batch_size):
+    """
+    Decode the samples of a "data" array in batches.
+    """
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.expect(']')
+        return
+    points = []
+    while True:
+        points.append(reader.value())
+        if len(points) >= batch_size:
+            yield meta, raw_samples({'data': points})
+            points = []
+        if reader.expect(',]') == ']':
+            break
+    if points:
+        yield meta, raw_samples({'data': points})
+
+
+def iter_samples(chunks, batch_size=4096):
+    """
+    Decode an archiver response incrementally.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        the response body, e.g. read in fixed size blocks
+
+    batch_size : int
+        samples decoded per yielded batch. Defaults to 4096.
+
+    Yields
+    ------
+    meta : dict
+        the PV's meta data as far as it has been read (the archiver sends it
+        ahead of the samples)
+
+    samples : numpy.ndarray
+        raw_archive.SAMPLE_DTYPE array of at most batch_size samples
+    """
+    reader = _Reader(chunks)
+    if reader.peek() == None:
+        return
+    in_list = reader.peek() == '['
+    if in_list:
+        reader.expect('[')
+        if reader.peek() == ']':
+            return
+    while True:
+        reader.expect('{')
+        meta = {}
+        if reader.peek() == '}':
+            reader.expect('}')
+        else:
+            while True:
+                key = reader.value()
+                reader.expect(':')
+                if key != 'data':
+                    value = reader.value()
+                    if key == 'meta':
+                        meta.update(value)
+                else:
+                    yield from _iter_data(reader, meta, batch_size)
+                if reader.expect(',}') == '}':
+                    break
+        if not in_list or reader.expect(',]') == ']':
+            return
+
+
+class ReductionAccumulator:
+    """
+    Builds a PvReduction from successive batches of samples.
+
+    Attributes
+    ----------
+    last_time : numpy.datetime64 or None
+        time of the newest sample seen
+    """
+    def __init__(self, eq_values=None):
+        """
+        Parameters
+        ----------
+        eq_values : array-like or None
+            '==' trigger values to look for, see trigger_eval.reduce_samples
+        """
+        if eq_values is None:
+            eq_values = np.zeros(0)
+        self.eq_values = np.asarray(eq_values, dtype=float)
+        self.count = 0
+        self.minimum = np.nan
+        self.maximum = np.nan
+        self.found = np.zeros(len(self.eq_values), dtype=bool)
+        self.last_time = None
+
+    def add(self, times, values):
+        """
+        Fold a batch of samples in.
+
+        Parameters
+        ----------
+        times : numpy.ndarray
+
+        values : numpy.ndarray
+        """
+        if len(times):
+            self.last_time = times[-1]
+        batch = trigger_eval.reduce_samples(values, self.eq_values)
+        if not batch.count:
+            return
+        self.count = self.count + batch.count
+        self.minimum = np.fmin(self.minimum, batch.minimum)
+        self.maximum = np.fmax(self.maximum, batch.maximum)
+        if len(batch.equal):
+            self.found |= np.isin(self.eq_values, batch.equal)
+
+    def result(self):
+        """
+        Returns
+        -------
+        trigger_eval.PvReduction
+        """
+        if not self.count:
+            return trigger_eval.EMPTY_REDUCTION
+        return trigger_eval.PvReduction(
+            self.count, self.minimum, self.maximum,
+            self.eq_values[self.found],
+        )
+
+
+def reduce_stream(chunks, eq_values=None, batch_size=4096):
+    """
+    Reduce a single PV archiver response without holding all its samples.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        the response body
+
+    eq_values : array-like or None
+        '==' trigger values to look for
+
+    batch_size : int
+        samples decoded at a time. Defaults to 4096.
+
+    Returns
+    -------
+    trigger_eval.PvReduction
+    """
+    accumulator = ReductionAccumulator(eq_values)
+    for _, samples in iter_samples(chunks, batch_size):
+        accumulator.add(samples['time'], samples['val'])
+    return accumulator.result()
@@ -0,0 +1,303 @@
+"""
+trigger_eval.py provides TriggerEvaluator, a compiled form of a set of
+triggers that is evaluated against archiver data in a handful of numpy
+operations instead of one python comparison per trigger.
+
+Evaluation happens in two steps. Each PV's samples are first reduced once to
+a PvReduction (sample count, minimum, maximum and which of the '==' trigger
+values occur in the samples). Every trigger is then evaluated at once as an
+array comparison against the reductions of its PV.
+"""
+
+############
+# Standard #
+############
+import logging
+from collections import namedtuple
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Custom #
+##########
+
+#################
+# Configuration #
+#################
+logger = logging.getLogger(__name__)
+
+# Trigger.compare strings, the index in this tuple is the compiled op code
+OPERATORS = ('==', '<=', '>=', '<', '>', '!=')
+EQ, LE, GE, LT, GT, NE = range(len(OPERATORS))
+
+
+PvReduction = namedtuple('PvReduction', ['count', 'minimum', 'maximum', 'equal'])
+PvReduction.__doc__ = """
+Everything a trigger needs to know about one PV's samples in a scan window.
+
+Attributes
+----------
+count : int
+    number of valid (non NaN) samples
+
+minimum : float
+    smallest sample, NaN if there are no samples
+
+maximum : float
+    largest sample, NaN if there are no samples
+
+equal : numpy.ndarray
+    the requested '==' trigger values that occur in the samples
+"""
+
+EMPTY_REDUCTION = PvReduction(0, np.nan, np.nan, np.zeros(0))
+
+
+def reduce_samples(values, eq_values=None):
+    """
+    Reduce a PV's samples to the statistics required by its triggers.
+
+    Parameters
+    ----------
+    values : array-like
+        sample values for the scan window
+
+    eq_values : array-like or None
+        trigger values whose presence in the samples must be known ('=='
+        triggers). Defaults to None.
+
+    Returns
+    -------
+    PvReduction
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return EMPTY_REDUCTION
+    if eq_values is None or not len(eq_values):
+        equal = np.zeros(0)
+    else:
+        eq_values = np.asarray(eq_values, dtype=float)
+        equal = eq_values[np.isin(eq_values, values)]
+    return PvReduction(len(values), values.min(), values.max(), equal)
+
+
+def archive_values(archpv, name):
+    """
+    Extract the sample values of a PV from the data returned by
+    TriggerScan.archPull.
+
+    Parameters
+    ----------
+    archpv : numpy.ndarray, xarray.Dataset or xarray.DataArray
+        archiver data for a single PV, a raw_archive.SAMPLE_DTYPE array or
+        archapp's xarray output
+
+    name : string
+        PV name
+
+    Returns
+    -------
+    numpy.ndarray
+        float sample values, empty if the archiver returned nothing
+    """
+    if archpv is None:
+        return np.zeros(0)
+    if isinstance(archpv, np.ndarray) and archpv.dtype.names:
+        return archpv['val']
+    try:
+        if name in getattr(archpv, 'data_vars', ()):
+            archpv = archpv[name]
+        return np.asarray(
+            archpv.sel(field='vals').values,
+            dtype=float,
+        ).ravel()
+    except (KeyError, ValueError, TypeError):
+        # the archiver returns an empty array when it has no data
+        return np.zeros(0)
+
+
+class TriggerEvaluator:
+    """
+    Compiled, vectorized evaluation of a collection of triggers.
+
+    Each trigger is compiled into a row of parallel arrays (trigger pk, PV,
+    operator code and threshold). A trigger watching several PVs is simply
+    compiled into several rows; it trips if any of them do.
+    """
+    def __init__(self, triggers):
+        """
+        Compile the triggers.
+
+        Parameters
+        ----------
+        triggers : iterable of tuples
+            (pk, pv_name, compare, value) for every trigger/PV pair. Rows with
+            a missing compare or value, or an unknown compare string, are
+            skipped since they can never trip.
+        """
+        pks = []
+        ops = []
+        values = []
+        self.pv_names = []
+        pv_lookup = {}
+        pv_rows = []
+        for pk, pv_name, compare, value in triggers:
+            if compare == None or value == None:
+                continue
+            try:
+                op = OPERATORS.index(compare)
+            except ValueError:
+                logger.error("comparator not yet implemented: {}".format(
+                    compare))
+                continue
+            if pv_name not in pv_lookup:
+                pv_lookup[pv_name] = len(self.pv_names)
+                self.pv_names.append(pv_name)
+            pks.append(pk)
+            ops.append(op)
+            values.append(value)
+            pv_rows.append(pv_lookup[pv_name])
+
+        self.pks = np.array(pks, dtype=np.int64)
+        self.ops = np.array(ops, dtype=np.int8)
+        self.values = np.array(values, dtype=float)
+        self.pv_index = np.array(pv_rows, dtype=np.intp)
+
+        # rows needing an equality lookup, grouped by PV
+        self.eq_rows = {}
+        for row in np.flatnonzero(self.ops == EQ):
+            name = self.pv_names[self.pv_index[row]]
+            self.eq_rows.setdefault(name, []).append(row)
+        self.eq_rows = {
+            name: np.array(rows, dtype=np.intp)
+            for name, rows in self.eq_rows.items()
+        }
+
+    def __len__(self):
+        return len(self.pks)
+
+    def eq_values(self, name):
+        """
+        Return the distinct '==' trigger values watching a PV.
+
+        Parameters
+        ----------
+        name : string
+            PV name
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        rows = self.eq_rows.get(name)
+        if rows is None:
+            return np.zeros(0)
+        return np.unique(self.values[rows])
+
+    def reduce(self, samples):
+        """
+        Reduce the samples of every compiled PV.
+
+        Parameters
+        ----------
+        samples : dict
+            PV name to array of sample values. PVs missing from the dict are
+            treated as having no samples.
+
+        Returns
+        -------
+        dict of PvReduction
+        """
+        reductions = {}
+        for name in self.pv_names:
+            if name not in samples:
+                continue
+            reductions[name] = reduce_samples(
+                samples[name],
+                self.eq_values(name),
+            )
+        return reductions
+
+    def evaluate(self, samples):
+        """
+        Evaluate every trigger against raw samples.
+
+        Parameters
+        ----------
+        samples : dict
+            PV name to array of sample values
+
+        Returns
+        -------
+        set
+            pks of the tripped triggers
+        """
+        return self.evaluate_reductions(self.reduce(samples))
+
+    def evaluate_reductions(self, reductions):
+        """
+        Evaluate every trigger against precomputed PV reductions.
+
+        Parameters
+        ----------
+        reductions : dict
+            PV name to PvReduction. PVs missing from the dict never trip.
+
+        Returns
+        -------
+        set
+            pks of the tripped triggers
+        """
+        if not len(self):
+            return set()
+        n_pvs = len(self.pv_names)
+        counts = np.zeros(n_pvs, dtype=np.int64)
+        mins = np.full(n_pvs, np.nan)
+        maxs = np.full(n_pvs, np.nan)
+        for i, name in enumerate(self.pv_names):
+            reduction = reductions.get(name)
+            if reduction is None:
+                continue
+            counts[i] = reduction.count
+            mins[i] = reduction.minimum
+            maxs[i] = reduction.maximum
+
+        present = counts[self.pv_index] > 0
+        row_min = mins[self.pv_index]
+        row_max = maxs[self.pv_index]
+        values = self.values
+
+        equal = np.zeros(len(self), dtype=bool)
+        for name, rows in self.eq_rows.items():
+            reduction = reductions.get(name)
+            if reduction is None or not len(reduction.equal):
+                continue
+            equal[rows] = np.isin(values[rows], reduction.equal)
+
+        with np.errstate(invalid='ignore'):
+            tripped = np.select(
+                [
+                    self.ops == EQ,
+                    self.ops == LE,
+                    self.ops == GE,
+                    self.ops == LT,
+                    self.ops == GT,
+                    self.ops == NE,
+                ],
+                [
+                    equal,
+                    row_min <= values,
+                    row_max >= values,
+                    row_min < values,
+                    row_max > values,
+                    # some sample differs unless every sample equals value
+                    ~((row_min == values) & (row_max == values)),
+                ],
+                default = False,
+            )
+        tripped = tripped & present
+        return set(self.pks[tripped].tolist())
@@ -8,10 +8,12 @@ Main script running the alerts engine.
 import logging
 import datetime
 import configparser
+import multiprocessing
 
 ###############
 # Third Party #
 ###############
+from django.conf import settings
 
 ##########
 # Custom #
@@ -20,6 +22,16 @@ from engine_tools import scheduler_async
 from engine_tools import email_wrapper
 from engine_tools import record_scanner
 from engine_tools import django_connect
+from engine_tools import live_monitor
+from engine_tools import outbox
+from engine_tools import digest
+from engine_tools import flap_detect
+from engine_tools import sharding
+from engine_tools import archive_cache
+from engine_tools import raw_archive
+from engine_tools import bulk_fetch
+from engine_tools import server_reduce
+from engine_tools import parallel_eval
 
 #################
 # Configuration #
@@ -36,12 +48,80 @@ logger = logging.getLogger(__name__)
 
 
 
-def main():
-    logger.info("START {}".format(str(datetime.datetime.now())))
-    # access configuration for alerts engine, treat conf mostly like a dict 
-    conf = configparser.ConfigParser()
-    conf.read('alert_engine.ini')
-    
+def class_scheduler(conf, make_scanner, rep_t):
+    """
+    Build a TaskScheduler running one scanner per scan class.
+
+    Each entry of the [scan_classes] section reads
+    "interval seconds, priority". Alerts in a class without an entry are
+    scanned with the default class. A TriggerScan isn't safe to run from
+    several threads at once, so a third concurrency field may only be 1.
+
+    Parameters
+    ----------
+    conf : configparser.ConfigParser
+
+    make_scanner : callable
+        returns a TriggerScan for a list of scan classes and a scan period
+
+    rep_t : datetime.timedelta
+        period of the default class when it has no entry
+
+    Returns
+    -------
+    scheduler_async.TaskScheduler
+    """
+    from alert_config_app.models import Alert
+
+    configured = {}
+    for name, entry in conf['scan_classes'].items():
+        fields = [field.strip() for field in entry.split(',')]
+        fields = fields + ['0', '1'][len(fields) - 1:]
+        configured[name] = (
+            datetime.timedelta(seconds=float(fields[0])),
+            int(fields[1]),
+            int(fields[2]),
+        )
+        if configured[name][2] != 1:
+            raise ValueError(
+                "scan class {}: concurrency must be 1".format(name))
+    default = Alert.scan_class_default
+    if default not in configured:
+        configured[default] = (rep_t, 0, 1)
+
+    engine = scheduler_async.TaskScheduler()
+    overrun = conf.get('scheduler', 'overrun', fallback=scheduler_async.SKIP)
+    for name, (interval, priority, concurrency) in configured.items():
+        scan_classes = [name]
+        if name == default:
+            scan_classes = scan_classes + [
+                choice for choice, _ in Alert.scan_class_choices
+                if choice not in configured
+            ]
+        engine.add(
+            name,
+            interval,
+            make_scanner(scan_classes, interval).scanTask,
+            priority = priority,
+            concurrency = concurrency,
+            overrun = overrun,
+        )
+        logger.info("scan class {}: every {}".format(name, interval))
+    return engine
+
+
+def run_engine(conf, shard_name=None):
+    """
+    Build and run one engine until it is stopped.
+
+    Parameters
+    ----------
+    conf : configparser.ConfigParser
+
+    shard_name : string or None
+        Name of this worker when sharding is enabled. Defaults to None
+        (unsharded, scan every PV).
+    """
     rep_t = datetime.timedelta(
         hours = float(conf['scan_period']['hours']),
         minutes = float(conf['scan_period']['minutes']),
@@ -49,30 +129,224 @@ def main():
     )
 
 
-    scanner = record_scanner.TriggerScan("pscaa01-dev",rep_t)
-    
-    '''
-    logger.debug("start test_db")
-    scanner = record_scanner.TriggerScan("pscaa02-dev",rep_t)
-    print(scanner.dbPvPull())
-    a = scanner.dbPvPull()
-    print(type(a))
-    print(scanner.archPull(a))
-    scanner.scanTask()
-    logger.debug("end test_db")
-    '''
-
-    # configure Event Manager
-    engine = scheduler_async.EventMgr(
-        rep_t,
-        block=True,
-        task=scanner.scanTask
+    emailer = email_wrapper.EmailWrapper(settings.EMAIL_HOST, "EASE")
+
+    # queue notifications so mail delivery can't hold up the scans
+    if conf.getboolean('outbox', 'enabled', fallback=False):
+        outbox_path = conf.get('outbox', 'path', fallback='outbox.sqlite3')
+        if shard_name != None:
+            # every worker drains its own queue
+            outbox_path = "{}.{}".format(
+                outbox_path, shard_name.replace(':', '-'))
+        notification_outbox = outbox.NotificationOutbox(
+            emailer,
+            path = outbox_path,
+            workers = conf.getint('outbox', 'workers', fallback=2),
+            max_attempts = conf.getint('outbox', 'max_attempts', fallback=8),
+            backoff = conf.getfloat('outbox', 'backoff', fallback=30.0),
+        )
+        notification_outbox.start()
+    else:
+        notification_outbox = None
+
+    # one digest for every scan class, so a recipient gets a single message
+    # for the alerts tripped within the window
+    notification_digest = digest.NotificationDigest(
+        conf.getfloat('notifications', 'digest_window', fallback=0.0))
+
+    flap_transitions = conf.getint('flapping', 'transitions', fallback=0)
+    if flap_transitions > 1:
+        flapping = flap_detect.FlapDetector(
+            window = conf.getfloat('flapping', 'window', fallback=600.0),
+            transitions = flap_transitions,
+            clear_transitions = conf.getint(
+                'flapping', 'clear_transitions', fallback=flap_transitions // 2),
+        )
+    else:
+        flapping = None
+
+    if shard_name != None:
+        shard = sharding.ShardCoordinator(
+            shard_name,
+            ttl = datetime.timedelta(
+                seconds = conf.getfloat('shard', 'ttl', fallback=90.0)),
+        )
+        shard.refresh()
+        logger.info("sharded worker {}".format(shard.name))
+    else:
+        shard = None
+
+    # recent samples for the web interface
+    if conf.getboolean('sample_cache', 'enabled', fallback=False):
+        from alert_config_app import sample_cache
+        cache_path = conf.get(
+            'sample_cache', 'path', fallback='/dev/shm/ease_samples')
+        if shard_name != None:
+            cache_path = "{}.{}".format(
+                cache_path, shard_name.replace(':', '-'))
+        cache = sample_cache.SampleCache.create(
+            cache_path,
+            slots = conf.getint('sample_cache', 'slots', fallback=4096),
+            capacity = conf.getint('sample_cache', 'capacity', fallback=256),
+        )
+    else:
+        cache = None
+
+    arch_conf = conf['archiver'] if conf.has_section('archiver') else {}
+
+    # one set of archiver clients for every scanner so identical requests
+    # are shared
+    xarray = conf.getboolean('archiver', 'xarray', fallback=False)
+    archive = raw_archive.RawArchive(
+        arch_conf.get('hostname', "pscaa01-dev"),
+        timeout = float(arch_conf.get('fetch_timeout', 0)) or 30.0,
     )
+    bulk_size = int(arch_conf.get('bulk_size', 0))
+    if bulk_size > 1:
+        bulk = bulk_fetch.BulkArchive(
+            arch_conf.get('hostname', "pscaa01-dev"),
+            timeout = float(arch_conf.get('fetch_timeout', 0)) or 30.0,
+        )
+    else:
+        bulk = None
+    extrema_bin = int(arch_conf.get('extrema_bin', 0))
+    if extrema_bin:
+        extrema = server_reduce.ExtremaArchive(
+            arch_conf.get('hostname', "pscaa01-dev"),
+            bin_size = extrema_bin,
+            timeout = float(arch_conf.get('fetch_timeout', 0)) or 30.0,
+        )
+    else:
+        extrema = None
+    cache_ttl = float(arch_conf.get('cache_ttl', 0))
+    if cache_ttl > 0:
+        def cached(client):
+            if client == None:
+                return None
+            return archive_cache.CachedArchive(
+                client,
+                ttl = cache_ttl,
+                max_entries = int(arch_conf.get('cache_entries', 1024)),
+            )
+        archive = cached(archive)
+        bulk = cached(bulk)
+        extrema = cached(extrema)
+
+    # one process pool for every scan class
+    eval_processes = conf.getint('evaluation', 'processes', fallback=0)
+    if eval_processes > 1:
+        evaluator = parallel_eval.ParallelEvaluator(eval_processes)
+    else:
+        evaluator = None
+
+    def make_scanner(scan_classes=None, period=rep_t):
+        return record_scanner.TriggerScan(
+            arch_conf.get('hostname', "pscaa01-dev"),
+            period,
+            max_workers = int(arch_conf.get('max_workers', 0)),
+            fetch_timeout = float(arch_conf.get('fetch_timeout', 0)) or None,
+            glob_ttl = float(arch_conf.get('glob_ttl', 600)),
+            lookback = datetime.timedelta(
+                seconds = float(arch_conf.get('lookback', 0))
+            ) or None,
+            outbox = notification_outbox,
+            digest = notification_digest,
+            flapping = flapping,
+            scan_classes = scan_classes,
+            shard = shard,
+            parallel = evaluator,
+            sample_cache = cache,
+            archive = archive,
+            bulk_size = bulk_size,
+            bulk = bulk,
+            xarray = xarray,
+            stream = conf.getboolean('archiver', 'stream', fallback=False),
+            extrema_bin = extrema_bin,
+            extrema = extrema,
+            config_interval = conf.getfloat(
+                'scheduler', 'config_interval', fallback=0.0),
+        )
+
+    # live mode evaluates triggers on PV updates, the periodic task only
+    # keeps the monitors in line with the configured triggers
+    if conf.getboolean('live', 'enabled', fallback=False):
+        monitor = live_monitor.LiveMonitor(
+            make_scanner(),
+            live_monitor.EpicsPvSource(),
+        )
+        task = monitor.task
+    elif conf.has_section('scan_classes'):
+        # every scan class builds its own scanner
+        monitor = None
+        task = None
+    else:
+        monitor = None
+        task = make_scanner().scanTask
+
+    if task == None:
+        engine = class_scheduler(conf, make_scanner, rep_t)
+    else:
+        # configure Event Manager
+        engine = scheduler_async.EventMgr(
+            rep_t,
+            block=True,
+            task=task,
+            overrun=conf.get(
+                'scheduler', 'overrun', fallback=scheduler_async.SKIP),
+            run_in_executor=conf.getboolean(
+                'scheduler', 'run_in_executor', fallback=True),
+        )
+    if monitor != None:
+        monitor.loop = engine.loop
 
     logger.debug('ENGINE START')
     engine.start()
     logger.debug('ENGINE END')
+    # don't drop the alerts still waiting for their digest window
+    notification_digest.flush(emailer, notification_outbox, force=True)
+    if evaluator != None:
+        evaluator.close()
+    if notification_outbox != None:
+        notification_outbox.close()
+    if shard != None:
+        shard.leave()
+
+
+def main():
+    logger.info("START {}".format(str(datetime.datetime.now())))
+    # access configuration for alerts engine, treat conf mostly like a dict 
+    conf = configparser.ConfigParser()
+    conf.read('alert_engine.ini')
+
+    if not conf.getboolean('shard', 'enabled', fallback=False):
+        run_engine(conf)
+        return
+
+    processes = conf.getint('shard', 'processes', fallback=1)
+    first = conf.getint('shard', 'index', fallback=0)
+    if processes <= 1:
+        run_engine(
+            conf,
+            conf.get('shard', 'name', fallback='')
+                or sharding.default_name(first),
+        )
+        return
 
+    # the children must open their own database connections
+    from django.db import connections
+    connections.close_all()
+    workers = [
+        multiprocessing.Process(
+            target = run_engine,
+            args = (conf, sharding.default_name(first + i)),
+            name = "engine:{}".format(first + i),
+        )
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 import pytest
+import smtplib
 
 from engine_tools import scheduler_async
 
@@ -26,3 +27,54 @@ def limited_counter_class():
     return counter_class
 
 
+class fake_smtp:
+    """
+    Records connections and messages in place of smtplib.SMTP. The server
+    hangs up after drop_after messages on a connection.
+    """
+    connections = []
+    drop_after = None
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.open = True
+        fake_smtp.connections.append(self)
+
+    def send_message(self, msg):
+        if not self.open:
+            raise smtplib.SMTPServerDisconnected()
+        if 'refuse' in msg['To']:
+            raise smtplib.SMTPRecipientsRefused({msg['To']: (550, b'no')})
+        self.sent.append(msg)
+        if fake_smtp.drop_after and len(self.sent) >= fake_smtp.drop_after:
+            self.open = False
+
+    def quit(self):
+        self.open = False
+
+    def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    fake_smtp.connections = []
+    fake_smtp.drop_after = None
+    monkeypatch.setattr(smtplib, 'SMTP', fake_smtp)
+    return fake_smtp
+
+
+@pytest.fixture(scope='session')
+def django_db():
+    """
+    Create the test database for the tests reading and writing the models,
+    django.test.TestCase classes using this fixture run in a transaction
+    rolled back after each test.
+    """
+    from engine_tools import django_connect
+    django_connect.prepare()
+    from django.db import connection
+    name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    yield connection
+    connection.creation.destroy_test_db(name, verbosity=0)
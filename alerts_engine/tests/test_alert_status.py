@@ -0,0 +1,106 @@
+import pytest
+
+import datetime
+
+from engine_tools import django_connect
+django_connect.prepare()
+from django.contrib.auth.models import User
+from django.test import TestCase
+from alert_config_app.models import Alert, AlertState, Pv, Trigger
+from engine_tools import record_scanner
+from engine_tools import scan_plan
+
+
+class fake_emailer:
+    def __init__(self):
+        self.sent = []
+
+    def build_message(self, recipient, subject, body):
+        return (recipient, subject)
+
+    def send_batch(self, messages):
+        self.sent.extend(messages)
+
+
+class broken_archive:
+    def get(self, pvname, *args, **kwargs):
+        raise IOError("archiver unreachable")
+
+
+def status(alert):
+    return AlertState.objects.get(pk=alert.pk).status
+
+
+@pytest.mark.usefixtures('django_db')
+class TestAlertStatus(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='op', email='op@x.org')
+        self.alert = Alert.objects.create(name='beam loss')
+        self.alert.subscriber.add(user.profile)
+        Pv.objects.create(name='PV:A')
+        Pv.objects.create(name='PV:B')
+        self.trigger_a = Trigger.objects.create(
+            name='a', alert=self.alert, value_src='PV:A', compare='>',
+            value=5)
+        self.trigger_b = Trigger.objects.create(
+            name='b', alert=self.alert, value_src='PV:B', compare='>',
+            value=5)
+        self.time = datetime.datetime(2018, 1, 1)
+
+    def scanner(self, **kwargs):
+        scanner = record_scanner.TriggerScan(**kwargs)
+        scanner.emailer = fake_emailer()
+        return scanner
+
+    def test_record_evaluation_transitions(self):
+        plan = scan_plan.ScanPlan.load()
+        a, b = self.trigger_a.pk, self.trigger_b.pk
+        assert plan.record_evaluation({a, b}, {a}, self.time) \
+            == {self.alert.pk}
+        assert status(self.alert) == AlertState.ACTIVE
+        # b trips too, the alert stays active without notifying again
+        assert plan.record_evaluation({a, b}, {a, b}, self.time) == set()
+        # a clears, b keeps the alert raised
+        assert plan.record_evaluation({a}, set(), self.time) == set()
+        assert status(self.alert) == AlertState.ACTIVE
+        assert plan.record_evaluation({b}, set(), self.time) == set()
+        assert status(self.alert) == AlertState.CLEARED
+        assert plan.states[self.alert.pk].status == AlertState.CLEARED
+        assert plan.record_evaluation({a}, {a}, self.time) == {self.alert.pk}
+        state = AlertState.objects.get(pk=self.alert.pk)
+        assert state.trip_count == 2
+        assert state.last_evaluated != None
+
+    def test_acknowledged_stays_until_clear(self):
+        plan = scan_plan.ScanPlan.load()
+        a = self.trigger_a.pk
+        plan.record_evaluation({a}, {a}, self.time)
+        state = AlertState.objects.get(pk=self.alert.pk)
+        state.acknowledge()
+        assert plan.record_evaluation({a}, {a}, self.time) == set()
+        assert status(self.alert) == AlertState.ACKNOWLEDGED
+        plan.record_evaluation({a}, set(), self.time)
+        assert status(self.alert) == AlertState.NORMAL
+
+    def test_notify_on_activation_only(self):
+        scanner = self.scanner()
+        plan = scan_plan.ScanPlan.load()
+        a, b = self.trigger_a.pk, self.trigger_b.pk
+        assert scanner.notify(plan, {a}, self.time, {a, b}) \
+            == [self.alert.pk]
+        assert scanner.emailer.sent == [('op@x.org', 'EASE: beam loss tripped')]
+        assert scanner.notify(plan, {a}, self.time, {a, b}) == []
+        assert scanner.notify(plan, set(), self.time, {a, b}) == []
+        assert status(self.alert) == AlertState.CLEARED
+        assert len(scanner.emailer.sent) == 1
+        assert AlertState.objects.get(pk=self.alert.pk).last_sent != None
+
+    def test_fetch_failure_keeps_alert_active(self):
+        scanner = self.scanner(max_workers=2)
+        plan = scan_plan.ScanPlan.load()
+        scanner.notify(plan, {self.trigger_a.pk}, self.time,
+                       {self.trigger_a.pk, self.trigger_b.pk})
+        scanner.arch = broken_archive()
+        scanner.scanTask(self.time + datetime.timedelta(minutes=1))
+        assert status(self.alert) == AlertState.ACTIVE
+        assert len(scanner.emailer.sent) == 1
@@ -0,0 +1,82 @@
+import pytest
+
+import threading
+import time
+
+from engine_tools import archive_cache
+
+
+class counting_archive:
+    def __init__(self, delay=0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, pvname, xarray=True, start=None, end=None):
+        with self.lock:
+            self.calls = self.calls + 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError("archiver unreachable")
+        return (pvname, start, end)
+
+    def search(self, glob, do_print=True):
+        return [glob]
+
+
+class fake_clock:
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_lru():
+    arch = counting_archive()
+    clock = fake_clock()
+    cache = archive_cache.CachedArchive(arch, ttl=10, max_entries=2,
+                                        clock=clock)
+    assert cache.get("PV:A", start=0, end=1) == ("PV:A", 0, 1)
+    cache.get("PV:A", start=0, end=1)
+    assert arch.calls == 1 and cache.hits == 1
+    # different window, different entry
+    cache.get("PV:A", start=0, end=2)
+    cache.get("PV:B", start=0, end=1)
+    assert len(cache) == 2
+    cache.get("PV:A", start=0, end=1)
+    assert arch.calls == 4
+    clock.now = 11
+    cache.get("PV:A", start=0, end=1)
+    assert arch.calls == 5
+    assert cache.search("PV:*") == ["PV:*"]
+
+
+@pytest.mark.timeout(2)
+def test_coalesces_in_flight():
+    arch = counting_archive(delay=.2)
+    cache = archive_cache.CachedArchive(arch)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.get("PV:A", start=0, end=1)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert arch.calls == 1
+    assert results == [("PV:A", 0, 1)] * 5
+    assert cache.coalesced == 4
+
+
+@pytest.mark.timeout(2)
+def test_errors_not_cached():
+    arch = counting_archive(fail=True)
+    cache = archive_cache.CachedArchive(arch)
+    for _ in range(2):
+        with pytest.raises(IOError):
+            cache.get("PV:A", start=0, end=1)
+    assert arch.calls == 2
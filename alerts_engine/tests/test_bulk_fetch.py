@@ -0,0 +1,40 @@
+import pytest
+
+import datetime
+
+from engine_tools import bulk_fetch
+
+
+def raw_entry(name, *values):
+    return {
+        'meta': {'name': name, 'PREC': '0'},
+        'data': [
+            {'secs': 1514764800 + i, 'nanos': 0, 'val': val,
+             'severity': 0, 'status': 0}
+            for i, val in enumerate(values)
+        ],
+    }
+
+
+def test_bulk_get_splits_response():
+    bulk = bulk_fetch.BulkArchive("archiver")
+    bulk.get_raw = lambda pvs, start, end: [
+        raw_entry("PV:A", 1., 2.),
+        raw_entry("PV:B", 3.),
+        {},
+    ]
+    start = datetime.datetime(2018, 1, 1)
+    data = bulk.get(["PV:A", "PV:B", "PV:C"], start, start)
+    assert sorted(data) == ["PV:A", "PV:B", "PV:C"]
+    assert list(data["PV:A"]['val']) == [1., 2.]
+    # no samples in the window
+    assert len(data["PV:C"]) == 0
+    data = bulk.get(["PV:A", "PV:C"], start, start, xarray=True)
+    assert list(data["PV:A"].sel(field='vals').values) == [1., 2.]
+    assert data["PV:C"].shape == ()
+    url = bulk.url(["PV:A", "PV:B"], start, start)
+    assert "getDataForPVs.json?pv=PV%3AA&pv=PV%3AB&from=" in url
+
+
+def test_batches():
+    assert bulk_fetch.batches(list("abcde"), 2) == [["a", "b"], ["c", "d"], ["e"]]
@@ -0,0 +1,114 @@
+import pytest
+
+import datetime
+
+from engine_tools import digest
+
+
+class fake_clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+TRIPPED = datetime.datetime(2018, 5, 1, 12, 0, 0)
+
+
+def test_one_message_per_recipient():
+    notifications = digest.NotificationDigest()
+    for i in range(40):
+        notifications.add(
+            ['a@x.org', 'b@x.org'], 'alert{}'.format(i), ['t'], TRIPPED)
+    notifications.add(['b@x.org', 'b@x.org'], 'extra', ['t1', 't2'], TRIPPED)
+
+    due = notifications.due()
+    assert [to for to, _, _ in due] == ['a@x.org', 'b@x.org']
+    assert due[0][1] == 'EASE: 40 alerts tripped'
+    assert due[1][1] == 'EASE: 41 alerts tripped'
+    assert due[1][2].count('triggers tripped:') == 41
+    assert 'extra (2018-05-01 12:00:00)\ntriggers tripped:\n\tt1\n\tt2\n' \
+        in due[1][2]
+    assert notifications.due() == []
+
+
+def test_single_alert_subject():
+    notifications = digest.NotificationDigest()
+    notifications.add(['a@x.org'], 'beam loss', ['t'], TRIPPED)
+    assert notifications.due()[0][1] == 'EASE: beam loss tripped'
+
+
+def test_events():
+    notifications = digest.NotificationDigest()
+    notifications.add(
+        ['a@x.org'], 'beam loss', ['t'], TRIPPED, event='flapping',
+        note='notifications are suppressed until it stabilizes')
+    (to, subject, body), = notifications.due()
+    assert subject == 'EASE: beam loss flapping'
+    assert body == (
+        'beam loss (2018-05-01 12:00:00)\n'
+        'notifications are suppressed until it stabilizes\n'
+        'triggers flapping:\n\tt\n'
+    )
+    notifications.add(['a@x.org'], 'beam loss', ['t'], TRIPPED)
+    notifications.add(['a@x.org'], 'vacuum', ['t'], TRIPPED, event='flapping')
+    assert notifications.due()[0][1] == 'EASE: 2 alerts changed'
+
+
+def test_window_collects_alerts():
+    clock = fake_clock()
+    notifications = digest.NotificationDigest(window=30, clock=clock)
+    notifications.add(['a@x.org'], 'first', ['t'], TRIPPED)
+    clock.now = 20
+    notifications.add(['a@x.org', 'b@x.org'], 'second', ['t'], TRIPPED)
+    assert notifications.due() == []
+
+    # a@x.org's window opened at 0, b@x.org's at 20
+    clock.now = 30
+    due = notifications.due()
+    assert [to for to, _, _ in due] == ['a@x.org']
+    assert 'first' in due[0][2] and 'second' in due[0][2]
+    assert len(notifications) == 1
+
+    assert [to for to, _, _ in notifications.due(force=True)] == ['b@x.org']
+    assert len(notifications) == 0
+
+
+class fake_emailer:
+    def __init__(self):
+        self.batches = []
+
+    def build_message(self, recipient, subject, body):
+        return (recipient, subject)
+
+    def send_batch(self, messages):
+        self.batches.append(messages)
+
+
+class fake_outbox:
+    def __init__(self):
+        self.queued = []
+
+    def enqueue(self, recipient, subject, body):
+        self.queued.append((recipient, subject))
+
+
+def test_flush():
+    notifications = digest.NotificationDigest()
+    emailer = fake_emailer()
+    assert notifications.flush(emailer) == 0
+    assert emailer.batches == []
+    notifications.add(['a@x.org', 'b@x.org'], 'beam loss', ['t'], TRIPPED)
+    assert notifications.flush(emailer) == 2
+    # one batch, i.e. one SMTP connection, for every recipient
+    assert emailer.batches == [[
+        ('a@x.org', 'EASE: beam loss tripped'),
+        ('b@x.org', 'EASE: beam loss tripped'),
+    ]]
+
+    box = fake_outbox()
+    notifications.add(['a@x.org'], 'beam loss', ['t'], TRIPPED)
+    assert notifications.flush(emailer, box) == 1
+    assert box.queued == [('a@x.org', 'EASE: beam loss tripped')]
+    assert len(emailer.batches) == 1
@@ -0,0 +1,36 @@
+import pytest
+
+from engine_tools import django_connect
+django_connect.prepare()
+from engine_tools import email_wrapper
+
+
+def test_send_without_session(smtp):
+    emailer = email_wrapper.EmailWrapper('localhost', 'EASE')
+    emailer.send_text('a@x.org', 'subj', 'one')
+    emailer.send_text('a@x.org', 'subj', 'two')
+    assert len(smtp.connections) == 2
+    assert not any(conn.open for conn in smtp.connections)
+
+
+def test_session_reuses_connection(smtp):
+    emailer = email_wrapper.EmailWrapper('localhost', 'EASE')
+    with emailer.session():
+        for i in range(5):
+            emailer.send_text(['a@x.org', 'b@x.org'], 'subj', str(i))
+    assert len(smtp.connections) == 1
+    assert len(smtp.connections[0].sent) == 5
+    assert not smtp.connections[0].open
+
+
+def test_batch_reconnects_and_isolates_failures(smtp):
+    smtp.drop_after = 2
+    emailer = email_wrapper.EmailWrapper('localhost', 'EASE')
+    messages = [
+        emailer.build_message('a@x.org', 'subj', str(i)) for i in range(5)
+    ]
+    messages.insert(1, emailer.build_message('refuse@x.org', 'subj', 'no'))
+    failed = emailer.send_batch(messages)
+    assert [msg['To'] for msg in failed] == ['refuse@x.org']
+    assert sum(len(conn.sent) for conn in smtp.connections) == 5
+    assert len(smtp.connections) == 3
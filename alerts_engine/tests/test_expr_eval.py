@@ -0,0 +1,66 @@
+import numpy as np
+
+from engine_tools import expr_eval
+
+
+def times(*seconds):
+    return np.array(seconds, dtype='datetime64[s]').astype('datetime64[ns]')
+
+
+def test_compile_cached():
+    first = expr_eval.compile_expression('value > 1')
+    assert expr_eval.compile_expression('value > 1') is first
+    assert expr_eval.compile_expression('value >') is None
+
+
+def test_referenced_pvs():
+    rows = [
+        (1, 'PV:A', 'pv("PV:B") > value'),
+        (2, 'PV:A', 'value > 1'),
+        (3, 'PV:C', 'broken'),
+    ]
+    assert expr_eval.referenced_pvs(rows) == {'PV:B'}
+
+
+def test_evaluator():
+    evaluator = expr_eval.ExpressionEvaluator()
+    rows = [
+        (1, 'PV:A', 'value > 10 deadband 5'),
+        (1, 'PV:B', 'value > 10 deadband 5'),
+        (2, 'PV:A', 'value in [0, 1]'),
+        (3, 'PV:A', 'value >'),
+    ]
+    samples = {
+        'PV:A': (times(0, 1), np.array([5., 12.])),
+        'PV:B': (times(0, 1), np.array([1., 2.])),
+    }
+    assert evaluator.evaluate(rows, samples) == {1}
+
+    # PV:A stays latched above 5, PV:B never tripped
+    samples = {
+        'PV:A': (times(2, 3), np.array([8., 7.])),
+        'PV:B': (times(2, 3), np.array([8., 7.])),
+    }
+    assert evaluator.evaluate(rows, samples) == {1}
+    assert evaluator.evaluate(rows[1:], samples) == set()
+    # dropped rows lose their latch
+    assert evaluator.evaluate(rows, samples) == set()
+
+
+def test_evaluator_keeps_skipped_latches():
+    evaluator = expr_eval.ExpressionEvaluator()
+    rows = [
+        (1, 'PV:A', 'value > 10 deadband 5'),
+        (2, 'PV:B', 'value > 10'),
+    ]
+    samples = {'PV:A': (times(0, 1), np.array([5., 12.]))}
+    assert evaluator.evaluate(rows[:1], samples, current=rows) == {1}
+    # PV:A failed to fetch, only PV:B is evaluated
+    samples = {'PV:B': (times(2, 3), np.array([1., 2.]))}
+    assert evaluator.evaluate(rows[1:], samples, current=rows) == set()
+    # back within its deadband, PV:A is still latched
+    samples = {'PV:A': (times(4, 5), np.array([8., 7.]))}
+    assert evaluator.evaluate(rows[:1], samples, current=rows) == {1}
+    # removed from the plan, the latch is dropped
+    assert evaluator.evaluate(rows[1:], {}, current=rows[1:]) == set()
+    assert list(evaluator.latches) == [rows[1]]
@@ -0,0 +1,40 @@
+import pytest
+
+from engine_tools import flap_detect
+
+
+def test_flapping_starts_and_stops():
+    detector = flap_detect.FlapDetector(
+        window=100, transitions=4, clear_transitions=1)
+    # trigger 1 alternates every 10 seconds, trigger 2 stays tripped
+    started = set()
+    for i in range(5):
+        tripped = {2} | ({1} if i % 2 else set())
+        new, stopped = detector.update({1, 2}, tripped, 10.0 * i)
+        started |= new
+        assert stopped == set()
+    # transitions at 10, 20, 30 and 40
+    assert started == {1}
+    assert detector.flapping == {1}
+
+    # stable again, the transitions leave the window one by one
+    assert detector.update({1, 2}, {2}, 125.0) == (set(), set())
+    assert detector.update({1, 2}, {2}, 135.0) == (set(), {1})
+    assert detector.flapping == set()
+
+
+def test_slow_transitions_dont_flap():
+    detector = flap_detect.FlapDetector(window=60, transitions=3)
+    for i in range(10):
+        started, _ = detector.update([7], [7] if i % 2 else [], 40.0 * i)
+        assert started == set()
+    assert detector.flapping == set()
+
+
+def test_stabilizes_without_evaluation():
+    detector = flap_detect.FlapDetector(window=50, transitions=2)
+    detector.update([1], [], 0.0)
+    detector.update([1], [1], 1.0)
+    assert detector.update([1], [], 2.0) == ({1}, set())
+    # trigger 1 isn't evaluated any more, it still stabilizes
+    assert detector.update([3], [3], 100.0) == (set(), {1})
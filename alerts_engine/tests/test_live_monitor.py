@@ -0,0 +1,118 @@
+import pytest
+
+import datetime
+
+from engine_tools import live_monitor
+
+
+class fake_plan:
+    def __init__(self, rows, expressions=()):
+        self.rows = rows
+        self.expressions = list(expressions)
+
+    def trigger_rows(self):
+        return self.rows
+
+    def expression_rows(self):
+        return self.expressions
+
+
+class fake_scanner:
+    pv_index = None
+
+    def __init__(self):
+        self.notified = []
+        self.flushed = 0
+
+    def notify(self, plan, tripped_trigger_pk, target_time, evaluated=None):
+        self.notified.append((tripped_trigger_pk, evaluated))
+        return list(tripped_trigger_pk)
+
+    def flushDigest(self, force=False):
+        self.flushed = self.flushed + 1
+        return 0
+
+
+def test_monitor_evaluates_changed_pv_only():
+    source = live_monitor.SimulatedPvSource()
+    scanner = fake_scanner()
+    monitor = live_monitor.LiveMonitor(scanner, source)
+    monitor.refresh(fake_plan([
+        (1, 'PV:A', '>', 5),
+        (2, 'PV:A', '<', 0),
+        (3, 'PV:B', '>', 5),
+    ]))
+    assert sorted(source.subscriptions()) == ['PV:A', 'PV:B']
+
+    source.put('PV:A', 1)
+    assert scanner.notified == [(set(), {1, 2})]
+    source.put('PV:A', 10)
+    assert scanner.notified[-1] == ({1}, {1, 2})
+    source.put('PV:B', 10, datetime.datetime.now())
+    assert scanner.notified[-1] == ({1, 3}, {1, 2, 3})
+    source.put('PV:C', 10)
+    assert len(scanner.notified) == 3
+
+
+def test_monitor_notifies_on_changes_only():
+    source = live_monitor.SimulatedPvSource()
+    scanner = fake_scanner()
+    monitor = live_monitor.LiveMonitor(scanner, source)
+    monitor.refresh(fake_plan([(1, 'PV:A', '>', 5)]))
+    source.put('PV:A', 10)
+    source.put('PV:A', 11)
+    source.put('PV:A', 12)
+    assert scanner.notified == [({1}, {1})]
+    source.put('PV:A', 0)
+    assert scanner.notified[-1] == (set(), {1})
+    assert len(scanner.notified) == 2
+
+
+def test_monitor_refresh_updates_subscriptions():
+    source = live_monitor.SimulatedPvSource()
+    monitor = live_monitor.LiveMonitor(fake_scanner(), source)
+    monitor.refresh(fake_plan([(1, 'PV:A', '>', 5), (2, 'PV:B', '>', 5)]))
+    monitor.refresh(fake_plan([(2, 'PV:B', '>', 5), (3, 'PV:C', '>', 5)]))
+    assert sorted(source.subscriptions()) == ['PV:B', 'PV:C']
+    source.close()
+    assert source.subscriptions() == []
+
+
+def test_monitor_warns_about_expressions(caplog):
+    source = live_monitor.SimulatedPvSource()
+    monitor = live_monitor.LiveMonitor(fake_scanner(), source)
+    monitor.refresh(fake_plan(
+        [(1, 'PV:A', '>', 5)],
+        [(2, 'PV:B', 'value > 5 for 3s')],
+    ))
+    assert source.subscriptions() == ['PV:A']
+    assert "1 expression triggers aren't evaluated" in caplog.text
+
+
+class fake_shard:
+    def __init__(self, owned):
+        self.owned = set(owned)
+
+    def refresh(self):
+        pass
+
+    def owns(self, pv_name):
+        return pv_name in self.owned
+
+
+def test_monitor_forgets_tripped_pv_leaving_shard():
+    source = live_monitor.SimulatedPvSource()
+    scanner = fake_scanner()
+    scanner.shard = fake_shard(['PV:A', 'PV:B'])
+    monitor = live_monitor.LiveMonitor(scanner, source)
+    plan = fake_plan([(1, 'PV:A', '>', 5), (2, 'PV:B', '>', 5)])
+    monitor.refresh(plan)
+    source.put('PV:A', 10)
+    assert scanner.notified[-1] == ({1}, {1})
+
+    # same plan, but PV:A moved to another engine
+    scanner.shard.owned.discard('PV:A')
+    monitor.refresh(plan)
+    assert source.subscriptions() == ['PV:B']
+    source.put('PV:B', 10)
+    assert scanner.notified[-1] == ({2}, {2})
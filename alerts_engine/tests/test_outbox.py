@@ -0,0 +1,60 @@
+import pytest
+
+import time
+
+from engine_tools import django_connect
+django_connect.prepare()
+from engine_tools import email_wrapper
+from engine_tools import outbox
+
+
+def make_outbox(path=":memory:", **kwargs):
+    emailer = email_wrapper.EmailWrapper('localhost', 'EASE')
+    return outbox.NotificationOutbox(emailer, path, **kwargs)
+
+
+def test_drain_retries_then_fails(smtp):
+    box = make_outbox(max_attempts=2, backoff=0)
+    for i in range(3):
+        box.enqueue(['a@x.org'], 'subj', str(i))
+    box.enqueue('refuse@x.org', 'subj', 'bad')
+    assert box.pending() == 4
+
+    assert box.drain() == 3
+    assert box.pending() == 0
+    assert len(box.failed()) == 1
+    assert box.failed()[0][1] == ['refuse@x.org']
+    assert sum(len(conn.sent) for conn in smtp.connections) == 3
+
+
+def test_backoff_delays_retry(smtp):
+    box = make_outbox(backoff=60)
+    box.enqueue('refuse@x.org', 'subj', 'bad')
+    assert box.drain() == 0
+    assert box.pending() == 1
+    assert box.drain() == 0
+    assert box.failed() == []
+
+
+def test_queue_survives_restart(smtp, tmpdir):
+    path = str(tmpdir.join('outbox.sqlite3'))
+    box = make_outbox(path)
+    box.enqueue('a@x.org', 'subj', 'kept')
+    box.close()
+
+    box = make_outbox(path)
+    assert box.pending() == 1
+    assert box.drain() == 1
+    assert smtp.connections[-1].sent[0]['To'] == 'a@x.org'
+
+
+@pytest.mark.timeout(2)
+def test_workers_deliver(smtp):
+    box = make_outbox(workers=2)
+    box.start()
+    for i in range(10):
+        box.enqueue('a@x.org', 'subj', str(i))
+    while box.pending():
+        time.sleep(.01)
+    box.stop()
+    assert sum(len(conn.sent) for conn in smtp.connections) == 10
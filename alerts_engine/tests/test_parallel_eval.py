@@ -0,0 +1,69 @@
+import pytest
+
+import os
+import numpy as np
+
+from engine_tools import parallel_eval
+from engine_tools import trigger_eval
+
+
+def make_scan(n_pvs=50, per_pv=4):
+    rng = np.random.RandomState(0)
+    samples = {
+        "PV:{}".format(i): rng.uniform(0, 10, rng.randint(0, 20))
+        for i in range(n_pvs)
+    }
+    rows = []
+    for name in samples:
+        for op in trigger_eval.OPERATORS[:per_pv]:
+            rows.append((len(rows), name, op, float(rng.randint(0, 10))))
+    return rows, samples
+
+
+def test_shared_samples_roundtrip():
+    _, samples = make_scan()
+    with parallel_eval.SharedSamples(samples) as shared:
+        mapped = parallel_eval.open_samples(
+            shared.path, shared.length, shared.offsets)
+        for name, values in samples.items():
+            assert np.array_equal(mapped[name], values)
+    assert not os.path.exists(shared.path)
+
+
+def test_split_rows_keeps_pvs_together():
+    rows, _ = make_scan()
+    batches = parallel_eval.split_rows(rows, 4)
+    assert len(batches) == 4
+    assert sorted(sum(batches, [])) == sorted(rows)
+    owners = {}
+    for i, batch in enumerate(batches):
+        for row in batch:
+            assert owners.setdefault(row[1], i) == i
+
+
+@pytest.mark.timeout(30)
+def test_parallel_matches_serial():
+    rows, samples = make_scan()
+    serial = trigger_eval.TriggerEvaluator(rows).evaluate(samples)
+    evaluator = parallel_eval.ParallelEvaluator(processes=3, min_rows=0)
+    try:
+        assert evaluator.evaluate(rows, samples) == serial
+    finally:
+        evaluator.close()
+    assert serial
+
+
+@pytest.mark.timeout(30)
+def test_shared_between_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    rows, samples = make_scan()
+    serial = trigger_eval.TriggerEvaluator(rows).evaluate(samples)
+    evaluator = parallel_eval.ParallelEvaluator(processes=2, min_rows=0)
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(
+                lambda _: evaluator.evaluate(rows, samples), range(6)))
+    finally:
+        evaluator.close()
+    assert results == [serial] * 6
+    evaluator.close()
@@ -0,0 +1,48 @@
+import pytest
+
+from engine_tools import pv_index
+
+
+class counting_search:
+    def __init__(self, matches):
+        self.matches = matches
+        self.calls = []
+
+    def __call__(self, glob):
+        self.calls.append(glob)
+        return self.matches.get(glob, [])
+
+
+def test_parse_value_src():
+    assert pv_index.parse_value_src(None) == []
+    assert pv_index.parse_value_src("") == []
+    assert pv_index.parse_value_src("PV:A, PV:B,,PV:C ") == [
+        "PV:A", "PV:B", "PV:C"]
+
+
+def test_resolve_dedup_and_glob():
+    search = counting_search({"PV:*": ["PV:A", "PV:B"]})
+    index = pv_index.PvIndex(search)
+    assert index.resolve("PV:B,PV:*,PV:A,PV:C") == ["PV:B", "PV:A", "PV:C"]
+    assert index.resolve("PV:*") == ["PV:A", "PV:B"]
+    assert search.calls == ["PV:*"]
+
+
+def test_glob_ttl_expiry():
+    search = counting_search({"PV:?": ["PV:A"]})
+    index = pv_index.PvIndex(search, ttl=0)
+    index.resolve("PV:?")
+    index.resolve("PV:?")
+    assert search.calls == ["PV:?", "PV:?"]
+
+
+def test_failed_search_keeps_stale_expansion():
+    search = counting_search({"PV:*": ["PV:A"]})
+    index = pv_index.PvIndex(search, ttl=0)
+    assert index.resolve("PV:*") == ["PV:A"]
+
+    def broken(glob):
+        raise IOError("archiver unreachable")
+    index.search = broken
+    assert index.resolve("PV:*") == ["PV:A"]
+    assert index.resolve("OTHER:*") == []
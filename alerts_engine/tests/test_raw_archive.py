@@ -0,0 +1,115 @@
+import pytest
+
+import datetime
+import http.server
+import json
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from engine_tools import raw_archive
+from engine_tools import record_scanner
+
+
+class archiver_handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves three samples for any PV from the retrieval service's url and two
+    PVs for any search. PVs named MISSING are answered with a 404.
+    """
+    def do_GET(self):
+        if self.path.startswith('/mgmt/bpl/getAllPVs'):
+            self.reply(['PV:A1', 'PV:A2'])
+            return
+        if 'MISSING' in self.path:
+            self.send_error(404)
+            return
+        self.reply([{
+            'meta': {'name': 'PV:A', 'PREC': '0'},
+            'data': [
+                {'secs': 1514764800 + i, 'nanos': 0, 'val': float(i),
+                 'severity': 0, 'status': 0}
+                for i in range(3)
+            ],
+        }])
+
+    def reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class archiver_server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def archiver():
+    server = archiver_server(('127.0.0.1', 0), archiver_handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.parametrize("xarray", [False, True])
+def test_get_from_worker_thread(archiver, xarray):
+    host, port = archiver
+    arch = raw_archive.RawArchive(host, data_port=port, timeout=2)
+    start = datetime.datetime(2018, 1, 1)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        data = executor.submit(
+            arch.get, 'PV:A', start, start, xarray=xarray).result()
+    if xarray:
+        assert list(data.sel(field='vals').values) == [0., 1., 2.]
+    else:
+        assert list(data['val']) == [0., 1., 2.]
+
+
+@pytest.mark.timeout(5)
+def test_search_from_worker_thread(archiver):
+    host, port = archiver
+    arch = raw_archive.RawArchive(host, mgmt_port=port, timeout=2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        names = executor.submit(arch.search, 'PV:A*').result()
+    assert names == ['PV:A1', 'PV:A2']
+
+
+def test_search_failure_raises():
+    # nothing listens on port 1
+    arch = raw_archive.RawArchive('127.0.0.1', mgmt_port=1, timeout=2)
+    with pytest.raises(IOError):
+        arch.search('PV:A*')
+
+
+@pytest.mark.timeout(5)
+def test_scanner_concurrent_xarray(archiver):
+    host, port = archiver
+    scanner = record_scanner.TriggerScan(
+        max_workers=4,
+        xarray=True,
+        archive=raw_archive.RawArchive(host, data_port=port, timeout=2),
+    )
+    names = ["PV:{}".format(i) for i in range(8)]
+    data = scanner.archPull(names, end_time=datetime.datetime.now())
+    assert sorted(data) == names
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.parametrize("max_workers", [None, 4])
+def test_scanner_drops_missing_pv(archiver, max_workers):
+    host, port = archiver
+    scanner = record_scanner.TriggerScan(
+        max_workers=max_workers,
+        archive=raw_archive.RawArchive(host, data_port=port, timeout=2),
+    )
+    data = scanner.archPull(
+        ["PV:A", "PV:MISSING"], end_time=datetime.datetime.now())
+    assert sorted(data) == ["PV:A"]
@@ -1,4 +1,387 @@
 import pytest
 
 from engine_tools import record_scanner
+from engine_tools import archive_cache
 
+import datetime
+import threading
+import time
+
+
+class fake_archive:
+    """
+    Stand-in for archapp's EpicsArchive. Returns the PV name as its data,
+    sleeps for PVs listed in slow and raises for PVs listed in broken.
+    """
+    def __init__(self, slow=(), broken=(), delay=1):
+        self.slow = slow
+        self.broken = broken
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def get(self, pvname, *args, **kwargs):
+        with self.lock:
+            self.calls.append(pvname)
+            self.in_flight = self.in_flight + 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(.01)
+            if pvname in self.slow:
+                time.sleep(self.delay)
+            if pvname in self.broken:
+                raise IOError("archiver unreachable")
+            return pvname
+        finally:
+            with self.lock:
+                self.in_flight = self.in_flight - 1
+
+
+def make_scanner(arch, **kwargs):
+    scanner = record_scanner.TriggerScan(**kwargs)
+    scanner.arch = arch
+    return scanner
+
+
+def test_archPull_sequential():
+    arch = fake_archive()
+    scanner = make_scanner(arch)
+    names = ["PV:{}".format(i) for i in range(5)]
+    data = scanner.archPull(names)
+    assert data == {name: name for name in names}
+    assert arch.max_in_flight == 1
+
+
+@pytest.mark.timeout(2)
+def test_archPull_concurrent_bounded():
+    arch = fake_archive()
+    scanner = make_scanner(arch, max_workers=4)
+    names = ["PV:{}".format(i) for i in range(20)]
+    data = scanner.archPull(names)
+    assert data == {name: name for name in names}
+    assert 1 < arch.max_in_flight <= 4
+
+
+@pytest.mark.timeout(2)
+def test_archPull_concurrent_isolates_failures():
+    arch = fake_archive(slow=["PV:SLOW"], broken=["PV:BROKEN"], delay=5)
+    scanner = make_scanner(arch, max_workers=4, fetch_timeout=.2)
+    names = ["PV:SLOW", "PV:BROKEN", "PV:A", "PV:B"]
+    start = time.monotonic()
+    data = scanner.archPull(names, end_time=datetime.datetime.now())
+    assert time.monotonic() - start < 1
+    assert data == {"PV:A": "PV:A", "PV:B": "PV:B"}
+
+
+class series_archive:
+    """
+    Stand-in for EpicsArchive serving one sample per second per PV, including
+    the last sample before the requested start like the archiver does.
+    """
+    def __init__(self, origin):
+        self.origin = origin
+        self.requests = []
+
+    def get(self, pvname, xarray=True, start=None, end=None):
+        import numpy as np
+        import xarray as xr
+        self.requests.append((pvname, start, end))
+        first = int((start - self.origin).total_seconds())
+        last = int((end - self.origin).total_seconds())
+        seconds = np.arange(max(first - 1, 0), last + 1)
+        stamps = np.datetime64(self.origin, 'ns') \
+            + seconds.astype('timedelta64[s]')
+        data = np.zeros((3, len(seconds)), dtype=object)
+        data[0] = seconds.astype(float)
+        arr = xr.DataArray(
+            data,
+            coords=[['vals', 'sevr', 'stat'], stamps],
+            dims=['field', 'time'],
+            name=pvname,
+        )
+        return xr.merge([arr])
+
+
+def test_archPullIncremental():
+    origin = datetime.datetime(2018, 1, 1)
+    arch = series_archive(origin)
+    scanner = make_scanner(
+        arch,
+        rep_t=datetime.timedelta(seconds=10),
+        lookback=datetime.timedelta(seconds=60),
+    )
+    end = origin + datetime.timedelta(seconds=100)
+    scanner.archPullIncremental(["PV:A"], end)
+    assert arch.requests[-1][1] == end - datetime.timedelta(seconds=60)
+    _, values = scanner.samples.window("PV:A", end)
+    assert values[0] == 39 and values[-1] == 100
+
+    end = end + datetime.timedelta(seconds=10)
+    scanner.archPullIncremental(["PV:A"], end)
+    assert arch.requests[-1][1] == end - datetime.timedelta(seconds=10)
+    _, values = scanner.samples.window("PV:A", end)
+    assert list(values) == list(range(49, 111))
+
+
+def test_archPullIncremental_sample_cache(tmpdir):
+    from alert_config_app import sample_cache
+    origin = datetime.datetime(2018, 1, 1)
+    scanner = make_scanner(
+        series_archive(origin),
+        rep_t=datetime.timedelta(seconds=10),
+    )
+    scanner.sample_cache = sample_cache.SampleCache.create(
+        str(tmpdir.join("samples")), slots=4, capacity=8)
+    end = origin + datetime.timedelta(seconds=100)
+    scanner.archPullIncremental(["PV:A"], end)
+    scanner.archPullIncremental(["PV:A"], end + datetime.timedelta(seconds=5))
+    reader = sample_cache.SampleCache(str(tmpdir.join("samples")))
+    _, values = reader.read("PV:A")
+    assert list(values) == list(range(98, 106))
+
+
+class fake_bulk:
+    def __init__(self, broken=()):
+        self.broken = broken
+        self.requests = []
+
+    def get(self, pvs, start, end, xarray=False):
+        self.requests.append((list(pvs), start, end))
+        if set(pvs) & set(self.broken):
+            raise IOError("bad gateway")
+        return {name: "bulk:" + name for name in pvs}
+
+
+@pytest.mark.parametrize("max_workers", [None, 4])
+def test_archPullBulk(max_workers):
+    arch = fake_archive()
+    scanner = make_scanner(arch, max_workers=max_workers)
+    scanner.bulk_size = 3
+    scanner.bulk = fake_bulk(broken=["PV:4"])
+    end = datetime.datetime(2018, 1, 1, 1)
+    starts = {
+        "PV:{}".format(i): end - datetime.timedelta(seconds=10 * i)
+        for i in range(7)
+    }
+    data = scanner.archPull(list(starts), end, starts)
+    # batches follow the window starts, each covering its PVs' windows
+    assert sorted(
+        (sorted(pvs), start) for pvs, start, _ in scanner.bulk.requests
+    ) == [
+        (["PV:0"], end),
+        (["PV:1", "PV:2", "PV:3"], starts["PV:3"]),
+        (["PV:4", "PV:5", "PV:6"], starts["PV:6"]),
+    ]
+    assert data["PV:0"] == "bulk:PV:0"
+    # the failed batch falls back to single PV requests
+    assert data["PV:5"] == "PV:5"
+    assert sorted(arch.calls) == ["PV:4", "PV:5", "PV:6"]
+
+
+def test_scanners_share_bulk_fetch():
+    bulk = fake_bulk()
+    shared = archive_cache.CachedArchive(bulk)
+    end = datetime.datetime(2018, 1, 1, 1)
+    starts = {
+        "PV:{}".format(i): end - datetime.timedelta(seconds=10)
+        for i in range(3)
+    }
+    scanners = [
+        make_scanner(fake_archive(), bulk_size=3, bulk=shared)
+        for _ in range(2)
+    ]
+    data = [scanner.archPull(list(starts), end, starts) for scanner in scanners]
+    assert data[0] == data[1] == {name: "bulk:" + name for name in starts}
+    # the second scan class is answered from the first one's request
+    assert len(bulk.requests) == 1
+    assert (shared.misses, shared.hits) == (1, 1)
+
+
+class stream_archive:
+    def __init__(self, values):
+        self.values = values
+        self.windows = []
+
+    def stream(self, pvname, start, end):
+        import json
+        self.windows.append((pvname, start, end))
+        body = json.dumps({"meta": {"name": pvname}, "data": [
+            {"secs": 1514764800 + i, "nanos": 0, "val": val}
+            for i, val in enumerate(self.values[pvname])
+        ]}).encode('utf-8')
+        return [body[i:i + 16] for i in range(0, len(body), 16)]
+
+
+class rows_plan:
+    def __init__(self, rows, expressions=()):
+        self.rows = rows
+        self.expressions = list(expressions)
+
+    def trigger_rows(self):
+        return self.rows
+
+    def expression_rows(self):
+        return self.expressions
+
+
+@pytest.mark.parametrize("max_workers", [None, 4])
+def test_scanStreamed(max_workers):
+    arch = stream_archive({"PV:A": [1., 5., 2.], "PV:B": [0., 0.]})
+    scanner = make_scanner(arch, max_workers=max_workers, stream=True)
+    plan = rows_plan([
+        (1, "PV:A", ">", 4.),
+        (2, "PV:A", "==", 2.),
+        (3, "PV:B", "!=", 0.),
+        (4, "PV:C", "<", 9.),
+    ])
+    end = datetime.datetime(2018, 1, 1)
+    tripped, evaluated = scanner.scanStreamed(plan, ["PV:A", "PV:B"], end)
+    assert tripped == {1, 2}
+    assert [row[0] for row in evaluated] == [1, 2, 3]
+    assert sorted(arch.windows) == [
+        ("PV:A", end - scanner.rep_t, end),
+        ("PV:B", end - scanner.rep_t, end),
+    ]
+
+
+class fake_extrema:
+    def __init__(self, broken=()):
+        self.broken = broken
+        self.requested = []
+
+    def get(self, pvs, start, end):
+        from engine_tools import trigger_eval
+        self.requested.extend(pvs)
+        if set(pvs) & set(self.broken):
+            raise IOError("bad gateway")
+        return {
+            name: trigger_eval.PvReduction(1, 0., 10., ())
+            for name in pvs
+        }
+
+
+def test_scanExtrema():
+    origin = datetime.datetime(2018, 1, 1)
+    arch = series_archive(origin)
+    scanner = make_scanner(arch, rep_t=datetime.timedelta(seconds=10))
+    scanner.extrema = fake_extrema(broken=["PV:C"])
+    scanner.bulk_size = 1
+    plan = rows_plan([
+        (1, "PV:A", ">", 5.),
+        (2, "PV:B", "==", 95.),
+        (3, "PV:B", ">", 500.),
+        (4, "PV:C", ">", 99.),
+    ])
+    end = origin + datetime.timedelta(seconds=100)
+    tripped, evaluated = scanner.scanExtrema(
+        plan, ["PV:A", "PV:B", "PV:C"], end)
+    assert tripped == {1, 2, 4}
+    assert [row[0] for row in evaluated] == [1, 2, 3, 4]
+    # PV:B has an == trigger, PV:C's extrema request failed
+    assert scanner.extrema.requested == ["PV:A", "PV:C"]
+    assert sorted(name for name, _, _ in arch.requests) == ["PV:B", "PV:C"]
+
+
+def test_scanExtrema_expressions():
+    origin = datetime.datetime(2018, 1, 1)
+    arch = series_archive(origin)
+    scanner = make_scanner(arch, rep_t=datetime.timedelta(seconds=10))
+    scanner.extrema = fake_extrema()
+    scanner.bulk_size = 1
+    plan = rows_plan(
+        [(1, "PV:A", ">", 5.)],
+        [
+            (2, "PV:B", "value > 95 for 3s"),
+            (3, "PV:B", 'pv("PV:C") - value > 0'),
+            (4, "PV:B", "value > 200"),
+        ],
+    )
+    end = origin + datetime.timedelta(seconds=100)
+    tripped, evaluated = scanner.scanExtrema(plan, ["PV:A", "PV:B"], end)
+    assert tripped == {1, 2}
+    assert [row[0] for row in evaluated] == [1, 2, 3, 4]
+    # the expression PVs are downloaded, including the referenced PV:C
+    assert scanner.extrema.requested == ["PV:A"]
+    assert sorted(name for name, _, _ in arch.requests) == ["PV:B", "PV:C"]
+
+
+def test_knownTriggers():
+    scanner = make_scanner(fake_archive())
+    rows = [
+        (1, "PV:A", ">", 5.),
+        (2, "PV:B", ">", 5.),
+        # a glob expanded to two PVs
+        (3, "PV:C1", ">", 5.),
+        (3, "PV:C2", ">", 5.),
+        (4, "PV:D", "value > 5"),
+    ]
+    # PV:B failed to fetch, PV:C2 belongs to another worker
+    evaluated = [rows[0], rows[2], rows[4]]
+    assert scanner.knownTriggers(rows, evaluated, set()) == {1, 4}
+    # a trip from one of its PVs is enough
+    assert scanner.knownTriggers(rows, evaluated, {3}) == {1, 3, 4}
+
+
+def test_scanBuffered_quiet_pv():
+    from engine_tools import bulk_fetch
+    origin = datetime.datetime(2018, 1, 1)
+    scanner = make_scanner(
+        series_archive(origin),
+        rep_t=datetime.timedelta(seconds=10),
+        lookback=datetime.timedelta(seconds=60),
+    )
+    plan = rows_plan([(1, "PV:A", ">", 50.), (2, "PV:B", ">", 500.)])
+    end = origin + datetime.timedelta(seconds=100)
+    tripped, evaluated = scanner.scanBuffered(plan, ["PV:A", "PV:B"], end)
+    assert tripped == {1}
+    assert [row[0] for row in evaluated] == [1, 2]
+
+    # no new samples in the next window, the buffered ones are evaluated
+    scanner.bulk_size = 10
+    scanner.bulk = bulk_fetch.BulkArchive("archiver")
+    scanner.bulk.get_raw = lambda pvs, start, end: []
+    end = end + datetime.timedelta(seconds=10)
+    tripped, evaluated = scanner.scanBuffered(plan, ["PV:A", "PV:B"], end)
+    assert tripped == {1}
+    assert [row[0] for row in evaluated] == [1, 2]
+
+
+class scripted_archive:
+    """
+    Stand-in for RawArchive serving one value per request and PV, taken from
+    values[pvname] in order. None raises like an unreachable archiver.
+    """
+    def __init__(self, values):
+        self.values = {name: list(vals) for name, vals in values.items()}
+
+    def get(self, pvname, start=None, end=None):
+        import numpy as np
+        from engine_tools import raw_archive
+        value = self.values[pvname].pop(0)
+        if value == None:
+            raise IOError("archiver unreachable")
+        samples = np.zeros(1, dtype=raw_archive.SAMPLE_DTYPE)
+        samples['time'] = np.datetime64(end, 'ns')
+        samples['val'] = value
+        return samples
+
+
+def test_scanBuffered_keeps_latch_over_failed_fetch():
+    origin = datetime.datetime(2018, 1, 1)
+    step = datetime.timedelta(seconds=10)
+    arch = scripted_archive({"PV:A": [12., None, 8.], "PV:B": [0., 0., 0.]})
+    scanner = make_scanner(arch, rep_t=step, lookback=step)
+    plan = rows_plan([], [
+        (1, "PV:A", "value > 10 deadband 5"),
+        (2, "PV:B", "value > 10"),
+    ])
+    names = ["PV:A", "PV:B"]
+    assert scanner.scanBuffered(plan, names, origin + step)[0] == {1}
+    # PV:A fails, PV:B's expression is still evaluated
+    _, evaluated = scanner.scanBuffered(plan, names, origin + 2 * step)
+    assert [row[0] for row in evaluated] == [2]
+    assert plan.expressions[0] in scanner.expressions.latches
+    # 8 is within the deadband of the latch set two scans ago
+    assert scanner.scanBuffered(plan, names, origin + 3 * step)[0] == {1}
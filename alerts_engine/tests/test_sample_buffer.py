@@ -0,0 +1,67 @@
+import pytest
+
+import datetime
+import numpy as np
+
+from engine_tools import sample_buffer
+
+
+def times(*seconds):
+    return np.array(seconds, dtype='datetime64[s]').astype('datetime64[ns]')
+
+
+def test_ring_extend_skips_repeats():
+    ring = sample_buffer.SampleRing(capacity=2)
+    assert ring.extend(times(1, 2), [1., 2.]) == 2
+    # the archiver repeats the last sample before the requested start
+    assert ring.extend(times(2, 3, 4), [2., 3., 4.]) == 2
+    assert ring.capacity >= 4
+    t, v = ring.ordered()
+    assert list(v) == [1., 2., 3., 4.]
+    assert ring.last_time == times(4)[0]
+
+
+def test_ring_trim_and_window():
+    ring = sample_buffer.SampleRing(capacity=4)
+    ring.extend(times(1, 2, 3), [1., 2., 3.])
+    ring.trim(times(2)[0] + np.timedelta64(500, 'ms'))
+    ring.extend(times(4, 5), [4., 5.])
+    t, v = ring.ordered()
+    assert list(v) == [2., 3., 4., 5.]
+    # includes the value in effect at the window start
+    t, v = ring.window(times(3)[0] + np.timedelta64(500, 'ms'), times(4)[0])
+    assert list(v) == [3., 4.]
+
+
+def test_buffer_fetch_start():
+    lookback = datetime.timedelta(seconds=10)
+    buf = sample_buffer.SampleBuffer(lookback)
+    end = datetime.datetime(2018, 1, 1, 0, 1)
+    assert buf.fetch_start('PV:A', end) == end - lookback
+    last = end - datetime.timedelta(seconds=2)
+    buf.add('PV:A', np.array([np.datetime64(last, 'ns')]), [1.])
+    assert buf.fetch_start('PV:A', end) == last
+    later = end + datetime.timedelta(minutes=5)
+    assert buf.fetch_start('PV:A', later) == later - lookback
+    buf.retain([])
+    assert buf.rings == {}
+
+
+def test_raw_samples():
+    from engine_tools import raw_archive
+    data = {
+        'meta': {'name': 'PV:A'},
+        'data': [
+            {'secs': 1514764800, 'nanos': 5, 'val': 1.5,
+             'severity': 2, 'status': 3},
+            {'secs': 1514764801, 'nanos': 0, 'val': 'off',
+             'severity': 0, 'status': 0},
+        ],
+    }
+    samples = raw_archive.raw_samples(data)
+    assert samples['sevr'][0] == 2 and samples['stat'][0] == 3
+    assert samples['time'][1] - samples['time'][0] \
+        == np.timedelta64(999999995, 'ns')
+    times, values = sample_buffer.archive_samples(samples, 'PV:A')
+    assert values[0] == 1.5 and np.isnan(values[1])
+    assert len(raw_archive.raw_samples({})) == 0
@@ -0,0 +1,197 @@
+import pytest
+
+import datetime
+
+from engine_tools import scan_plan
+from django.contrib.auth.models import User
+from django.test import TestCase
+from alert_config_app.models import Alert, AlertState, Trigger, TriggerState
+
+
+class fake_clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class fake_plan:
+    def __init__(self, globs=False):
+        self.globs = globs
+        self.resolves = 0
+
+    def resolved(self):
+        self.resolves = self.resolves + 1
+        return self
+
+
+@pytest.fixture
+def config(monkeypatch):
+    state = {'version': 1, 'checks': 0, 'globs': False}
+
+    def current():
+        state['checks'] = state['checks'] + 1
+        return state['version']
+
+    monkeypatch.setattr(scan_plan.ConfigVersion, 'current', current)
+    monkeypatch.setattr(
+        scan_plan.ScanPlan, 'load',
+        classmethod(lambda cls, *args: fake_plan(state['globs'])),
+    )
+    return state
+
+
+def test_plan_cache_reloads_on_change(config):
+    plans = scan_plan.PlanCache()
+    plan = plans.get()
+    assert plans.get() is plan
+    assert plans.loads == 1
+    assert config['checks'] == 2
+    config['version'] = 2
+    assert plans.get() is not plan
+    assert plans.loads == 2
+    plans.invalidate()
+    plans.get()
+    assert plans.loads == 3
+
+
+def test_plan_cache_check_interval(config):
+    clock = fake_clock()
+    plans = scan_plan.PlanCache(check_interval=10.0, clock=clock)
+    plan = plans.get()
+    config['version'] = 2
+    clock.now = 5.0
+    assert plans.get() is plan
+    assert config['checks'] == 1
+    clock.now = 10.0
+    assert plans.get() is not plan
+    assert config['checks'] == 2
+
+
+def test_plan_cache_resolves_globs(config):
+    config['globs'] = True
+    plans = scan_plan.PlanCache()
+    plan = plans.get()
+    plans.get()
+    plans.get()
+    assert plans.loads == 1
+    assert plan.resolves == 2
+
+
+@pytest.mark.usefixtures('django_db')
+class TestNotifiable(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2018, 1, 1, 12)
+        self.alerts = {}
+        for name, lockout, last_sent in [
+                ('never sent', 60, None),
+                ('locked out', 60, 30),
+                ('lockout over', 60, 90),
+                ('no lockout', None, 0),
+        ]:
+            alert = Alert.objects.create(
+                name = name,
+                lockout_duration = lockout and datetime.timedelta(
+                    minutes=lockout),
+            )
+            Trigger.objects.create(
+                name = name, alert = alert, value_src = 'PV:A',
+                compare = '>', value = 0)
+            if last_sent != None:
+                AlertState.objects.filter(pk=alert.pk).update(
+                    last_sent = scan_plan.timezone.make_aware(
+                        self.now - datetime.timedelta(minutes=last_sent)))
+            self.alerts[name] = alert.pk
+
+    def test_notifiable(self):
+        plan = scan_plan.ScanPlan.load()
+        with self.assertNumQueries(1):
+            notifiable = plan.notifiable(self.alerts.values(), self.now)
+        assert notifiable == {
+            self.alerts[name]
+            for name in ['never sent', 'lockout over', 'no lockout']
+        }
+        # the last_sent read from the database is kept
+        assert plan.states[self.alerts['no lockout']].last_sent != None
+
+    def test_notifiable_after_mark_sent(self):
+        plan = scan_plan.ScanPlan.load()
+        pk = self.alerts['never sent']
+        plan.mark_sent([pk], self.now)
+        assert plan.notifiable([pk], self.now) == set()
+        later = self.now + datetime.timedelta(minutes=60)
+        assert plan.notifiable([pk], later) == {pk}
+
+    def test_notifiable_nothing(self):
+        plan = scan_plan.ScanPlan.load()
+        with self.assertNumQueries(0):
+            assert plan.notifiable([], self.now) == set()
+
+
+@pytest.mark.usefixtures('django_db')
+class TestScanPlanLoad(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=name, email=name + '@x.org')
+            for name in ['a', 'b', 'c']
+        ]
+        self.alerts = []
+        self.triggers = []
+        for i in range(10):
+            alert = Alert.objects.create(name='alert{}'.format(i))
+            alert.subscriber.add(*[
+                user.profile for user in self.users[:i % 3 + 1]])
+            self.alerts.append(alert)
+            for j in range(3):
+                self.triggers.append(Trigger.objects.create(
+                    name = 't{}.{}'.format(i, j),
+                    alert = alert,
+                    value_src = 'PV:{}'.format(j),
+                    compare = '>',
+                    value = 0,
+                ))
+        # without a value_src the trigger isn't scanned
+        Trigger.objects.create(name='unset', alert=self.alerts[0])
+
+    def test_load_query_count(self):
+        with self.assertNumQueries(5):
+            plan = scan_plan.ScanPlan.load()
+            # nothing is fetched lazily afterwards
+            recipients = {
+                alert.name: plan.recipients[pk]
+                for pk, alert in plan.alerts.items()
+            }
+            plan.states[self.alerts[0].pk].status
+        assert len(plan.triggers) == 30
+        assert sorted(plan.pv_names) == ['PV:0', 'PV:1', 'PV:2']
+        assert sorted(recipients['alert4']) == ['a@x.org', 'b@x.org']
+
+    def test_load_creates_missing_states(self):
+        AlertState.objects.filter(pk=self.alerts[0].pk).delete()
+        TriggerState.objects.filter(pk=self.triggers[0].pk).delete()
+        plan = scan_plan.ScanPlan.load()
+        assert plan.states[self.alerts[0].pk].pk == self.alerts[0].pk
+        assert TriggerState.objects.filter(pk=self.triggers[0].pk).exists()
+
+    def test_tripped_alerts_and_mark_sent(self):
+        plan = scan_plan.ScanPlan.load()
+        tripped = {
+            self.triggers[4].pk, self.triggers[3].pk, self.triggers[9].pk}
+        with self.assertNumQueries(0):
+            grouped = plan.tripped_alerts(tripped)
+        assert {
+            alert.name: [trigger.name for trigger in triggers]
+            for alert, triggers in grouped.items()
+        } == {'alert1': ['t1.0', 't1.1'], 'alert3': ['t3.0']}
+        assert sorted(plan.recipients[self.alerts[1].pk]) \
+            == ['a@x.org', 'b@x.org']
+
+        sent = datetime.datetime(2018, 1, 1, 12)
+        with self.assertNumQueries(1):
+            plan.mark_sent([alert.pk for alert in grouped], sent)
+        states = AlertState.objects.filter(last_sent__isnull=False)
+        assert sorted(state.alert_id for state in states) \
+            == [self.alerts[1].pk, self.alerts[3].pk]
+        assert plan.states[self.alerts[1].pk].last_sent \
+            == scan_plan.timezone.make_aware(sent)
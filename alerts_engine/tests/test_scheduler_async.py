@@ -98,3 +98,150 @@ def test_non_blocking_sigterm(limited_counter_class):
 '''
    
     
+
+
+class slow_first_task:
+    def __init__(self, delay):
+        self.delay = delay
+        self.threads = set()
+        self.targets = []
+
+    def task(self, target_time=None, *args, **kwargs):
+        self.threads.add(threading.get_ident())
+        self.targets.append(target_time)
+        if len(self.targets) == 1:
+            time.sleep(self.delay)
+
+
+@pytest.mark.timeout(tmo)
+@pytest.mark.parametrize("overrun,ticks,missed", [
+    (scheduler_async.RUN_LATE, [0, 1, 2, 3], 0),
+    (scheduler_async.COALESCE, [0, 2, 3], 1),
+    (scheduler_async.SKIP, [0, 3], 2),
+])
+def test_overrun_policy(overrun, ticks, missed):
+    slow = slow_first_task(.25)
+    z = scheduler_async.EventMgr(
+        datetime.timedelta(seconds=.1),
+        end=datetime.datetime.now() + datetime.timedelta(seconds=.38),
+        block=True,
+        task = slow.task,
+        overrun = overrun,
+    )
+    z.start()
+    assert [t.iteration for t in z.ticks] == ticks
+    assert z.ticks[0].missed == missed
+    assert z.ticks[0].duration >= .25
+    # target times stay on the grid whatever the policy
+    interval = datetime.timedelta(seconds=.1)
+    for stats in z.ticks:
+        assert stats.target_time == z.start_wall + stats.iteration * interval
+
+
+@pytest.mark.timeout(tmo)
+def test_run_in_executor(counter_class):
+    slow = slow_first_task(0)
+    z = scheduler_async.EventMgr(
+        datetime.timedelta(seconds=.01),
+        end=datetime.datetime.now() + datetime.timedelta(seconds=.1),
+        block=True,
+        task = slow.task,
+        run_in_executor = True,
+    )
+    z.start()
+    assert 5 <= len(slow.targets) <= 10
+    assert threading.get_ident() not in slow.threads
+    assert z.last_tick.duration < .01
+
+
+def test_invalid_overrun():
+    with pytest.raises(ValueError):
+        scheduler_async.EventMgr(datetime.timedelta(seconds=1), overrun='x')
+
+
+@pytest.mark.timeout(tmo)
+def test_task_scheduler_rates():
+    fast = slow_first_task(0)
+    slow = slow_first_task(0)
+    z = scheduler_async.TaskScheduler(
+        end=datetime.datetime.now() + datetime.timedelta(seconds=.35),
+    )
+    z.add("fast", datetime.timedelta(seconds=.05), fast.task)
+    z.add("slow", datetime.timedelta(seconds=.2), slow.task)
+    z.start()
+    assert 6 <= len(fast.targets) <= 8
+    assert len(slow.targets) == 2
+    assert slow.targets[1] - slow.targets[0] == datetime.timedelta(seconds=.2)
+    assert threading.get_ident() not in fast.threads | slow.threads
+    with pytest.raises(ValueError):
+        z.add("fast", datetime.timedelta(seconds=1), fast.task)
+
+
+@pytest.mark.timeout(tmo)
+def test_task_scheduler_priority():
+    order = []
+    z = scheduler_async.TaskScheduler(max_workers=1)
+    z.add("low", datetime.timedelta(seconds=1), lambda t: order.append("low"),
+          priority=1)
+    z.add("high", datetime.timedelta(seconds=1),
+          lambda t: order.append("high"))
+    z.add("stop", datetime.timedelta(seconds=.05), limited_stop(2),
+          priority=2)
+    z.start()
+    assert order == ["high", "low"]
+
+
+def limited_stop(runs):
+    count = []
+
+    def task(target_time):
+        count.append(target_time)
+        if len(count) >= runs:
+            raise scheduler_async.EndRun
+    return task
+
+
+@pytest.mark.timeout(tmo)
+@pytest.mark.parametrize("overrun,ticks", [
+    (scheduler_async.RUN_LATE, [0, 1, 2, 3]),
+    (scheduler_async.COALESCE, [0, 2, 3]),
+    (scheduler_async.SKIP, [0, 3]),
+])
+def test_task_scheduler_overrun(overrun, ticks):
+    slow = slow_first_task(.25)
+    z = scheduler_async.TaskScheduler(
+        end=datetime.datetime.now() + datetime.timedelta(seconds=.38),
+    )
+    ptask = z.add(
+        "slow", datetime.timedelta(seconds=.1), slow.task, overrun=overrun)
+    z.start()
+    assert sorted(t.iteration for t in ptask.ticks) == ticks
+    assert ptask.ticks[0].duration >= .25
+
+
+@pytest.mark.timeout(tmo)
+def test_task_scheduler_concurrency():
+    slow = slow_first_task(.25)
+    z = scheduler_async.TaskScheduler(
+        end=datetime.datetime.now() + datetime.timedelta(seconds=.18),
+    )
+    ptask = z.add(
+        "slow", datetime.timedelta(seconds=.1), slow.task, concurrency=2)
+    z.start()
+    # the second tick starts while the first is still running
+    assert [t.iteration for t in ptask.ticks] == [1]
+    assert len(slow.targets) == 2
+
+
+def test_task_scheduler_backlog_bounded():
+    z = scheduler_async.TaskScheduler()
+    ptask = z.add(
+        "slow", datetime.timedelta(seconds=1), lambda t: None,
+        overrun=scheduler_async.RUN_LATE, max_backlog=3,
+    )
+    ptask.running = 1
+    for tick in range(10):
+        z._tick(ptask, tick, 0.)
+    # only the latest ticks are kept
+    assert list(ptask.backlog) == [7, 8, 9]
+    assert ptask.missed == 7
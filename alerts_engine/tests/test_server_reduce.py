@@ -0,0 +1,44 @@
+import pytest
+
+import datetime
+
+from engine_tools import server_reduce
+
+
+def bins(name, *values):
+    return {
+        'meta': {'name': name},
+        'data': [
+            {'secs': 1514764800 + 10 * i, 'nanos': 0, 'val': val}
+            for i, val in enumerate(values)
+        ],
+    }
+
+
+def test_operator_url():
+    extrema = server_reduce.ExtremaArchive("archiver", bin_size=10)
+    start = datetime.datetime(2018, 1, 1)
+    url = extrema.url(["PV:A"], start, start)
+    assert "pv=min_10%28PV%3AA%29&pv=max_10%28PV%3AA%29" in url
+
+
+def test_get_folds_bins():
+    extrema = server_reduce.ExtremaArchive("archiver", bin_size=10)
+    extrema.get_raw = lambda pvs, start, end: [
+        bins("min_10(PV:A)", 3., 1.),
+        bins("max_10(PV:A)", 7., 9.),
+        bins("min_10(PV:B)"),
+        bins("max_10(PV:B)"),
+    ]
+    reductions = extrema.get(["PV:A", "PV:B"], None, None)
+    assert list(reductions) == ["PV:A"]
+    assert reductions["PV:A"][:3] == (2, 1., 9.)
+
+
+def test_get_matches_by_order():
+    extrema = server_reduce.ExtremaArchive("archiver", bin_size=10)
+    extrema.get_raw = lambda pvs, start, end: [
+        bins("PV:A", 3.), bins("PV:A", 4.),
+    ]
+    reduction = extrema.get(["PV:A"], None, None)["PV:A"]
+    assert (reduction.minimum, reduction.maximum) == (3., 4.)
@@ -0,0 +1,39 @@
+import pytest
+
+from engine_tools import sharding
+
+
+names = ["XCS:PV:{}".format(i) for i in range(2000)]
+
+
+def test_ring_partition_even():
+    ring = sharding.HashRing(["a", "b", "c", "d"])
+    shares = ring.partition(names)
+    assert sorted(sum(shares.values(), [])) == sorted(names)
+    for share in shares.values():
+        assert 300 < len(share) < 700
+    assert sharding.HashRing().owner("XCS:PV:0") == None
+
+
+def test_ring_minimal_movement():
+    before = sharding.HashRing(["a", "b", "c"])
+    after = sharding.HashRing(["a", "b", "c", "d"])
+    moved = [name for name in names if before.owner(name) != after.owner(name)]
+    # only the PVs taken over by the new node move
+    assert all(after.owner(name) == "d" for name in moved)
+    assert len(moved) < len(names) / 2
+
+
+def test_coordinator_rebalance():
+    members = ["a", "b"]
+    shard = sharding.ShardCoordinator("a")
+    shard.heartbeat = lambda now=None: None
+    shard.members = lambda now=None: list(members)
+    assert shard.refresh()
+    assert not shard.refresh()
+    share = shard.share(names)
+    assert 0 < len(share) < len(names)
+    # b died, a takes over everything
+    members.remove("b")
+    assert shard.refresh()
+    assert shard.share(names) == names
@@ -0,0 +1,56 @@
+import pytest
+
+import json
+import numpy as np
+
+from engine_tools import stream_decode
+from engine_tools import trigger_eval
+
+
+def response(values, name="PV:A"):
+    return json.dumps([{
+        "meta": {"name": name, "PREC": "3"},
+        "data": [
+            {"secs": 1514764800 + i, "nanos": 0, "val": val,
+             "severity": 0, "status": 0, "fields": {"DESC": "x"}}
+            for i, val in enumerate(values)
+        ],
+    }]).encode('utf-8')
+
+
+def chunked(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_samples_batches(chunk_size):
+    values = [float(i) * 1.5 for i in range(25)]
+    batches = list(stream_decode.iter_samples(
+        chunked(response(values), chunk_size), batch_size=10))
+    assert [len(samples) for _, samples in batches] == [10, 10, 5]
+    assert batches[0][0]["name"] == "PV:A"
+    decoded = np.concatenate([samples['val'] for _, samples in batches])
+    assert list(decoded) == values
+
+
+def test_reduce_stream_matches_reduce_samples():
+    values = [3., 1e-7, 12345.678, -4., 3.]
+    eq_values = [3., 5.]
+    streamed = stream_decode.reduce_stream(
+        chunked(response(values), 5), eq_values, batch_size=2)
+    expected = trigger_eval.reduce_samples(values, eq_values)
+    assert streamed.count == expected.count
+    assert streamed.minimum == expected.minimum
+    assert streamed.maximum == expected.maximum
+    assert list(streamed.equal) == list(expected.equal)
+
+
+@pytest.mark.parametrize("body", [b"", b"[]", b"[{}]", b'{"meta": {}}',
+                                  b'[{"meta": {"name": "PV:A"}, "data": []}]'])
+def test_reduce_stream_empty(body):
+    assert stream_decode.reduce_stream(chunked(body, 3)).count == 0
+
+
+def test_truncated_response():
+    with pytest.raises(ValueError):
+        stream_decode.reduce_stream(chunked(response([1., 2.])[:-20], 8))
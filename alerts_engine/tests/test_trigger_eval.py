@@ -0,0 +1,82 @@
+import pytest
+
+import numpy as np
+import xarray as xr
+
+from engine_tools import trigger_eval
+
+
+samples = {
+    'PV:A': np.array([1.0, 2.0, 3.0]),
+    'PV:B': np.array([5.0, 5.0, np.nan]),
+    'PV:EMPTY': np.zeros(0),
+}
+
+
+@pytest.mark.parametrize("compare,value,pv,tripped", [
+    ('==', 2, 'PV:A', True),
+    ('==', 2.5, 'PV:A', False),
+    ('<=', 1, 'PV:A', True),
+    ('<', 1, 'PV:A', False),
+    ('>=', 3, 'PV:A', True),
+    ('>', 3, 'PV:A', False),
+    ('!=', 5, 'PV:B', False),
+    ('!=', 4, 'PV:B', True),
+    ('!=', 1, 'PV:A', True),
+    ('>', -1, 'PV:EMPTY', False),
+    ('!=', 0, 'PV:EMPTY', False),
+    ('>', -1, 'PV:MISSING', False),
+])
+def test_single_trigger(compare, value, pv, tripped):
+    evaluator = trigger_eval.TriggerEvaluator([(1, pv, compare, value)])
+    assert evaluator.evaluate(samples) == ({1} if tripped else set())
+
+
+def test_batch_matches_individual():
+    rows = []
+    pk = 0
+    for pv in ('PV:A', 'PV:B', 'PV:EMPTY'):
+        for compare in trigger_eval.OPERATORS:
+            for value in (0, 1, 2, 3, 5, 6):
+                pk = pk + 1
+                rows.append((pk, pv, compare, value))
+    expected = set()
+    for row in rows:
+        expected |= trigger_eval.TriggerEvaluator([row]).evaluate(samples)
+    assert trigger_eval.TriggerEvaluator(rows).evaluate(samples) == expected
+    assert len(expected) > 0
+
+
+def test_incomplete_triggers_skipped():
+    evaluator = trigger_eval.TriggerEvaluator([
+        (1, 'PV:A', None, 1),
+        (2, 'PV:A', '>', None),
+        (3, 'PV:A', '~=', 1),
+        (4, 'PV:A', '>', 1),
+    ])
+    assert len(evaluator) == 1
+    assert evaluator.evaluate(samples) == {4}
+
+
+def test_multi_pv_trigger():
+    evaluator = trigger_eval.TriggerEvaluator([
+        (1, 'PV:A', '>', 4),
+        (1, 'PV:B', '>', 4),
+    ])
+    assert evaluator.evaluate(samples) == {1}
+
+
+def test_archive_values():
+    times = np.array(['2018-01-01T00:00', '2018-01-01T00:01'],
+                     dtype='datetime64[ns]')
+    data = np.array([[1.5, 2.5], [0, 0], [0, 0]], dtype=object)
+    arr = xr.DataArray(
+        data,
+        coords=[['vals', 'sevr', 'stat'], times],
+        dims=['field', 'time'],
+        name='PV:A',
+    )
+    dataset = xr.merge([arr])
+    assert list(trigger_eval.archive_values(dataset, 'PV:A')) == [1.5, 2.5]
+    assert list(trigger_eval.archive_values(arr, 'PV:A')) == [1.5, 2.5]
+    assert len(trigger_eval.archive_values(xr.DataArray(), 'PV:A')) == 0
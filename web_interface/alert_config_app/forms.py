@@ -19,6 +19,7 @@ from django.contrib.auth.forms import UserChangeForm
 from django.contrib.auth.models import User
 
 from .widgets import HorizontalCheckbox
+from . import trigger_expr
 import re
 
 
@@ -41,6 +42,10 @@ class configTrigger(forms.Form):
         new_value : forms.FloatField
             Changes to the triggering value can be entered in this field
 
+        new_expression : forms.CharField
+            Optional condition in the trigger expression language. When given
+            it replaces the comparison and value.
+
     """
     def __init__(self,*args,**kwargs):
         """Constrct the object
@@ -87,6 +92,36 @@ class configTrigger(forms.Form):
 
 
 
+    new_expression = forms.CharField(
+        label = 'Expression',
+        required = False,
+        max_length = Trigger.expression_max_length,
+        widget = forms.TextInput(
+            attrs = {
+                'class':'form-control',
+                'type':'text',
+                'placeholder':'value > 100 deadband 5',
+            }
+        )
+    )
+
+    def clean_new_expression(self):
+        """Parse the expression so mistakes are reported on save
+
+        Returns
+        -------
+        str or None
+            the expression, None if left blank
+        """
+        data = self.cleaned_data['new_expression'].strip()
+        if not data:
+            return None
+        try:
+            trigger_expr.parse(data)
+        except trigger_expr.ExpressionError as e:
+            raise forms.ValidationError(str(e))
+        return data
+
     def clean_new_name(self):
         data = self.cleaned_data['new_name']
         # print("DATA:",data)
@@ -154,6 +189,9 @@ class configAlert(forms.Form):#ModelForm
 
         new_subscribe : forms.BooleanField
             Determines whether the current user is subscribed.             
+
+        new_scan_class : forms.ChoiceField
+            Selects how often the alerts engine scans this alert's triggers.
     """
 
     class Meta:
@@ -204,6 +242,19 @@ class configAlert(forms.Form):#ModelForm
         ),
         help_text = "Time delay between successive alerts"
     )
+
+    new_scan_class = forms.ChoiceField(
+        label = "Scan class",
+        required = False,
+        choices = Alert.scan_class_choices,
+        initial = Alert.scan_class_default,
+        widget = forms.Select(
+            attrs = {
+                'class':'custom-select',
+            }
+        ),
+        help_text = "How often the triggers are checked"
+    )
     
     new_owners = forms.CharField(
         label = 'Owners',
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0012_auto_20180128_2328'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alert',
+            name='scan_class',
+            field=models.CharField(choices=[('critical', 'Critical'), ('standard', 'Standard'), ('housekeeping', 'Housekeeping')], default='standard', max_length=20),
+        ),
+    ]
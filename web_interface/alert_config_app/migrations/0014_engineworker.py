@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0013_alert_scan_class'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EngineWorker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('host', models.CharField(blank=True, max_length=100)),
+                ('pid', models.IntegerField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:42
+from __future__ import unicode_literals
+
+import alert_config_app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0014_engineworker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trigger',
+            name='expression',
+            field=models.CharField(blank=True, max_length=500, null=True, validators=[alert_config_app.models.validate_expression]),
+        ),
+    ]
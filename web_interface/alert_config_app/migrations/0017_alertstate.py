@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_last_sent(apps, schema_editor):
+    Alert = apps.get_model('alert_config_app', 'Alert')
+    AlertState = apps.get_model('alert_config_app', 'AlertState')
+    AlertState.objects.bulk_create([
+        AlertState(alert_id = pk, last_sent = last_sent)
+        for pk, last_sent in Alert.objects.values_list('pk', 'last_sent')
+    ])
+
+
+def restore_last_sent(apps, schema_editor):
+    Alert = apps.get_model('alert_config_app', 'Alert')
+    AlertState = apps.get_model('alert_config_app', 'AlertState')
+    for state in AlertState.objects.exclude(last_sent = None):
+        Alert.objects.filter(pk = state.alert_id).update(
+            last_sent = state.last_sent)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0016_configversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertState',
+            fields=[
+                ('alert', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='alert_config_app.Alert')),
+                ('last_sent', models.DateTimeField(blank=True, null=True)),
+                ('tripped', models.BooleanField(default=False)),
+                ('trip_count', models.PositiveIntegerField(default=0)),
+                ('last_evaluated', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(copy_last_sent, restore_last_sent),
+        migrations.RemoveField(
+            model_name='alert',
+            name='last_sent',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+ACTIVE = 1
+ACKNOWLEDGED = 2
+
+
+def tripped_to_status(apps, schema_editor):
+    AlertState = apps.get_model('alert_config_app', 'AlertState')
+    AlertState.objects.filter(tripped = True).update(status = ACTIVE)
+
+
+def status_to_tripped(apps, schema_editor):
+    AlertState = apps.get_model('alert_config_app', 'AlertState')
+    AlertState.objects.filter(
+        status__in = [ACTIVE, ACKNOWLEDGED]).update(tripped = True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0017_alertstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertstate',
+            name='status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Normal'), (1, 'Active'), (2, 'Acknowledged'), (3, 'Cleared')], default=0),
+        ),
+        migrations.AddField(
+            model_name='alertstate',
+            name='status_changed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(tripped_to_status, status_to_tripped),
+        migrations.RemoveField(
+            model_name='alertstate',
+            name='tripped',
+        ),
+    ]
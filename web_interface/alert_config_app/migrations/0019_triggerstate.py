@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+ACTIVE = 1
+ACKNOWLEDGED = 2
+
+
+def create_trigger_states(apps, schema_editor):
+    # the triggers of raised alerts start tripped, so the alerts only clear
+    # once their triggers were evaluated again
+    Trigger = apps.get_model('alert_config_app', 'Trigger')
+    AlertState = apps.get_model('alert_config_app', 'AlertState')
+    TriggerState = apps.get_model('alert_config_app', 'TriggerState')
+    raised = set(AlertState.objects.filter(
+        status__in = [ACTIVE, ACKNOWLEDGED]).values_list('alert_id', flat=True))
+    TriggerState.objects.bulk_create([
+        TriggerState(trigger_id = pk, tripped = alert_id in raised)
+        for pk, alert_id in Trigger.objects.values_list('pk', 'alert_id')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alert_config_app', '0018_alertstate_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TriggerState',
+            fields=[
+                ('trigger', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='state', serialize=False, to='alert_config_app.Trigger')),
+                ('tripped', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(create_trigger_states, migrations.RunPython.noop),
+    ]
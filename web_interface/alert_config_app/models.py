@@ -1,8 +1,15 @@
 """Manage alert_config data models
 """
-from django.db import models
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from account_mgr_app.models import Profile
+from . import trigger_expr
 
 # Create your models here.
 
@@ -34,17 +41,13 @@ class Alert(models.Model):
     
         Note
         ----
-            This attribute will likely undergo significant change or possibly
-            removal during the planned integration of the IEC 62682 plans
+            Users are only notified when the alert becomes active (see
+            AlertState), the lockout additionally limits how often an alert
+            that keeps clearing and tripping again notifies.
     
-    last_sent : django.db.models.DateTimeField
-        Specifies the time at which the last alert was sent. See the proceeding
-        note for potential changes
-
-        Note
-        ----
-            This attribute will likely undergo significant change or possibly
-            removal during the planned integration of the IEC 62682 plans
+    scan_class : django.db.models.CharField
+        Scan group the alerts engine evaluates this alert's triggers in. Each
+        class is scanned at its own rate, configured in alert_engine.ini.
 
     """
     name_max_length = 100
@@ -65,9 +68,17 @@ class Alert(models.Model):
         null = True,
     )
 
-    last_sent = models.DateTimeField(
-        blank = True,
-        null = True,
+    scan_class_choices = [
+        ('critical','Critical'),
+        ('standard','Standard'),
+        ('housekeeping','Housekeeping'),
+    ]
+    scan_class_default = 'standard'
+
+    scan_class = models.CharField(
+        choices = scan_class_choices,
+        max_length = 20,
+        default = scan_class_default,
     )
 
     def __repr__(self):
@@ -81,6 +92,181 @@ class Alert(models.Model):
         return(str(self.name))
 
 
+class AlertState(models.Model):
+    """Runtime state of an alert, written by the alerts engine
+
+    Kept apart from Alert so the engine's bookkeeping never rewrites the
+    configuration owners edit, and so each scan can record the state of all
+    its alerts with a few narrow UPDATEs. Saving an AlertState doesn't bump
+    the ConfigVersion.
+
+    The status follows the IEC 62682 alarm states, driven by whether a
+    trigger of the alert is tripped (see TriggerState):
+
+    - NORMAL: not tripped and nothing to acknowledge
+    - ACTIVE: tripped and not acknowledged yet. Entering it notifies the
+      subscribers
+    - ACKNOWLEDGED: still tripped, a user acknowledged it
+    - CLEARED: stopped tripping before it was acknowledged
+
+    Tripping again from NORMAL or CLEARED makes the alert ACTIVE, clearing
+    makes an ACTIVE alert CLEARED and an ACKNOWLEDGED one NORMAL. Acknowledging
+    moves ACTIVE to ACKNOWLEDGED and CLEARED to NORMAL, so it never changes
+    whether the alert counts as tripped (see raised).
+
+    Attributes
+    ----------
+    alert : django.db.models.OneToOneField
+        The alert, also the primary key. Reach the state from an alert as
+        Alert.state
+
+    last_sent : django.db.models.DateTimeField
+        Time at which the last notification was sent, compared to the
+        alert's lockout_duration
+
+    status : django.db.models.PositiveSmallIntegerField
+        One of NORMAL, ACTIVE, ACKNOWLEDGED or CLEARED
+
+    status_changed : django.db.models.DateTimeField
+        Time of the last status change
+
+    trip_count : django.db.models.PositiveIntegerField
+        Number of times the alert became ACTIVE
+
+    last_evaluated : django.db.models.DateTimeField
+        Time of the last scan that evaluated the alert's triggers
+    """
+    alert = models.OneToOneField(
+        Alert,
+        on_delete = models.CASCADE,
+        primary_key = True,
+        related_name = 'state',
+    )
+
+    last_sent = models.DateTimeField(
+        blank = True,
+        null = True,
+    )
+
+    NORMAL = 0
+    ACTIVE = 1
+    ACKNOWLEDGED = 2
+    CLEARED = 3
+    status_choices = [
+        (NORMAL, 'Normal'),
+        (ACTIVE, 'Active'),
+        (ACKNOWLEDGED, 'Acknowledged'),
+        (CLEARED, 'Cleared'),
+    ]
+    # the states in which the alert's condition holds
+    raised_statuses = (ACTIVE, ACKNOWLEDGED)
+
+    status = models.PositiveSmallIntegerField(
+        choices = status_choices,
+        default = NORMAL,
+    )
+
+    status_changed = models.DateTimeField(
+        blank = True,
+        null = True,
+    )
+
+    trip_count = models.PositiveIntegerField(default = 0)
+
+    last_evaluated = models.DateTimeField(
+        blank = True,
+        null = True,
+    )
+
+    @property
+    def raised(self):
+        """Whether a trigger of the alert tripped in the last evaluation
+        """
+        return self.status in self.raised_statuses
+
+    @property
+    def acknowledgeable(self):
+        """Whether the alert is waiting for an acknowledgement
+        """
+        return self.status in (self.ACTIVE, self.CLEARED)
+
+    @classmethod
+    def next_status(cls, status, tripped):
+        """Return the status an alert moves to after an evaluation
+
+        Parameters
+        ----------
+        status : int
+            current status
+
+        tripped : bool
+            whether a trigger of the alert tripped
+
+        Returns
+        -------
+        int
+        """
+        if tripped and status in (cls.NORMAL, cls.CLEARED):
+            return cls.ACTIVE
+        if not tripped and status == cls.ACTIVE:
+            return cls.CLEARED
+        if not tripped and status == cls.ACKNOWLEDGED:
+            return cls.NORMAL
+        return status
+
+    def acknowledge(self, now=None):
+        """Acknowledge the alert: ACTIVE becomes ACKNOWLEDGED and CLEARED
+        becomes NORMAL
+
+        The row is only updated if the engine didn't change its status in
+        the meantime.
+
+        Parameters
+        ----------
+        now : datetime.datetime or None
+            defaults to timezone.now()
+
+        Returns
+        -------
+        bool
+            whether the status changed
+        """
+        acknowledged = {
+            self.ACTIVE: self.ACKNOWLEDGED,
+            self.CLEARED: self.NORMAL,
+        }
+        if not self.acknowledgeable:
+            return False
+        if now == None:
+            now = timezone.now()
+        status = acknowledged[self.status]
+        updated = AlertState.objects.filter(
+            pk = self.pk,
+            status = self.status,
+        ).update(status = status, status_changed = now)
+        if updated:
+            self.status = status
+            self.status_changed = now
+        return bool(updated)
+
+    def __repr__(self):
+        return '{}(alert_id={},status={},last_sent={})'.format(
+            self.__class__.__name__,
+            self.alert_id,
+            self.get_status_display(),
+            self.last_sent,
+        )
+
+    def __str__(self):
+        return(str(self.alert_id))
+
+
+@receiver(post_save, sender = Alert)
+def create_alert_state(sender, instance, created, **kwargs):
+    if created:
+        AlertState.objects.create(alert = instance)
+
+
 class Pv(models.Model):
     """Each PV instance is made to match with an EPICS PV.
 
@@ -98,15 +284,34 @@ class Pv(models.Model):
         return(str(self.name))
 
 
+def validate_expression(value):
+    """Reject trigger expressions that don't parse
+    """
+    if not value:
+        return
+    try:
+        trigger_expr.parse(value)
+    except trigger_expr.ExpressionError as e:
+        raise ValidationError(str(e))
+
+
 class Trigger(models.Model):
     """Individual 'trip statemet'
     
     Each trigger defines a trip condition relating a numeric value, condition 
     and PV. Each trigger can be owned by a single Alert. Triggers are not
     edited directly but through the alerts config page.
+
+    Attributes
+    ----------
+    expression : django.db.models.CharField
+        Optional condition in the trigger expression language (see
+        trigger_expr), e.g. "value > 100 deadband 5". When set it replaces
+        compare and value.
     """
     name_max_length = 100
     val_src_max_length = 100
+    expression_max_length = 500
     name = models.CharField(max_length = name_max_length)
     alert = models.ForeignKey(Alert, on_delete=models.CASCADE)
 
@@ -137,8 +342,22 @@ class Trigger(models.Model):
         null = True,
     ) 
 
+    expression = models.CharField(
+        max_length = expression_max_length,
+        blank = True,
+        null = True,
+        validators = [validate_expression],
+    )
+
 
     def __repr__(self):
+        if self.expression:
+            return '{}(name="{}",alert="{}",expression="{}")'.format(
+                self.__class__.__name__,
+                self.name,
+                self.alert,
+                self.expression,
+            )
         return '{}(name="{}",alert="{}",value={},compare="{}")'.format(
             self.__class__.__name__, 
             self.name, 
@@ -150,3 +369,185 @@ class Trigger(models.Model):
     def __str__(self):
         return(str(self.name))
 
+
+class TriggerState(models.Model):
+    """Result of the last evaluation of a trigger, written by the alerts
+    engine
+
+    An alert is raised while any of its triggers is tripped. Keeping the
+    result per trigger lets each engine worker record only the triggers it
+    evaluated: a trigger whose PV couldn't be fetched, or that belongs to
+    another worker, keeps its last result instead of clearing the alert.
+
+    Attributes
+    ----------
+    trigger : django.db.models.OneToOneField
+        The trigger, also the primary key. Reach the state from a trigger as
+        Trigger.state
+
+    tripped : django.db.models.BooleanField
+        Whether the trigger tripped in its last evaluation
+    """
+    trigger = models.OneToOneField(
+        Trigger,
+        on_delete = models.CASCADE,
+        primary_key = True,
+        related_name = 'state',
+    )
+
+    tripped = models.BooleanField(default = False)
+
+    def __repr__(self):
+        return '{}(trigger_id={},tripped={})'.format(
+            self.__class__.__name__,
+            self.trigger_id,
+            self.tripped,
+        )
+
+    def __str__(self):
+        return(str(self.trigger_id))
+
+
+@receiver(post_save, sender = Trigger)
+def create_trigger_state(sender, instance, created, **kwargs):
+    if created:
+        TriggerState.objects.create(trigger = instance)
+
+
+class EngineWorker(models.Model):
+    """Membership record of an alerts engine shard
+
+    Each sharded engine process keeps its row's heartbeat current. The live
+    workers divide the PVs between them by consistent hashing on the PV name,
+    so when a worker joins or its heartbeat goes stale the others pick up its
+    share on their next scan.
+
+    Attributes
+    ----------
+    name : django.db.models.CharField
+        Unique name of the worker, e.g. host:index
+
+    host : django.db.models.CharField
+        Hostname the worker runs on
+
+    pid : django.db.models.IntegerField
+        Process id of the worker
+
+    heartbeat : django.db.models.DateTimeField
+        Last time the worker reported itself alive
+    """
+    name_max_length = 100
+    name = models.CharField(max_length = name_max_length, unique = True)
+
+    host = models.CharField(max_length = name_max_length, blank = True)
+
+    pid = models.IntegerField(
+        blank = True,
+        null = True,
+    )
+
+    heartbeat = models.DateTimeField()
+
+    def __repr__(self):
+        return '{}(name="{}",heartbeat={})'.format(
+            self.__class__.__name__,
+            self.name,
+            self.heartbeat,
+        )
+
+    def __str__(self):
+        return(str(self.name))
+
+
+class ConfigVersion(models.Model):
+    """Counter of alert configuration changes
+
+    A single row whose version is bumped by the signal receivers below
+    whenever an Alert, a Trigger, an alert's subscribers or owners, or a
+    user's email change. The alerts engine keeps its scan plan in memory and
+    only reloads it when the version moves.
+
+    Note
+    ----
+        bulk_create and QuerySet.update send no signals. Code changing the
+        configuration that way must call ConfigVersion.bump itself.
+
+    Attributes
+    ----------
+    version : django.db.models.BigIntegerField
+        Incremented on every change
+
+    changed : django.db.models.DateTimeField
+        Time of the last change
+    """
+    row_pk = 1
+
+    version = models.BigIntegerField(default = 0)
+
+    changed = models.DateTimeField(default = timezone.now)
+
+    @classmethod
+    def current(cls):
+        """Return the configuration version, 0 if it was never bumped
+        """
+        version = (
+            cls.objects
+            .filter(pk = cls.row_pk)
+            .values_list('version', flat = True)
+            .first()
+        )
+        return version or 0
+
+    @classmethod
+    def bump(cls):
+        """Record a configuration change
+        """
+        now = timezone.now()
+        bumped = cls.objects.filter(pk = cls.row_pk).update(
+            version = F('version') + 1,
+            changed = now,
+        )
+        if bumped:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(pk = cls.row_pk, version = 1, changed = now)
+        except IntegrityError:
+            # created by a concurrent bump
+            cls.objects.filter(pk = cls.row_pk).update(
+                version = F('version') + 1,
+                changed = now,
+            )
+
+    def __repr__(self):
+        return '{}(version={},changed={})'.format(
+            self.__class__.__name__,
+            self.version,
+            self.changed,
+        )
+
+    def __str__(self):
+        return(str(self.version))
+
+
+@receiver(post_save, sender = Alert)
+@receiver(post_delete, sender = Alert)
+@receiver(post_save, sender = Trigger)
+@receiver(post_delete, sender = Trigger)
+def bump_config_version(sender, **kwargs):
+    ConfigVersion.bump()
+
+
+@receiver(m2m_changed, sender = Alert.subscriber.through)
+@receiver(m2m_changed, sender = Alert.owner.through)
+def bump_config_version_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        ConfigVersion.bump()
+
+
+@receiver(post_save, sender = User)
+def bump_config_version_user(sender, update_fields, **kwargs):
+    # logging in only updates last_login, which the engine doesn't use
+    if update_fields != None and set(update_fields) == {'last_login'}:
+        return
+    ConfigVersion.bump()
@@ -0,0 +1,327 @@
+"""Memory mapped cache of recent PV samples
+
+The alerts engine writes the samples it retrieves from the archiver into this
+cache after every scan, and the web interface reads them back without asking
+the archiver again. The file has a fixed layout: a header, a table of PV
+slots and one ring of (time, value) samples per slot. Each slot carries a
+sequence number that is odd while the engine writes to it, so readers never
+return a half written ring. When every slot is taken, the PV that was
+updated least recently makes room for the new one.
+
+This module only needs numpy so the engine can use it without the rest of
+the web interface.
+"""
+import fnmatch
+import glob
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'EASESMP1'
+VERSION = 1
+NAME_LENGTH = 104
+
+HEADER = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<i8'),
+    ('slots', '<i8'),
+    ('capacity', '<i8'),
+])
+
+SLOT = np.dtype([
+    ('name', 'S{}'.format(NAME_LENGTH)),
+    ('seq', '<u8'),
+    ('head', '<i8'),
+    ('size', '<i8'),
+])
+
+SAMPLE = np.dtype([
+    ('time', '<M8[ns]'),
+    ('value', '<f8'),
+])
+
+
+class SampleCache:
+    """Fixed layout ring buffers of PV samples in a memory mapped file
+
+    Open an existing cache with SampleCache(path) to read it, or use
+    SampleCache.create to make a writable one.
+
+    Attributes
+    ----------
+    path : str
+        file backing the cache
+
+    slots : int
+        number of PVs the cache can hold
+
+    capacity : int
+        number of samples kept per PV
+    """
+    def __init__(self, path, writable=False):
+        """
+        Parameters
+        ----------
+        path : str
+            existing cache file
+
+        writable : bool
+            map the file for writing. Defaults to False.
+        """
+        self.path = path
+        self.writable = writable
+        mode = 'r+' if writable else 'r'
+        header = np.memmap(path, dtype=HEADER, mode='r', shape=(1,))[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError("{} is not a sample cache".format(path))
+        self.slots = int(header['slots'])
+        self.capacity = int(header['capacity'])
+        self.table = np.memmap(
+            path,
+            dtype = SLOT,
+            mode = mode,
+            offset = HEADER.itemsize,
+            shape = (self.slots,),
+        )
+        self.samples = np.memmap(
+            path,
+            dtype = SAMPLE,
+            mode = mode,
+            offset = HEADER.itemsize + SLOT.itemsize * self.slots,
+            shape = (self.slots, self.capacity),
+        )
+        self._index = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, slots=4096, capacity=256):
+        """Open a cache for writing, creating it if the file is missing or
+        has a different layout.
+
+        Parameters
+        ----------
+        path : str
+
+        slots : int
+            number of PVs. Defaults to 4096.
+
+        capacity : int
+            samples kept per PV. Defaults to 256.
+
+        Returns
+        -------
+        SampleCache
+        """
+        try:
+            cache = cls(path, writable=True)
+            if cache.slots == slots and cache.capacity == capacity:
+                return cache
+        except (OSError, ValueError):
+            pass
+        size = HEADER.itemsize + slots * (
+            SLOT.itemsize + capacity * SAMPLE.itemsize)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        header = np.memmap(path, dtype=HEADER, mode='r+', shape=(1,))
+        header[0] = (MAGIC, VERSION, slots, capacity)
+        header.flush()
+        del header
+        return cls(path, writable=True)
+
+    def names(self):
+        """Return the names of the cached PVs
+
+        Returns
+        -------
+        list of str
+        """
+        return [
+            name.decode() for name in self.table['name'] if name
+        ]
+
+    def slot(self, name):
+        """Return the slot holding a PV, or None if it is not cached
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        int or None
+        """
+        key = name.encode()
+        idx = self._index.get(name)
+        if idx != None and self.table['name'][idx] == key:
+            return idx
+        found = np.flatnonzero(self.table['name'] == key)
+        if not len(found):
+            self._index.pop(name, None)
+            return None
+        self._index[name] = int(found[0])
+        return self._index[name]
+
+    def read(self, name, retries=100):
+        """Return the cached samples of a PV, oldest first
+
+        Parameters
+        ----------
+        name : str
+
+        retries : int
+            attempts to get a consistent copy while the engine writes
+
+        Returns
+        -------
+        times : numpy.ndarray
+            datetime64[ns] sample times, in the engine's local time
+
+        values : numpy.ndarray
+        """
+        empty = (np.zeros(0, dtype=SAMPLE['time']), np.zeros(0))
+        for _ in range(retries):
+            idx = self.slot(name)
+            if idx == None:
+                return empty
+            entry = self.table[idx]
+            seq = int(entry['seq'])
+            if seq % 2:
+                continue
+            head = int(entry['head'])
+            size = int(entry['size'])
+            ring = self.samples[idx]
+            order = (head + np.arange(size)) % self.capacity
+            copy = ring[order]
+            if int(self.table[idx]['seq']) == seq:
+                return copy['time'], copy['value']
+        logger.warning("gave up reading {} from the sample cache".format(name))
+        return empty
+
+    def _begin(self, idx):
+        self.table['seq'][idx] = self.table['seq'][idx] + 1
+
+    def _commit(self, idx):
+        self.table['seq'][idx] = self.table['seq'][idx] + 1
+
+    def _allocate(self, name):
+        """Claim a slot for a PV, evicting the stalest PV if none is free
+        """
+        free = np.flatnonzero(self.table['name'] == b'')
+        if len(free):
+            idx = int(free[0])
+        else:
+            size = self.table['size']
+            newest = self.samples['time'][
+                np.arange(self.slots),
+                (self.table['head'] + np.maximum(size - 1, 0)) % self.capacity,
+            ]
+            idx = int(np.argmin(newest))
+            logger.debug("sample cache full, dropping {}".format(
+                self.table['name'][idx].decode()))
+        self._begin(idx)
+        self.table['name'][idx] = name.encode()
+        self.table['head'][idx] = 0
+        self.table['size'][idx] = 0
+        self._commit(idx)
+        self._index[name] = idx
+        return idx
+
+    def write(self, name, times, values):
+        """Append samples of a PV that are newer than the cached ones
+
+        Parameters
+        ----------
+        name : str
+
+        times : numpy.ndarray
+            datetime64 sample times, ascending
+
+        values : numpy.ndarray
+
+        Returns
+        -------
+        int
+            number of samples added
+        """
+        key = name.encode()
+        if len(key) > NAME_LENGTH:
+            logger.warning("PV name too long for the sample cache: " + name)
+            return 0
+        with self._lock:
+            idx = self.slot(name)
+            if idx == None:
+                idx = self._allocate(name)
+            return self._append(idx, times, values)
+
+    def _append(self, idx, times, values):
+        times = np.asarray(times, dtype=SAMPLE['time'])
+        values = np.asarray(values, dtype=float)
+        head = int(self.table['head'][idx])
+        size = int(self.table['size'][idx])
+        if size:
+            last = self.samples['time'][
+                idx, (head + size - 1) % self.capacity]
+            newer = times > last
+            times = times[newer]
+            values = values[newer]
+        count = len(times)
+        if not count:
+            return 0
+        times = times[-self.capacity:]
+        values = values[-self.capacity:]
+
+        self._begin(idx)
+        pos = (head + size + np.arange(len(times))) % self.capacity
+        self.samples['time'][idx, pos] = times
+        self.samples['value'][idx, pos] = values
+        size = size + len(times)
+        if size > self.capacity:
+            head = (head + size - self.capacity) % self.capacity
+            size = self.capacity
+        self.table['head'][idx] = head
+        self.table['size'][idx] = size
+        self._commit(idx)
+        return count
+
+    def flush(self):
+        """Write the changes back to the file
+        """
+        self.table.flush()
+        self.samples.flush()
+
+
+def read_pvs(pattern, pv_names):
+    """Read PVs from whichever cache files hold them
+
+    Sharded engines write one cache each, so the web interface looks through
+    every file matching a pattern.
+
+    Parameters
+    ----------
+    pattern : str
+        glob pattern of the cache files
+
+    pv_names : iterable of str
+        PV names, which may be glob patterns as in Trigger.value_src
+
+    Returns
+    -------
+    dict
+        {PV name: (times, values)} for every cached PV matching
+    """
+    pv_names = list(pv_names)
+    found = {}
+    for path in sorted(glob.glob(pattern)):
+        try:
+            cache = SampleCache(path)
+        except (OSError, ValueError):
+            continue
+        cached = cache.names()
+        for pv_name in pv_names:
+            for name in fnmatch.filter(cached, pv_name):
+                if name not in found:
+                    found[name] = cache.read(name)
+    return found
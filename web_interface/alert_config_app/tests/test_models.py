@@ -98,3 +98,110 @@ class PVFieldsTests(TestCase):
     def tearDownClass(cls):
         super().tearDownClass()
         pass
+
+
+class ConfigVersionTests(TestCase):
+    """Ensure that configuration changes bump the version
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.u = User.objects.create_user("version_user", password="pass")
+        cls.a = Alert.objects.create(name="version_alert")
+
+    def assertBumps(self, change):
+        before = ConfigVersion.current()
+        change()
+        self.assertGreater(ConfigVersion.current(), before)
+
+    def test_alert_changes(self):
+        self.assertBumps(lambda: Alert.objects.create(name="other"))
+        self.a.name = "renamed"
+        self.assertBumps(self.a.save)
+        self.assertBumps(lambda: self.a.subscriber.add(self.u.profile))
+        self.assertBumps(lambda: self.a.owner.add(self.u.profile))
+        self.assertBumps(lambda: self.a.subscriber.clear())
+
+    def test_trigger_changes(self):
+        trigger = Trigger(name="t", alert=self.a)
+        self.assertBumps(trigger.save)
+        self.assertBumps(trigger.delete)
+
+    def test_login_ignored(self):
+        before = ConfigVersion.current()
+        self.u.save(update_fields=['last_login'])
+        self.assertEqual(ConfigVersion.current(), before)
+        self.u.email = "version_user@example.com"
+        self.assertBumps(self.u.save)
+
+
+class AlertStateTests(TestCase):
+    """Ensure that the engine's runtime state lives apart from the Alert
+    """
+    def test_created_with_alert(self):
+        alert = Alert.objects.create(name="state_alert")
+        self.assertEqual(alert.state.trip_count, 0)
+        self.assertEqual(alert.state.status, AlertState.NORMAL)
+        self.assertFalse(alert.state.raised)
+
+    def test_alert_save_keeps_state(self):
+        alert = Alert.objects.create(name="state_alert")
+        stale = Alert.objects.get(pk=alert.pk)
+        AlertState.objects.filter(pk=alert.pk).update(trip_count=3)
+        stale.name = "renamed"
+        stale.save()
+        self.assertEqual(AlertState.objects.get(pk=alert.pk).trip_count, 3)
+
+    def test_state_changes_keep_version(self):
+        alert = Alert.objects.create(name="state_alert")
+        before = ConfigVersion.current()
+        alert.state.status = AlertState.ACTIVE
+        alert.state.save()
+        self.assertEqual(ConfigVersion.current(), before)
+
+    def test_transitions(self):
+        expected = [
+            (AlertState.NORMAL, True, AlertState.ACTIVE),
+            (AlertState.NORMAL, False, AlertState.NORMAL),
+            (AlertState.ACTIVE, True, AlertState.ACTIVE),
+            (AlertState.ACTIVE, False, AlertState.CLEARED),
+            (AlertState.ACKNOWLEDGED, True, AlertState.ACKNOWLEDGED),
+            (AlertState.ACKNOWLEDGED, False, AlertState.NORMAL),
+            (AlertState.CLEARED, True, AlertState.ACTIVE),
+            (AlertState.CLEARED, False, AlertState.CLEARED),
+        ]
+        for status, tripped, new_status in expected:
+            self.assertEqual(
+                AlertState.next_status(status, tripped), new_status,
+                (status, tripped))
+
+    def test_acknowledge(self):
+        alert = Alert.objects.create(name="state_alert")
+        state = alert.state
+        self.assertFalse(state.acknowledge())
+
+        AlertState.objects.filter(pk=alert.pk).update(
+            status=AlertState.ACTIVE)
+        state.refresh_from_db()
+        self.assertTrue(state.acknowledge())
+        self.assertEqual(
+            AlertState.objects.get(pk=alert.pk).status,
+            AlertState.ACKNOWLEDGED)
+        self.assertTrue(state.raised)
+
+        AlertState.objects.filter(pk=alert.pk).update(
+            status=AlertState.CLEARED)
+        state.refresh_from_db()
+        self.assertTrue(state.acknowledge())
+        self.assertEqual(state.status, AlertState.NORMAL)
+
+    def test_acknowledge_stale(self):
+        alert = Alert.objects.create(name="state_alert")
+        AlertState.objects.filter(pk=alert.pk).update(
+            status=AlertState.ACTIVE)
+        state = AlertState.objects.get(pk=alert.pk)
+        # the engine cleared the alert in the meantime
+        AlertState.objects.filter(pk=alert.pk).update(
+            status=AlertState.CLEARED)
+        self.assertFalse(state.acknowledge())
+        self.assertEqual(
+            AlertState.objects.get(pk=alert.pk).status, AlertState.CLEARED)
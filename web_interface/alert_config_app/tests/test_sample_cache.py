@@ -0,0 +1,86 @@
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.contrib.auth.models import User
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from alert_config_app import sample_cache
+from alert_config_app.models import Alert, Trigger
+
+
+def times(*seconds):
+    return np.array(seconds, dtype='datetime64[s]').astype('datetime64[ns]')
+
+
+class SampleCacheTests(SimpleTestCase):
+    """Write and read back the memory mapped sample rings
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'samples')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_ring_wraps(self):
+        cache = sample_cache.SampleCache.create(self.path, slots=2, capacity=3)
+        self.assertEqual(cache.write('PV:A', times(1, 2), [1., 2.]), 2)
+        # repeated samples are skipped
+        self.assertEqual(cache.write('PV:A', times(2, 3, 4), [2., 3., 4.]), 2)
+        reader = sample_cache.SampleCache(self.path)
+        t, v = reader.read('PV:A')
+        self.assertEqual(list(v), [2., 3., 4.])
+        self.assertEqual(t[-1], times(4)[0])
+        self.assertEqual(len(reader.read('PV:B')[1]), 0)
+
+    def test_evicts_stalest(self):
+        cache = sample_cache.SampleCache.create(self.path, slots=2, capacity=3)
+        cache.write('PV:A', times(5), [1.])
+        cache.write('PV:B', times(1), [1.])
+        cache.write('PV:C', times(6), [1.])
+        self.assertEqual(sorted(cache.names()), ['PV:A', 'PV:C'])
+
+    def test_layout_change_recreates(self):
+        sample_cache.SampleCache.create(self.path, slots=2, capacity=3)
+        cache = sample_cache.SampleCache.create(self.path, slots=4, capacity=3)
+        self.assertEqual(cache.slots, 4)
+        with open(os.path.join(self.dir, 'other'), 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            sample_cache.SampleCache(os.path.join(self.dir, 'other'))
+
+
+class AlertSamplesViewTests(TestCase):
+    """Serve cached samples of an alert's PVs
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("test", password="tests")
+        cls.alert = Alert.objects.create(name="alert")
+        Trigger.objects.create(
+            name="trig", alert=cls.alert, value_src="PV:A, PV:B*")
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        cache = sample_cache.SampleCache.create(
+            os.path.join(self.dir, 'samples.0'), slots=4, capacity=4)
+        cache.write('PV:A', times(1, 2), [1., 2.])
+        cache.write('PV:B1', times(1), [5.])
+        cache.write('PV:C', times(1), [7.])
+        self.client.login(username="test", password="tests")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_alert_samples(self):
+        with override_settings(
+                SAMPLE_CACHE_PATHS=os.path.join(self.dir, 'samples*')):
+            response = self.client.get(
+                '/alert/alert_samples/{}/'.format(self.alert.pk))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['trig']
+        self.assertEqual(sorted(data), ['PV:A', 'PV:B1'])
+        self.assertEqual(data['PV:A']['values'], [1., 2.])
@@ -0,0 +1,104 @@
+from django.test import SimpleTestCase
+from django.core.exceptions import ValidationError
+
+import numpy as np
+
+from alert_config_app import trigger_expr
+from alert_config_app.models import validate_expression
+
+
+def times(*seconds):
+    return np.array(seconds, dtype='datetime64[s]').astype('datetime64[ns]')
+
+
+SAMPLES = {
+    'PV:A': (times(0, 10, 20, 30), np.array([1., 5., 12., 3.])),
+    'PV:B': (times(0, 20), np.array([0., 10.])),
+}
+
+
+class ParseTests(SimpleTestCase):
+    """Parse expressions and report the mistakes
+    """
+    def test_referenced_pvs(self):
+        expression = trigger_expr.parse('pv("PV:B") - value > 3')
+        self.assertEqual(expression.pvs, ('PV:B',))
+        self.assertTrue(expression.uses_value)
+        expression = trigger_expr.parse("max(pv('X'), pv('Y')) >= 2")
+        self.assertEqual(expression.pvs, ('X', 'Y'))
+        self.assertFalse(expression.uses_value)
+
+    def test_errors(self):
+        for source in [
+                '',
+                'value',
+                'value >',
+                'value > 1 and 3',
+                'rate(value + 1) > 2',
+                'foo > 1',
+                'value == 1 deadband 2',
+                'pv(1) > 2',
+                'value > 1 for',
+                'value @ 2',
+                ]:
+            with self.assertRaises(trigger_expr.ExpressionError, msg=source):
+                trigger_expr.parse(source)
+
+    def test_validator(self):
+        validate_expression('value in [1, 2]')
+        validate_expression(None)
+        with self.assertRaises(ValidationError):
+            validate_expression('value in [1, 2')
+
+
+class EvaluateTests(SimpleTestCase):
+    """Evaluate expressions over the aligned samples of a window
+    """
+    def series(self, source, state=None):
+        return list(trigger_expr.parse(source).series(
+            SAMPLES, 'PV:A', times(40)[0], state)[1])
+
+    def test_comparisons(self):
+        self.assertEqual(self.series('value > 10'), [0, 0, 1, 0])
+        self.assertEqual(self.series('value in [2, 6]'), [0, 1, 0, 1])
+        self.assertEqual(self.series('value not in [2, 6]'), [1, 0, 1, 0])
+        self.assertEqual(
+            self.series('(value + 1) * 2 > 25 or value == 1'), [1, 0, 1, 0])
+
+    def test_rate(self):
+        # 0.4, 0.7 and -0.9 per second
+        self.assertEqual(self.series('abs(rate(value)) > 0.5'), [0, 0, 1, 1])
+
+    def test_combined_pvs(self):
+        # PV:B holds 0 until t=20
+        self.assertEqual(self.series('pv("PV:B") - value > 3'), [0, 0, 0, 1])
+        self.assertEqual(
+            self.series('min(value, pv("PV:B")) >= 1'), [0, 0, 1, 1])
+
+    def test_duration(self):
+        # above 4 from t=10 until t=30
+        self.assertEqual(self.series('value > 4 for 10s'), [0, 1, 1, 0])
+        self.assertEqual(self.series('value > 4 for 15s'), [0, 0, 1, 0])
+        self.assertEqual(self.series('value > 4 for 1m'), [0, 0, 0, 0])
+
+    def test_deadband(self):
+        # clears below 2, so the 3 at t=30 stays latched
+        self.assertEqual(self.series('value > 4 deadband 2'), [0, 1, 1, 1])
+        state = {}
+        self.assertEqual(
+            self.series('value > 10 deadband 8', state), [0, 0, 1, 1])
+        self.assertEqual(state, {0: True})
+
+    def test_deadband_carries_over(self):
+        expression = trigger_expr.parse('value > 10 deadband 5')
+        state = {0: True}
+        samples = {'PV:A': (times(50, 60), np.array([7., 4.]))}
+        self.assertEqual(
+            list(expression.series(samples, 'PV:A', state=state)[1]),
+            [1, 0])
+        self.assertEqual(state, {0: False})
+
+    def test_no_samples(self):
+        expression = trigger_expr.parse('value > 1')
+        self.assertFalse(expression.evaluate({}, 'PV:MISSING'))
+        self.assertTrue(expression.evaluate(SAMPLES, 'PV:A'))
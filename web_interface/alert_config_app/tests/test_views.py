@@ -425,6 +425,36 @@ class test_alert_config_view(TestCase):
         self.assertTemplateUsed(response, 'alert_config.html')
         self.assertContains(response, 'owner_redirect_name')
 
+    def test_create_alert_expression(self):
+        """check that a trigger expression is saved with its trigger
+        """
+        response = self.generic_alert_post(**{
+            'new_name':'expression_alert',
+            'tg-0-new_expression':'value > 100 deadband 5 for 30s',
+        })
+        alert_inst = Alert.objects.get(name="expression_alert")
+        self.assertEqual(
+            alert_inst.trigger_set.get(name="0 trigger").expression,
+            'value > 100 deadband 5 for 30s',
+        )
+        self.assertEqual(
+            alert_inst.trigger_set.get(name="1 trigger").expression,
+            None,
+        )
+
+    def test_create_alert_bad_expression(self):
+        """check that an expression that doesn't parse is sent back
+        """
+        response = self.generic_alert_post(**{
+            'new_name':'bad_expression_alert',
+            'tg-0-new_expression':'value >> 100',
+        })
+        self.assertFalse(
+            Alert.objects.filter(name="bad_expression_alert").exists())
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'alert_config.html')
+        self.assertContains(response, 'unexpected')
+
 
 class test_alert_detail_view(TestCase):
     """Collection of tests inspecting the detail_alert form 
@@ -557,6 +587,26 @@ class test_alert_detail_view(TestCase):
             "subscriber not removed",
         )
 
+    def test_acknowledge(self):
+        """Ensure owners and subscribers can acknowledge an active alert
+        """
+        path = '/alert/alert_acknowledge/'+str(self.alerts[0].pk)+'/'
+        states = AlertState.objects.filter(pk=self.alerts[0].pk)
+        states.update(status=AlertState.ACTIVE)
+
+        # neither owner nor subscriber
+        self.c.post(path, follow=True)
+        self.assertEqual(states.get().status, AlertState.ACTIVE)
+
+        self.alerts[0].subscriber.add(self.primary.profile)
+        response = self.c.get(path, follow=True)
+        self.assertEqual(states.get().status, AlertState.ACTIVE)
+        self.assertContains(response, 'Acknowledge')
+
+        response = self.c.post(path, follow=True)
+        self.assertEqual(states.get().status, AlertState.ACKNOWLEDGED)
+        self.assertNotContains(response, 'value="Acknowledge"')
+
 
 class test_alert_list_page_view(TestCase): 
     @classmethod
@@ -0,0 +1,652 @@
+"""Trigger condition expressions
+
+A trigger can describe its condition with an expression instead of a single
+compare/value pair. The expression is parsed when the alert is saved, so
+mistakes are reported on the configuration page, and the alerts engine keeps
+the compiled form between scans.
+
+Grammar
+-------
+Conditions combine with ``and``, ``or``, ``not`` and parentheses::
+
+    value > 100
+    value in [10, 20]               # inclusive range
+    value not in [10, 20]
+    abs(rate(value)) > 5            # change per second between samples
+    value > 100 for 30s             # held for at least 30 seconds (s, m, h)
+    value > 100 deadband 5          # trips above 100, clears below 95
+    pv("LINAC:TEMP") - value > 3    # combine other PVs with +, -, *, /
+    max(pv("A:I"), pv("B:I")) >= 2 and not value == 0
+
+``value`` stands for each PV listed in the trigger's value_src in turn, and
+``pv("NAME")`` for a specific PV. ``rate``, ``abs``, ``min`` and ``max`` are
+the available functions.
+
+Evaluation
+----------
+Every PV the expression refers to is sampled on the union of their sample
+times, each holding its last value, so the whole window is evaluated with a
+few numpy operations. The trigger trips if the condition holds at any point
+of the window.
+
+A ``deadband`` comparison latches: it stays true until the value crosses back
+past the threshold by the deadband, and the latch carries over to the next
+scan through the state dict passed to Expression.evaluate. A ``for``
+duration counts from the first sample of the run, so it should be shorter
+than the engine's lookback window.
+
+This module only needs numpy so the engine can use it without the rest of
+the web interface.
+"""
+import re
+
+import numpy as np
+
+COMPARE_OPERATORS = ('==', '!=', '<=', '>=', '<', '>')
+ORDERING_OPERATORS = ('<=', '>=', '<', '>')
+FUNCTIONS = ('abs', 'rate', 'min', 'max')
+DURATION_UNITS = {'s': 1.0, 'm': 60.0, 'h': 3600.0}
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+        |(?P<string>"[^"]*"|'[^']*')
+        |(?P<name>[A-Za-z_]\w*)
+        |(?P<op><=|>=|==|!=|[-+*/<>(),\[\]])
+    )""", re.VERBOSE)
+
+
+class ExpressionError(ValueError):
+    """The expression can't be parsed or mixes conditions and numbers
+
+    Attributes
+    ----------
+    position : int or None
+        offset of the offending character in the expression
+    """
+    def __init__(self, message, position=None):
+        if position != None:
+            message = "{} (at character {})".format(message, position + 1)
+        super().__init__(message)
+        self.position = position
+
+
+def tokenize(source):
+    """Split an expression into (kind, text, position) tokens
+
+    Raises
+    ------
+    ExpressionError
+        for characters that don't start a token
+    """
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        match = TOKEN.match(source, pos)
+        if not match:
+            raise ExpressionError(
+                "unexpected {!r}".format(source[pos:].lstrip()[:1]), pos)
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind)))
+        pos = match.end()
+    tokens.append(('end', '', len(source)))
+    return tokens
+
+
+class Frame:
+    """The samples of an evaluation, aligned on one time grid
+
+    Attributes
+    ----------
+    times : numpy.ndarray
+        seconds of every grid point since the first one
+
+    durations : numpy.ndarray
+        seconds each grid point lasts, up to the next point or the end of the
+        window
+    """
+    def __init__(self, samples, value_pv, names, end=None):
+        self.samples = samples
+        self.value_pv = value_pv
+        series = [samples[name][0] for name in names if name in samples]
+        if series:
+            grid = np.unique(np.concatenate(series))
+        else:
+            grid = np.zeros(0, dtype='datetime64[ns]')
+        self.grid = grid
+        self.origin = None
+        self.times = np.zeros(0)
+        self.durations = np.zeros(0)
+        if len(grid):
+            self.origin = grid[0]
+            self.times = self.seconds(grid)
+            stop = self.times[-1]
+            if end != None:
+                stop = max(stop, self.seconds(np.datetime64(end, 'ns')))
+            self.durations = np.diff(np.append(self.times, stop))
+        self._held = {}
+
+    def __len__(self):
+        return len(self.grid)
+
+    def seconds(self, times):
+        return (times - self.origin) / np.timedelta64(1, 's')
+
+    def hold(self, times, values):
+        """Sample a series on the grid, holding each value until the next
+        """
+        if not len(values):
+            return np.full(len(self), np.nan)
+        idx = np.searchsorted(times, self.grid, side='right') - 1
+        return np.where(idx >= 0, values[np.maximum(idx, 0)], np.nan)
+
+    def raw(self, name):
+        if name == None:
+            name = self.value_pv
+        times, values = self.samples.get(name, (np.zeros(0), np.zeros(0)))
+        return times, np.asarray(values, dtype=float)
+
+    def signal(self, name):
+        key = ('signal', name)
+        if key not in self._held:
+            self._held[key] = self.hold(*self.raw(name))
+        return self._held[key]
+
+    def rate(self, name):
+        key = ('rate', name)
+        if key not in self._held:
+            times, values = self.raw(name)
+            rates = np.full(len(values), np.nan)
+            if len(values) > 1:
+                elapsed = np.diff(self.seconds(times))
+                with np.errstate(all='ignore'):
+                    rates[1:] = np.where(
+                        elapsed > 0, np.diff(values) / elapsed, np.nan)
+            self._held[key] = self.hold(times, rates)
+        return self._held[key]
+
+
+class Node:
+    """Parsed element of an expression
+
+    Attributes
+    ----------
+    kind : str
+        'number' or 'condition'
+    """
+    kind = 'number'
+    children = ()
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def evaluate(self, frame, state):
+        raise NotImplementedError
+
+
+class Constant(Node):
+    def __init__(self, number):
+        self.number = number
+
+    def evaluate(self, frame, state):
+        return self.number
+
+
+class Signal(Node):
+    """``value`` (name None) or ``pv("name")``"""
+    def __init__(self, name=None):
+        self.name = name
+
+    def evaluate(self, frame, state):
+        return frame.signal(self.name)
+
+
+class Rate(Node):
+    def __init__(self, signal):
+        self.signal = signal
+        self.children = (signal,)
+
+    def evaluate(self, frame, state):
+        return frame.rate(self.signal.name)
+
+
+class Function(Node):
+    def __init__(self, name, args):
+        self.name = name
+        self.children = tuple(args)
+
+    def evaluate(self, frame, state):
+        args = [child.evaluate(frame, state) for child in self.children]
+        if self.name == 'abs':
+            return np.abs(args[0])
+        result = args[0]
+        for arg in args[1:]:
+            if self.name == 'min':
+                result = np.fmin(result, arg)
+            else:
+                result = np.fmax(result, arg)
+        return result
+
+
+class Arithmetic(Node):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.children = (left, right)
+
+    def evaluate(self, frame, state):
+        left, right = [child.evaluate(frame, state) for child in self.children]
+        if self.op == '+':
+            return left + right
+        elif self.op == '-':
+            return left - right
+        elif self.op == '*':
+            return left * right
+        return np.true_divide(left, right)
+
+
+class Negate(Node):
+    def __init__(self, operand):
+        self.children = (operand,)
+
+    def evaluate(self, frame, state):
+        return -self.children[0].evaluate(frame, state)
+
+
+class Compare(Node):
+    kind = 'condition'
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.children = (left, right)
+
+    @staticmethod
+    def apply(op, left, right):
+        if op == '==':
+            return left == right
+        elif op == '!=':
+            # a missing sample differs from nothing
+            return (left != right) & ~np.isnan(left) & ~np.isnan(right)
+        elif op == '<=':
+            return left <= right
+        elif op == '>=':
+            return left >= right
+        elif op == '<':
+            return left < right
+        return left > right
+
+    def evaluate(self, frame, state):
+        left, right = [child.evaluate(frame, state) for child in self.children]
+        return self.apply(self.op, left, right)
+
+
+class Range(Node):
+    kind = 'condition'
+
+    def __init__(self, operand, low, high, inside=True):
+        self.inside = inside
+        self.children = (operand, low, high)
+
+    def evaluate(self, frame, state):
+        operand, low, high = [
+            child.evaluate(frame, state) for child in self.children]
+        within = (operand >= low) & (operand <= high)
+        if self.inside:
+            return within
+        return (operand < low) | (operand > high)
+
+
+class Deadband(Node):
+    """Latching comparison, see the module documentation"""
+    kind = 'condition'
+
+    def __init__(self, compare, width, key):
+        self.compare = compare
+        self.width = width
+        self.key = key
+        self.children = (compare,)
+
+    def evaluate(self, frame, state):
+        left, right = [
+            child.evaluate(frame, state) for child in self.compare.children]
+        left = np.broadcast_to(left, (len(frame),))
+        trip = self.compare.apply(self.compare.op, left, right)
+        if self.compare.op in ('>', '>='):
+            clear = left < right - self.width
+        else:
+            clear = left > right + self.width
+        clear = np.broadcast_to(clear, (len(frame),))
+        # each point takes the state set by the last trip or clear sample
+        last = np.maximum.accumulate(
+            np.where(trip | clear, np.arange(len(frame)), -1))
+        latched = np.where(
+            last >= 0, trip[np.maximum(last, 0)], state.get(self.key, False))
+        if len(latched):
+            state[self.key] = bool(latched[-1])
+        return latched
+
+
+class Hold(Node):
+    """Condition that must hold for a number of seconds"""
+    kind = 'condition'
+
+    def __init__(self, condition, seconds):
+        self.seconds = seconds
+        self.children = (condition,)
+
+    def evaluate(self, frame, state):
+        held = np.broadcast_to(
+            self.children[0].evaluate(frame, state), (len(frame),))
+        points = np.arange(len(frame))
+        starts = held & ~np.concatenate(([False], held[:-1]))
+        run_start = np.maximum.accumulate(np.where(starts, points, 0))
+        run_end = frame.times + frame.durations
+        return held & (run_end - frame.times[run_start] >= self.seconds)
+
+
+class Logic(Node):
+    kind = 'condition'
+
+    def __init__(self, op, operands):
+        self.op = op
+        self.children = tuple(operands)
+
+    def evaluate(self, frame, state):
+        results = [child.evaluate(frame, state) for child in self.children]
+        combined = results[0]
+        for result in results[1:]:
+            if self.op == 'and':
+                combined = combined & result
+            else:
+                combined = combined | result
+        return combined
+
+
+class Not(Node):
+    kind = 'condition'
+
+    def __init__(self, condition):
+        self.children = (condition,)
+
+    def evaluate(self, frame, state):
+        return ~np.asarray(self.children[0].evaluate(frame, state), dtype=bool)
+
+
+class Parser:
+    """Recursive descent parser producing the Node tree of an expression
+
+    Note
+    ----
+        Intended for internal use only, see parse.
+
+    """
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.index = 0
+        self.latches = 0
+
+    @property
+    def token(self):
+        return self.tokens[self.index]
+
+    def error(self, message):
+        return ExpressionError(message, self.token[2])
+
+    def accept(self, text):
+        kind, token_text, _ = self.token
+        if kind in ('op', 'name') and token_text == text:
+            self.index = self.index + 1
+            return True
+        return False
+
+    def expect(self, text):
+        if not self.accept(text):
+            raise self.error("expected '{}'".format(text))
+
+    def require(self, node, kind):
+        if node.kind != kind:
+            raise self.error("expected a {} but found a {}".format(
+                kind, node.kind))
+        return node
+
+    def parse(self):
+        if self.token[0] == 'end':
+            raise self.error("empty expression")
+        node = self.require(self.disjunction(), 'condition')
+        if self.token[0] != 'end':
+            raise self.error("unexpected {!r}".format(self.token[1]))
+        return node
+
+    def disjunction(self):
+        operands = [self.conjunction()]
+        while self.accept('or'):
+            operands.append(self.conjunction())
+        if len(operands) == 1:
+            return operands[0]
+        for operand in operands:
+            self.require(operand, 'condition')
+        return Logic('or', operands)
+
+    def conjunction(self):
+        operands = [self.negation()]
+        while self.accept('and'):
+            operands.append(self.negation())
+        if len(operands) == 1:
+            return operands[0]
+        for operand in operands:
+            self.require(operand, 'condition')
+        return Logic('and', operands)
+
+    def negation(self):
+        if self.accept('not'):
+            return Not(self.require(self.negation(), 'condition'))
+        return self.test()
+
+    def test(self):
+        left = self.sum()
+        kind, text, _ = self.token
+        if kind == 'op' and text in COMPARE_OPERATORS:
+            self.index = self.index + 1
+            self.require(left, 'number')
+            node = Compare(text, left, self.require(self.sum(), 'number'))
+        elif self.accept('in'):
+            node = self.range(left, True)
+        elif text == 'not' and self.tokens[self.index + 1][1] == 'in':
+            self.index = self.index + 2
+            node = self.range(left, False)
+        else:
+            return left
+
+        if self.accept('deadband'):
+            if not isinstance(node, Compare) or node.op not in ORDERING_OPERATORS:
+                raise self.error("deadband needs a <, <=, > or >= comparison")
+            node = Deadband(node, self.constant(), self.latches)
+            self.latches = self.latches + 1
+        if self.accept('for'):
+            node = Hold(node, self.duration())
+        return node
+
+    def range(self, operand, inside):
+        self.require(operand, 'number')
+        self.expect('[')
+        low = self.require(self.sum(), 'number')
+        self.expect(',')
+        high = self.require(self.sum(), 'number')
+        self.expect(']')
+        return Range(operand, low, high, inside)
+
+    def constant(self):
+        kind, text, _ = self.token
+        if kind != 'number':
+            raise self.error("expected a number")
+        self.index = self.index + 1
+        return float(text)
+
+    def duration(self):
+        seconds = self.constant()
+        kind, text, _ = self.token
+        if kind == 'name' and text in DURATION_UNITS:
+            self.index = self.index + 1
+            seconds = seconds * DURATION_UNITS[text]
+        return seconds
+
+    def sum(self):
+        node = self.term()
+        while self.token[1] in ('+', '-') and self.token[0] == 'op':
+            op = self.token[1]
+            self.index = self.index + 1
+            self.require(node, 'number')
+            node = Arithmetic(op, node, self.require(self.term(), 'number'))
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.token[1] in ('*', '/') and self.token[0] == 'op':
+            op = self.token[1]
+            self.index = self.index + 1
+            self.require(node, 'number')
+            node = Arithmetic(op, node, self.require(self.unary(), 'number'))
+        return node
+
+    def unary(self):
+        if self.accept('-'):
+            return Negate(self.require(self.unary(), 'number'))
+        return self.atom()
+
+    def atom(self):
+        kind, text, _ = self.token
+        if kind == 'number':
+            self.index = self.index + 1
+            return Constant(float(text))
+        if self.accept('('):
+            node = self.disjunction()
+            self.expect(')')
+            return node
+        if self.accept('value'):
+            return Signal()
+        if self.accept('pv'):
+            self.expect('(')
+            kind, text, _ = self.token
+            if kind != 'string' or len(text) < 3:
+                raise self.error("pv() takes a quoted PV name")
+            self.index = self.index + 1
+            self.expect(')')
+            return Signal(text[1:-1].strip())
+        if kind == 'name' and text in FUNCTIONS:
+            self.index = self.index + 1
+            self.expect('(')
+            args = [self.require(self.sum(), 'number')]
+            while self.accept(','):
+                args.append(self.require(self.sum(), 'number'))
+            self.expect(')')
+            if text == 'rate':
+                if len(args) != 1 or not isinstance(args[0], Signal):
+                    raise self.error("rate() takes value or pv(...)")
+                return Rate(args[0])
+            if text == 'abs' and len(args) != 1:
+                raise self.error("abs() takes one argument")
+            return Function(text, args)
+        if kind == 'end':
+            raise self.error("unexpected end of expression")
+        if kind == 'name':
+            raise self.error("unknown name {!r}".format(text))
+        raise self.error("unexpected {!r}".format(text))
+
+
+class Expression:
+    """Compiled trigger expression
+
+    Attributes
+    ----------
+    source : str
+        the expression text
+
+    pvs : tuple of str
+        PV names referenced through pv("...")
+
+    uses_value : bool
+        whether the expression refers to ``value``
+    """
+    def __init__(self, source):
+        self.source = source
+        self.root = Parser(source).parse()
+        signals = [
+            node for node in self.root.walk() if isinstance(node, Signal)]
+        self.pvs = tuple(sorted({
+            node.name for node in signals if node.name != None}))
+        self.uses_value = any(node.name == None for node in signals)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.source)
+
+    def series(self, samples, value_pv=None, end=None, state=None):
+        """Evaluate the condition at every point of the time grid
+
+        Parameters
+        ----------
+        samples : dict
+            PV name to (times, values) arrays, times as datetime64
+
+        value_pv : str or None
+            the PV ``value`` stands for
+
+        end : datetime.datetime, numpy.datetime64 or None
+            end of the window, the last point lasts until then. Defaults to
+            the last sample.
+
+        state : dict or None
+            deadband latches, updated in place. Keep one dict per trigger and
+            value PV between scans.
+
+        Returns
+        -------
+        times : numpy.ndarray
+            datetime64 grid
+
+        held : numpy.ndarray
+            bool, the condition at each grid point
+        """
+        if state == None:
+            state = {}
+        names = set(self.pvs)
+        if self.uses_value:
+            names.add(value_pv)
+        frame = Frame(samples, value_pv, names, end)
+        if not len(frame):
+            return frame.grid, np.zeros(0, dtype=bool)
+        with np.errstate(all='ignore'):
+            held = self.root.evaluate(frame, state)
+        return frame.grid, np.broadcast_to(held, (len(frame),)).astype(bool)
+
+    def evaluate(self, samples, value_pv=None, end=None, state=None):
+        """Return whether the condition holds anywhere in the window
+
+        Takes the arguments of Expression.series.
+
+        Returns
+        -------
+        bool
+        """
+        return bool(self.series(samples, value_pv, end, state)[1].any())
+
+
+def parse(source):
+    """Compile a trigger expression
+
+    Parameters
+    ----------
+    source : str
+
+    Returns
+    -------
+    Expression
+
+    Raises
+    ------
+    ExpressionError
+    """
+    if source == None:
+        raise ExpressionError("empty expression")
+    return Expression(source)
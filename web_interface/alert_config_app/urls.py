@@ -17,5 +17,7 @@ urlpatterns = [
     url(r'^alert_config/(?P<pk>\d+)/$', views.alert_config.as_view(), name='alert_config'),
     url(r'^alert_create/$', views.alert_config.as_view(), name='alert_create'),
     url(r'^alert_delete/(?P<pk>\d+)/$', views.alert_delete,name='alert_delete'),
+    url(r'^alert_samples/(?P<pk>\d+)/$', views.alert_samples,name='alert_samples'),
+    url(r'^alert_acknowledge/(?P<pk>\d+)/$', views.alert_acknowledge,name='alert_acknowledge'),
 
 ]
@@ -7,14 +7,16 @@ from django.shortcuts import render, redirect
 
 from django.views import generic,View
 from django.views.generic import TemplateView
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.conf import settings
 from django.template.response import TemplateResponse
 from django.views.generic.edit import (CreateView, UpdateView, DeleteView)
 
 from account_mgr_app.models import Profile
 import account_mgr_app
-from .models import Alert, Pv, Trigger 
+from .models import Alert, AlertState, ConfigVersion, Pv, Trigger 
 from .forms import configAlert, configTrigger, deleteAlert, detailAlert, createPv
+from . import sample_cache
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
@@ -282,6 +284,7 @@ class alert_config(View):
                 'new_owners': initial_owners,
                 'new_subscribe': subscribed,
                 'new_lockout_duration':alert_inst.lockout_duration,    
+                'new_scan_class':alert_inst.scan_class,
             }
 
 
@@ -291,6 +294,7 @@ class alert_config(View):
                     'new_pv': l.value_src,
                     'new_value':l.value,
                     'new_compare':l.compare,
+                    'new_expression':l.expression,
                 } 
                 for l in alert_inst.trigger_set.all()
             ]
@@ -365,7 +369,14 @@ class alert_config(View):
                         'alert_detail',
                         kwargs={'pk':self.pk}))        
          
-        if form.is_valid():
+        # a trigger whose expression doesn't parse would be dropped below, so
+        # send the page back with the parser's message instead
+        expression_errors = any(
+            'new_expression' in single_trigger_form.errors
+            for single_trigger_form in triggerForm
+        )
+
+        if form.is_valid() and not expression_errors:
             
             # Set/Modify the alert's name 
             alert_inst.name = form.cleaned_data['new_name']
@@ -379,6 +390,10 @@ class alert_config(View):
             alert_inst.lockout_duration = form.cleaned_data[
                 'new_lockout_duration']
 
+            # Set/Modify how often the engine scans the alert
+            alert_inst.scan_class = (form.cleaned_data['new_scan_class']
+                or Alert.scan_class_default)
+
             # Set/Modify the alert's subscription relation with the user
             if ((form.cleaned_data['new_subscribe'])
                 and (request.user.profile not in alert_inst.subscriber.all())):
@@ -406,6 +421,8 @@ class alert_config(View):
                                 'new_compare'),
                             value = single_trigger_form.cleaned_data.get(
                                 'new_value'),
+                            expression = single_trigger_form.cleaned_data.get(
+                                'new_expression'),
                         )
                     )
             
@@ -414,7 +431,8 @@ class alert_config(View):
                 with transaction.atomic():
                     alert_inst.trigger_set.all().delete()
                     Trigger.objects.bulk_create(new_triggers)
-                    pass
+                    # bulk_create sends no post_save signals
+                    ConfigVersion.bump()
 
             except IntegrityError:
                 pass
@@ -482,3 +500,67 @@ def alert_delete(request,pk=None,*args,**kwargs):
         {'form':deleteForm,'alert':alert_inst},
     )
 
+
+@login_required()
+def alert_acknowledge(request, pk=None, *args, **kwargs):
+    """Acknowledge an alert on a post request by one of its owners or
+    subscribers, then return to the alert's page.
+
+    Attributes
+    ----------
+    request : django.http.HttpRequest
+
+    pk : int
+        Alert primary key
+
+    Returns
+    -------
+    django.http.HttpResponseRedirect
+    """
+    alert_inst = get_object_or_404(Alert, pk=pk)
+    profile = request.user.profile
+    allowed = (
+        alert_inst.owner.filter(pk=profile.pk).exists()
+        or alert_inst.subscriber.filter(pk=profile.pk).exists()
+    )
+    if request.method == "POST" and allowed:
+        state, _ = AlertState.objects.get_or_create(alert=alert_inst)
+        state.acknowledge()
+    return HttpResponseRedirect(reverse('alert_detail', kwargs={'pk': pk}))
+
+
+@login_required()
+def alert_samples(request, pk=None, *args, **kwargs):
+    """Return the recent samples of an alert's PVs as JSON.
+
+    The samples come from the cache the alerts engine fills after each scan,
+    so pages can show current values without querying the archiver.
+
+    Attributes
+    ----------
+    request : django.http.HttpRequest
+
+    pk : int
+        Alert primary key
+
+    Returns
+    -------
+    django.http.JsonResponse
+        {trigger name: {PV name: {'times': [...], 'values': [...]}}}
+    """
+    alert_inst = get_object_or_404(Alert, pk=pk)
+    response = {}
+    for trigger in alert_inst.trigger_set.all():
+        pv_names = [
+            name.strip() for name in (trigger.value_src or "").split(',')
+            if name.strip()
+        ]
+        found = sample_cache.read_pvs(settings.SAMPLE_CACHE_PATHS, pv_names)
+        response[trigger.name] = {
+            name: {
+                'times': [str(t) for t in times],
+                'values': values.tolist(),
+            }
+            for name, (times, values) in found.items()
+        }
+    return JsonResponse(response)
@@ -0,0 +1 @@
+SECRET_KEY = 'o13y^1hc&@n!o7n*h+)6#32d!lh(k&4w7cdmqch)=6h(x05b0('
\ No newline at end of file
@@ -280,3 +280,6 @@ else:
     LOGIN_URL = '/accounts/login'
 
 ACCOUNT_ACTIVATION_DAYS = 7
+
+# Sample cache files written by the alerts engine, see alert_engine.ini
+SAMPLE_CACHE_PATHS = '/dev/shm/ease_samples*'